@@ -0,0 +1,51 @@
+import json
+import sys
+
+import click
+
+from . import suite
+
+
+@click.group()
+def cli() -> None:  # pragma: no cover
+    pass
+
+
+@cli.command('run')
+@click.option('--scale', default=1, help='Multiplier of the generated data sizes')
+@click.option('--repeat', default=3, help='Number of runs of every benchmark, the best one is taken')
+@click.option('--only', multiple=True, help='Benchmark to run, may be repeated (all by default)')
+@click.option('--output', default=None, help='File to write the results to as json (stdout by default)')
+@click.option('--baseline', default=None, help='Results to compare with, regressions fail the command')
+@click.option('--threshold', default=0.1, help='Relative slowdown considered a regression')
+def run_benchmarks(scale: int, repeat: int, only: tuple[str, ...], output: str | None, baseline: str | None,
+                   threshold: float) -> None:
+    results = suite.run(scale, repeat, only or None)
+    if output is None:
+        click.echo(json.dumps(results, indent=2))
+    else:
+        with open(output, 'w') as out:
+            json.dump(results, out, indent=2)
+    if baseline is not None:
+        with open(baseline) as f:
+            _report(suite.compare(results, json.load(f), threshold))
+
+
+@cli.command('compare')
+@click.argument('current')
+@click.argument('baseline')
+@click.option('--threshold', default=0.1, help='Relative slowdown considered a regression')
+def compare_results(current: str, baseline: str, threshold: float) -> None:
+    with open(current) as current_file, open(baseline) as baseline_file:
+        _report(suite.compare(json.load(current_file), json.load(baseline_file), threshold))
+
+
+def _report(comparison: list[tuple[str, float, bool]]) -> None:
+    for name, ratio, regression in comparison:
+        click.echo(f'{name:<16} {ratio:6.2f}x{"  REGRESSION" if regression else ""}', err=True)
+    if any(regression for _, _, regression in comparison):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    cli()
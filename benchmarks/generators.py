@@ -0,0 +1,77 @@
+import datetime
+import random
+import typing as tp
+
+TRow = dict[str, tp.Any]
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'to', 'vi', 'de', 'po', 'an', 'el']
+PUNCTUATION = ['', '', '', ',', '.', '!', '?']
+
+
+def vocabulary(size: int, seed: int = 0) -> list[str]:
+    """Deterministic list of distinct words, the first ones are the most frequent in the generated texts"""
+    rnd = random.Random(seed)
+    words: dict[str, None] = {}
+    while len(words) < size:
+        words[''.join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(1, 4)))] = None
+    return list(words)
+
+
+def text_corpus(docs: int, words_per_doc: int = 50, vocabulary_size: int = 5000,
+                seed: int = 0) -> tp.Generator[TRow, None, None]:
+    """
+    Documents with Zipf-distributed words, mixed case and punctuation
+    :param docs: number of documents
+    :param words_per_doc: average number of words in a document
+    :param vocabulary_size: number of distinct words
+    :param seed: random seed, equal seeds give equal corpora
+    """
+    rnd = random.Random(seed)
+    words = vocabulary(vocabulary_size, seed)
+    weights = [1 / rank for rank in range(1, vocabulary_size + 1)]
+    for doc_id in range(docs):
+        count = rnd.randint(words_per_doc // 2, words_per_doc * 3 // 2)
+        text = ' '.join((word.capitalize() if rnd.random() < 0.1 else word) + rnd.choice(PUNCTUATION)
+                        for word in rnd.choices(words, weights, k=count))
+        yield {'doc_id': doc_id, 'text': text}
+
+
+def edge_lengths(edges: int, seed: int = 0) -> tp.Generator[TRow, None, None]:
+    """
+    Road graph edges around Moscow in the format of yandex_maps_graph input
+    :param edges: number of edges
+    :param seed: random seed
+    """
+    rnd = random.Random(seed)
+    for edge_id in range(edges):
+        lon, lat = 37.3 + rnd.random() * 0.6, 55.5 + rnd.random() * 0.4
+        yield {'edge_id': edge_id, 'start': [lon, lat],
+               'end': [lon + rnd.uniform(-0.005, 0.005), lat + rnd.uniform(-0.005, 0.005)]}
+
+
+def travel_times(records: int, edges: int, seed: int = 0) -> tp.Generator[TRow, None, None]:
+    """
+    Travel time log over the edges generated by edge_lengths, in the format of yandex_maps_graph input
+    :param records: number of log records
+    :param edges: number of edges the records refer to
+    :param seed: random seed
+    """
+    rnd = random.Random(seed)
+    epoch = datetime.datetime(2017, 10, 1)
+    for _ in range(records):
+        enter = epoch + datetime.timedelta(seconds=rnd.randrange(30 * 24 * 3600), microseconds=rnd.randrange(10 ** 6))
+        leave = enter + datetime.timedelta(seconds=rnd.uniform(1, 120))
+        yield {'edge_id': rnd.randrange(edges), 'enter_time': enter.strftime('%Y%m%dT%H%M%S.%f'),
+               'leave_time': leave.strftime('%Y%m%dT%H%M%S.%f')}
+
+
+def keyed_rows(rows: int, keys: int, seed: int = 0) -> tp.Generator[TRow, None, None]:
+    """
+    Rows with a random integer key and a value, for the operator benchmarks
+    :param rows: number of rows
+    :param keys: number of distinct keys
+    :param seed: random seed
+    """
+    rnd = random.Random(seed)
+    for index in range(rows):
+        yield {'key': rnd.randrange(keys), 'value': index}
@@ -0,0 +1,131 @@
+import platform
+import statistics
+import time
+import typing as tp
+from operator import itemgetter
+
+from compgraph import algorithms
+from compgraph import operations as ops
+from compgraph.external_sort import ExternalSort
+
+from . import generators
+
+TRow = dict[str, tp.Any]
+TSources = dict[str, list[TRow]]
+
+
+class Benchmark:
+    """Graph or operator timed on generated data"""
+
+    def __init__(self, name: str, prepare: tp.Callable[[int], TSources],
+                 run: tp.Callable[[TSources], tp.Iterable[TRow]]) -> None:
+        """
+        :param name: name of the benchmark in the results
+        :param prepare: scale -> input rows by source name (generated before timing)
+        :param run: input rows -> output rows
+        """
+        self.name = name
+        self.prepare = prepare
+        self.run = run
+
+
+def _copies(rows: list[TRow]) -> tp.Callable[[], tp.Iterator[TRow]]:
+    # operations modify the rows in place, every run gets fresh ones
+    return lambda: (dict(row) for row in rows)
+
+
+def _corpus(scale: int) -> TSources:
+    return {'texts': list(generators.text_corpus(200 * scale))}
+
+
+def _travels(scale: int) -> TSources:
+    edges = 100 * scale
+    return {'travel_time': list(generators.travel_times(1000 * scale, edges)),
+            'edge_length': list(generators.edge_lengths(edges))}
+
+
+def _keyed(scale: int) -> TSources:
+    return {'rows': sorted(generators.keyed_rows(10000 * scale, 1000 * scale), key=itemgetter('key'))}
+
+
+def _unsorted(scale: int) -> TSources:
+    return {'rows': list(generators.keyed_rows(10000 * scale, 1000 * scale))}
+
+
+def _graph(graph_factory: tp.Callable[..., tp.Any]) -> tp.Callable[[TSources], tp.Iterable[TRow]]:
+    def run(sources: TSources) -> tp.Iterable[TRow]:
+        return graph_factory().run(**{name: _copies(rows) for name, rows in sources.items()})
+    return run
+
+
+def _sort(sources: TSources) -> tp.Iterable[TRow]:
+    return ExternalSort(['key'])(_copies(sources['rows'])())
+
+
+def _join(sources: TSources) -> tp.Iterable[TRow]:
+    return ops.Join(ops.InnerJoiner(), ['key'])(_copies(sources['rows'])(), _copies(sources['rows'][::2])())
+
+
+def _reduce(sources: TSources) -> tp.Iterable[TRow]:
+    return ops.Reduce(ops.Count('count'), ['key'])(_copies(sources['rows'])())
+
+
+def _split(sources: TSources) -> tp.Iterable[TRow]:
+    return ops.Map(ops.Split('text'))(_copies(sources['texts'])())
+
+
+BENCHMARKS = [
+    Benchmark('word_count', _corpus, _graph(lambda: algorithms.word_count_graph('texts'))),
+    Benchmark('inverted_index', _corpus, _graph(lambda: algorithms.inverted_index_graph('texts'))),
+    Benchmark('pmi', _corpus, _graph(lambda: algorithms.pmi_graph('texts'))),
+    Benchmark('yandex_maps', _travels, _graph(lambda: algorithms.yandex_maps_graph('travel_time', 'edge_length'))),
+    Benchmark('external_sort', _unsorted, _sort),
+    Benchmark('join', _keyed, _join),
+    Benchmark('reduce', _keyed, _reduce),
+    Benchmark('split', _corpus, _split),
+]
+
+
+def run(scale: int = 1, repeat: int = 3, names: tp.Collection[str] | None = None) -> dict[str, tp.Any]:
+    """
+    Times the benchmarks, the best of the repeats is taken as the result
+    :param scale: multiplier of the generated data sizes
+    :param repeat: number of runs of every benchmark
+    :param names: benchmarks to run (all by default)
+    """
+    results = {}
+    for benchmark in BENCHMARKS:
+        if names is not None and benchmark.name not in names:
+            continue
+        sources = benchmark.prepare(scale)
+        rows_in = sum(len(rows) for rows in sources.values())
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            rows_out = sum(1 for _ in benchmark.run(sources))
+            timings.append(time.perf_counter() - start)
+        results[benchmark.name] = {
+            'rows_in': rows_in, 'rows_out': rows_out, 'seconds': min(timings), 'median_seconds':
+            statistics.median(timings), 'rows_per_second': rows_in / min(timings) if min(timings) else None,
+        }
+    return {'scale': scale, 'repeat': repeat, 'python': platform.python_version(), 'results': results}
+
+
+def compare(current: dict[str, tp.Any], baseline: dict[str, tp.Any],
+            threshold: float = 0.1) -> list[tuple[str, float, bool]]:
+    """
+    Compares the timings of the benchmarks present in both results
+    :param current: results of run
+    :param baseline: stored results of run (with the same scale)
+    :param threshold: relative slowdown considered a regression
+    :return: benchmark name, ratio of current to baseline time and whether it is a regression
+    """
+    if current['scale'] != baseline['scale']:
+        raise ValueError(f'Results of different scales can not be compared: {current["scale"]} and {baseline["scale"]}')
+    comparison = []
+    for name, result in current['results'].items():
+        if name not in baseline['results']:
+            continue
+        ratio = result['seconds'] / baseline['results'][name]['seconds']
+        comparison.append((name, ratio, ratio > 1 + threshold))
+    return comparison
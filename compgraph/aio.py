@@ -0,0 +1,90 @@
+import asyncio
+import os
+import typing as tp
+from concurrent.futures import ThreadPoolExecutor
+
+from . import operations as ops
+
+if tp.TYPE_CHECKING:  # pragma: no cover
+    from .graph import Graph
+
+BATCH_SIZE = 256
+
+
+async def _take_async(iterator: tp.AsyncIterator[ops.TRow], size: int) -> list[ops.TRow]:
+    batch = []
+    async for row in iterator:
+        batch.append(row)
+        if len(batch) >= size:
+            break
+    return batch
+
+
+def _take(iterator: tp.Iterator[ops.TRow], size: int) -> list[ops.TRow]:
+    batch = []
+    for row in iterator:
+        batch.append(row)
+        if len(batch) >= size:
+            break
+    return batch
+
+
+def is_source(value: tp.Any) -> bool:
+    return callable(value) or hasattr(value, '__aiter__')
+
+
+def sync_source(source: tp.Any, loop: asyncio.AbstractEventLoop) -> tp.Callable[[], ops.TRowsIterable]:
+    """
+    Adapts a data source for Graph.run running outside of the event loop thread
+    :param source: callable returning (async) iterable of rows, or async iterable of rows (read once)
+    :param loop: event loop to pull async iterables in
+    """
+    pid = os.getpid()
+    read = False
+
+    def rows() -> ops.TRowsGenerator:
+        nonlocal read
+        if not callable(source):
+            if read:
+                raise ValueError('An async iterable source can be read only once, pass a callable returning '
+                                 'a new async iterable to a graph reading the source several times')
+            read = True
+        iterable = source() if callable(source) else source
+        if not hasattr(iterable, '__aiter__'):
+            yield from iterable
+            return
+        if os.getpid() != pid:
+            # the forked process has a copy of the event loop, which never runs there
+            raise ValueError('Async sources can not be read by the processes of concurrent_branches, '
+                             'they are pulled in the event loop of arun')
+        iterator = aiter(iterable)
+        while True:
+            batch = asyncio.run_coroutine_threadsafe(_take_async(iterator, BATCH_SIZE), loop).result()
+            if not batch:
+                return
+            yield from batch
+
+    return rows
+
+
+async def arun(graph: 'Graph', kwargs: dict[str, tp.Any]) -> tp.AsyncGenerator[ops.TRow, None]:
+    """
+    Runs the graph in a separate thread, so that neither the operations nor waiting for the sorting
+    processes block the event loop; async sources are pulled in the event loop
+    :param graph: graph to run
+    :param kwargs: data sources (callables or async iterables) and Graph.run options
+    """
+    loop = asyncio.get_running_loop()
+    sources = {name: sync_source(value, loop) if is_source(value) else value for name, value in kwargs.items()}
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='compgraph')
+    rows = iter(graph.run(**sources))
+    try:
+        while True:
+            batch = await loop.run_in_executor(executor, _take, rows, BATCH_SIZE)
+            if not batch:
+                break
+            for row in batch:
+                yield row
+    finally:
+        await loop.run_in_executor(executor, getattr(rows, 'close', lambda: None))
+        executor.shutdown(wait=False)
@@ -7,17 +7,18 @@ from .graph import Graph
 
 
 def reader(input_stream_name: str, filename: str | None = None,
-           parser: Callable[[str], dict[str, tp.Any]] = json.loads) -> Graph:
+           parser: Callable[[str], dict[str, tp.Any]] = json.loads, workers: int = 1,
+           columns: tp.Sequence[str] | None = None) -> Graph:
     if filename is not None:
-        return Graph.graph_from_file(filename, lambda x: parser(x))
+        return Graph.graph_from_file(filename, parser, workers=workers, columns=columns)
     return Graph.graph_from_iter(input_stream_name)
 
 
 def word_count_graph(input_stream_name: str, text_column: str = 'text', count_column: str = 'count',
                      filename: str | None = None,
-                     parser: Callable[[str], dict[str, tp.Any]] = json.loads) -> Graph:
+                     parser: Callable[[str], dict[str, tp.Any]] = json.loads, read_workers: int = 1) -> Graph:
     """Constructs graph which counts words in text_column of all rows passed"""
-    reader_graph = reader(input_stream_name, filename, parser)
+    reader_graph = reader(input_stream_name, filename, parser, read_workers, [text_column])
 
     return reader_graph.copy() \
         .map(operations.FilterPunctuation(text_column)) \
@@ -30,9 +31,9 @@ def word_count_graph(input_stream_name: str, text_column: str = 'text', count_co
 
 def inverted_index_graph(input_stream_name: str, doc_column: str = 'doc_id', text_column: str = 'text',
                          result_column: str = 'tf_idf', filename: str | None = None,
-                         parser: Callable[[str], dict[str, tp.Any]] = json.loads) -> Graph:
+                         parser: Callable[[str], dict[str, tp.Any]] = json.loads, read_workers: int = 1) -> Graph:
     """Constructs graph which calculates td-idf for every word/document pair"""
-    reader_graph = reader(input_stream_name, filename, parser)
+    reader_graph = reader(input_stream_name, filename, parser, read_workers, [doc_column, text_column])
 
     split_graph = reader_graph.copy() \
         .map(operations.FilterPunctuation(text_column)) \
@@ -65,9 +66,9 @@ def inverted_index_graph(input_stream_name: str, doc_column: str = 'doc_id', tex
 
 def pmi_graph(input_stream_name: str, doc_column: str = 'doc_id', text_column: str = 'text',
               result_column: str = 'pmi', filename: str | None = None,
-              parser: Callable[[str], dict[str, tp.Any]] = json.loads) -> Graph:
+              parser: Callable[[str], dict[str, tp.Any]] = json.loads, read_workers: int = 1) -> Graph:
     """Constructs graph which gives for every document the top 10 words ranked by pointwise mutual information"""
-    reader_graph = reader(input_stream_name, filename, parser)
+    reader_graph = reader(input_stream_name, filename, parser, read_workers, [doc_column, text_column])
 
     split_graph = reader_graph \
         .map(operations.FilterPunctuation(text_column)) \
@@ -103,10 +104,12 @@ def yandex_maps_graph(input_stream_name_time: str, input_stream_name_length: str
                       weekday_result_column: str = 'weekday', hour_result_column: str = 'hour',
                       speed_result_column: str = 'speed', filename_time: str | None = None,
                       filename_length: str | None = None,
-                      parser: Callable[[str], dict[str, tp.Any]] = json.loads) -> Graph:
+                      parser: Callable[[str], dict[str, tp.Any]] = json.loads, read_workers: int = 1) -> Graph:
     """Constructs graph which measures average speed in km/h depending on the weekday and hour"""
-    time_reader_graph = reader(input_stream_name_time, filename_time, parser)
-    length_reader_graph = reader(input_stream_name_length, filename_length, parser)
+    time_reader_graph = reader(input_stream_name_time, filename_time, parser, read_workers,
+                               [edge_id_column, enter_time_column, leave_time_column])
+    length_reader_graph = reader(input_stream_name_length, filename_length, parser, read_workers,
+                                 [edge_id_column, start_coord_column, end_coord_column])
 
     time_graph = time_reader_graph \
         .map(operations.HourWeekday(enter_time_column, weekday_result_column, hour_result_column)) \
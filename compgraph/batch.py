@@ -0,0 +1,135 @@
+import re
+import typing as tp
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+TRow = dict[str, tp.Any]
+
+DEFAULT_BATCH_SIZE = 1024
+
+_ISO_BASIC = re.compile(r'\d{8}T\d{6}(\.\d{1,6})?')  # 20171020T112238.723000
+_ISO_EXTENDED = re.compile(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d{1,6})?')  # 2017-10-20T11:22:38.723000
+
+
+class RowBatch:
+    """Columnar batch of rows sharing the same set of columns"""
+
+    def __init__(self, columns: dict[str, tp.Any]) -> None:
+        """
+        :param columns: column name -> sequence of values (list or numpy array), all of the same length
+        """
+        self.columns = columns
+
+    @property
+    def schema(self) -> tuple[str, ...]:
+        return tuple(self.columns)
+
+    def __len__(self) -> int:
+        for values in self.columns.values():
+            return len(values)
+        return 0
+
+    @staticmethod
+    def from_rows(rows: list[TRow]) -> 'RowBatch':
+        """Rows should have the same columns (in the same order)"""
+        if not rows:
+            return RowBatch({})
+        schema = tuple(rows[0])
+        return RowBatch({column: list(values) for column, values in zip(schema, zip(*(row.values() for row in rows)))})
+
+    def rows(self) -> tp.Generator[TRow, None, None]:
+        schema = self.schema
+        lists = [values.tolist() if np is not None and isinstance(values, np.ndarray) else values
+                 for values in self.columns.values()]
+        for values in zip(*lists):
+            yield dict(zip(schema, values))
+
+    def with_column(self, column: str, values: tp.Any) -> 'RowBatch':
+        columns = dict(self.columns)
+        columns[column] = values
+        return RowBatch(columns)
+
+
+def to_batches(rows: tp.Iterable[TRow], size: int = DEFAULT_BATCH_SIZE) -> tp.Generator[RowBatch, None, None]:
+    """Groups consecutive rows with the same columns into batches of at most size rows"""
+    buffer: list[TRow] = []
+    schema: tuple[str, ...] | None = None
+    for row in rows:
+        row_schema = tuple(row)
+        if buffer and (row_schema != schema or len(buffer) >= size):
+            yield RowBatch.from_rows(buffer)
+            buffer = []
+        schema = row_schema
+        buffer.append(row)
+    if buffer:
+        yield RowBatch.from_rows(buffer)
+
+
+def from_batches(batches: tp.Iterable[RowBatch]) -> tp.Generator[TRow, None, None]:
+    for batch in batches:
+        yield from batch.rows()
+
+
+def numeric_columns(batch: RowBatch, columns: tp.Sequence[str]) -> list[tp.Any] | None:
+    """Columns of the batch as numeric numpy arrays, None if numpy is not available or some column is not numeric"""
+    if np is None:
+        return None
+    arrays = [np.asarray(batch.columns[column]) for column in columns]
+    if any(array.dtype.kind not in 'biuf' for array in arrays):
+        return None
+    return arrays
+
+
+def exact_integers(array: tp.Any) -> tp.Any:
+    """Integer array as an array of python ints, so that products and sums of it do not overflow"""
+    return array.astype(object) if array.dtype.kind in 'biu' else array
+
+
+def datetime_column(batch: RowBatch, column: str) -> tp.Any:
+    """
+    Column of ISO 8601 datetimes without a timezone as a numpy datetime64 array, None if numpy is not available
+    or some value is not such a datetime
+    """
+    if np is None:
+        return None
+    values = []
+    for value in batch.columns[column]:
+        if not isinstance(value, str):
+            return None
+        if _ISO_BASIC.fullmatch(value):
+            value = f'{value[:4]}-{value[4:6]}-{value[6:11]}:{value[11:13]}:{value[13:]}'
+        elif not _ISO_EXTENDED.fullmatch(value):
+            return None
+        values.append(value)
+    return np.array(values, dtype='datetime64[us]')
+
+
+def as_list(values: tp.Any) -> list[tp.Any]:
+    return values.tolist() if np is not None and isinstance(values, np.ndarray) else list(values)
+
+
+def segment_starts(batch: RowBatch, keys: tp.Sequence[str]) -> list[int]:
+    """Indices of the rows starting a new group of equal keys (the batch should be sorted by keys)"""
+    if not keys or not len(batch):
+        return [0] if len(batch) else []
+    key_values = list(zip(*(as_list(batch.columns[key]) for key in keys)))
+    return [0] + [index for index in range(1, len(key_values)) if key_values[index] != key_values[index - 1]]
+
+
+class BatchList:
+    """Re-iterable sequence of rows stored as columnar batches"""
+
+    def __init__(self, batches: list[RowBatch]) -> None:
+        self.batches = batches
+
+    def __iter__(self) -> tp.Iterator[TRow]:
+        return from_batches(self.batches)
+
+    def __len__(self) -> int:
+        return sum(len(batch) for batch in self.batches)
+
+
+COLUMNAR_GROUP_SIZE = 64  # rows of a group buffered under a memory budget before it is stored as columnar batches
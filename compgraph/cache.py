@@ -0,0 +1,128 @@
+import os
+import time
+import typing as tp
+
+from . import operations as ops
+from . import checkpoint as ckpt
+from . import rowfile
+
+if tp.TYPE_CHECKING:  # pragma: no cover
+    from .graph import Graph
+
+SUFFIX = '.rows'
+
+
+class ResultCache:
+    """
+    Content addressed cache of node results on disk: a result is identified by the plan of the graph computing it
+    and by its inputs, the least recently used results are evicted once the cache is larger than its size limit
+    """
+
+    def __init__(self, directory: str, max_size: int, hash_files: bool = False) -> None:
+        """
+        :param directory: directory to keep the results in
+        :param max_size: limit of the total size of the results in bytes
+        :param hash_files: identify the input files by their contents instead of their size and modification time
+        """
+        if max_size <= 0:
+            raise ValueError('Cache size should be positive')
+        self.directory = directory
+        self.max_size = max_size
+        self.hash_files = hash_files
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, graph: 'Graph', kwargs: dict[str, tp.Any]) -> str:
+        """Identity of the result of the graph over the given data sources"""
+        return ckpt.plan_digest(graph)[:32] + ckpt.input_digest(graph, kwargs, self.hash_files)[:32]
+
+    def _filename(self, key: str) -> str:
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def get(self, key: str) -> ops.TRowsGenerator | None:
+        """Rows of the result, None if it is not cached"""
+        filename = self._filename(key)
+        try:
+            # the file is opened right away, so that the result may be evicted while it is read
+            rows = rowfile.read_stream(open(filename, 'rb'))
+            self._touch(filename)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return rows
+
+    @staticmethod
+    def _touch(filename: str) -> None:
+        # the modification time orders the results by their last use, it is set explicitly
+        # as the file system clock may be too coarse to order the uses close in time
+        now = time.time_ns()
+        os.utime(filename, ns=(now, now))
+
+    def put(self, key: str, rows: ops.TRowsIterable) -> ops.TRowsGenerator:
+        """Caches the rows passing through, the result is stored once all of them are read"""
+        yield from rowfile.write_file(rows, self._filename(key))
+        self._touch(self._filename(key))
+        self.evict(keep=key)
+
+    def entries(self) -> list[tuple[str, os.stat_result]]:
+        """Keys and file statuses of the cached results, the least recently used first"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(SUFFIX):
+                try:
+                    entries.append((entry.name[:-len(SUFFIX)], entry.stat()))
+                except FileNotFoundError:  # evicted by another run
+                    pass
+        return sorted(entries, key=lambda entry: entry[1].st_mtime_ns)
+
+    def size(self) -> int:
+        return sum(status.st_size for _, status in self.entries())
+
+    def evict(self, keep: str | None = None) -> None:
+        """
+        Removes the least recently used results until the cache fits its size limit
+        :param keep: key of the result to keep even if it alone does not fit
+        """
+        entries = self.entries()
+        size = sum(status.st_size for _, status in entries)
+        for key, status in entries:
+            if size <= self.max_size:
+                break
+            if key == keep:
+                continue
+            try:
+                os.unlink(self._filename(key))
+            except FileNotFoundError:  # evicted by another run
+                pass
+            size -= status.st_size
+
+
+class Cached(ops.Operation):
+    """Streams the result of the upstream graph from the cache, computing and caching it on a miss"""
+
+    def __init__(self, cache: ResultCache, upstream: 'Graph') -> None:
+        """
+        :param cache: cache to keep the result in
+        :param upstream: graph computing the rows
+        """
+        self.cache = cache
+        self._upstream = upstream
+
+    def __call__(self, rows: ops.TRowsIterable, *args: tp.Any, dry: bool = False,
+                 **kwargs: tp.Any) -> ops.TRowsGenerator:
+        """
+        :param rows: upstream rows
+        :param dry: pass the upstream rows through, neither reading nor writing the cache (used by Graph.explain)
+        :param kwargs: data sources, identify the result together with the plan
+        """
+        if dry:
+            yield from rows
+            return
+        key = self.cache.key(self._upstream, kwargs)
+        cached = self.cache.get(key)
+        if cached is not None:
+            yield from cached
+        else:
+            yield from self.cache.put(key, rows)
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import re
+import types
+import typing as tp
+
+from . import operations as ops
+from . import rowfile
+from . import sharing
+
+if tp.TYPE_CHECKING:  # pragma: no cover
+    from .graph import Graph
+
+HASH_BLOCK_SIZE = 1 << 20
+ROWS_FILE = 'rows'
+MANIFEST_FILE = 'manifest.json'  # written once the rows are complete, marks the checkpoint as valid
+
+_ADDRESS = re.compile(r' at 0x[0-9a-fA-F]+')
+
+
+def _code_identity(code: types.CodeType) -> tp.Hashable:
+    constants = tuple(_code_identity(constant) if isinstance(constant, types.CodeType) else repr(constant)
+                      for constant in code.co_consts)
+    return code.co_code, constants, code.co_names
+
+
+def stable_identity(value: tp.Any) -> tp.Hashable:
+    """
+    Identity of an object without public state that stays the same between the processes: functions are
+    identified by their code and the values they capture, other objects by their type and representation
+    """
+    if isinstance(value, types.MethodType):
+        return stable_identity(value.__self__), stable_identity(value.__func__)
+    if isinstance(value, types.FunctionType):
+        captured = tuple(cell.cell_contents for cell in value.__closure__ or ())
+        return (value.__module__, value.__qualname__, _code_identity(value.__code__),
+                sharing.fingerprint([captured, value.__defaults__], identify=stable_identity))
+    if callable(value) and hasattr(value, '__qualname__'):
+        return getattr(value, '__module__', None), value.__qualname__
+    return type(value).__module__, type(value).__qualname__, _ADDRESS.sub('', repr(value))
+
+
+def plan_digest(graph: 'Graph') -> str:
+    """Digest of the structure of the graph, equal in every process (and run) for the same graph"""
+    return hashlib.sha256(repr(sharing.fingerprint(graph, identify=stable_identity)).encode()).hexdigest()
+
+
+def sources(graph: 'Graph') -> tp.Generator[ops.Operation, None, None]:
+    """Source operations of the graph (repeated as many times as they are read)"""
+    if not graph._parents:
+        yield graph._operation
+    for parent in graph._parents:
+        yield from sources(parent)
+
+
+def source_digest(source: ops.Operation, kwargs: dict[str, tp.Any], hash_files: bool = False) -> bytes:
+    """
+    Digest of the data a source reads: a file by its path, size and modification time (or by its contents),
+    a data source by its rows (so it is read once more)
+    :param source: Read, ReadRowFile, ReadCsv or ReadIterGenerator operation
+    :param kwargs: data sources
+    :param hash_files: identify the file by its contents
+    """
+    digest = hashlib.sha256()
+    if isinstance(source, (ops.Read, ops.ReadRowFile, ops.ReadCsv)) and hash_files:
+        with open(source.filename, 'rb') as f:
+            while block := f.read(HASH_BLOCK_SIZE):
+                digest.update(block)
+    elif isinstance(source, (ops.Read, ops.ReadRowFile, ops.ReadCsv)):
+        status = os.stat(source.filename)
+        digest.update(repr((os.path.abspath(source.filename), status.st_size, status.st_mtime_ns)).encode())
+    elif isinstance(source, ops.ReadIterGenerator):
+        digest.update(source.name.encode())
+        for row in kwargs[source.name]():
+            digest.update(repr(row).encode())
+    return digest.digest()
+
+
+def input_digest(graph: 'Graph', kwargs: dict[str, tp.Any], hash_files: bool = False) -> str:
+    """
+    Digest of the data the graph reads, see source_digest
+    :param graph: graph reading the data
+    :param kwargs: data sources
+    :param hash_files: identify the files by their contents
+    """
+    digest = hashlib.sha256()
+    for source in sources(graph):
+        digest.update(source_digest(source, kwargs, hash_files))
+    return digest.hexdigest()
+
+
+class Checkpoint(ops.Operation):
+    """
+    Persists the rows passing through it to a directory; later runs of the same plan over the same inputs
+    read the rows back instead of computing the upstream graph, see Graph.checkpoint
+    """
+
+    def __init__(self, path: str, upstream: 'Graph') -> None:
+        """
+        :param path: directory of the checkpoint
+        :param upstream: graph computing the rows, identifies the checkpoint together with its inputs
+        """
+        self.path = path
+        self._upstream = upstream
+
+    def key(self, kwargs: dict[str, tp.Any]) -> str:
+        return f'{plan_digest(self._upstream)}:{input_digest(self._upstream, kwargs)}'
+
+    def is_valid(self, key: str) -> bool:
+        try:
+            with open(os.path.join(self.path, MANIFEST_FILE)) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return False
+        return manifest.get('key') == key and os.path.exists(os.path.join(self.path, ROWS_FILE))
+
+    def __call__(self, rows: ops.TRowsIterable, *args: tp.Any, dry: bool = False,
+                 **kwargs: tp.Any) -> ops.TRowsGenerator:
+        """
+        :param rows: upstream rows
+        :param dry: pass the upstream rows through, neither reading nor writing the checkpoint (used by Graph.explain)
+        :param kwargs: data sources, identify the checkpoint together with the plan
+        """
+        if dry:
+            yield from rows
+            return
+        key = self.key(kwargs)
+        if self.is_valid(key):
+            # the upstream rows are not iterated, so nothing before the checkpoint is computed
+            yield from rowfile.read_stream(open(os.path.join(self.path, ROWS_FILE), 'rb'))
+            return
+        os.makedirs(self.path, exist_ok=True)
+        try:
+            os.unlink(os.path.join(self.path, MANIFEST_FILE))
+        except FileNotFoundError:
+            pass
+        count = yield from rowfile.write_file(rows, os.path.join(self.path, ROWS_FILE))
+        temporary = os.path.join(self.path, f'.{MANIFEST_FILE}.{os.getpid()}.{id(self)}')
+        with open(temporary, 'w') as f:
+            json.dump({'key': key, 'rows': count}, f)
+        os.replace(temporary, os.path.join(self.path, MANIFEST_FILE))
@@ -0,0 +1,210 @@
+import calendar
+import math
+import re
+import typing as tp
+
+import dateutil.parser
+
+from . import operations as ops
+
+TEmitter = tp.Callable[[tp.Any, '_Writer', str], str | None]
+
+
+class _Writer:
+    """Accumulates the body of the generated function"""
+
+    def __init__(self) -> None:
+        self.lines: list[str] = []
+        self.indent = 2
+        self.constants: list[tp.Any] = []
+        self._variables = 0
+
+    def line(self, text: str) -> None:
+        self.lines.append('    ' * self.indent + text)
+
+    def block(self, text: str) -> None:
+        self.line(text)
+        self.indent += 1
+
+    def constant(self, value: tp.Any) -> str:
+        self.constants.append(value)
+        return f'_c{len(self.constants) - 1}'
+
+    def variable(self, prefix: str) -> str:
+        self._variables += 1
+        return f'{prefix}{self._variables}'
+
+
+# Each emitter writes the code of one mapper applied to the row in variable `row`
+# and returns the variable holding the resulting row (None if the mapper can not be compiled)
+
+
+def _emit_dummy(mapper: ops.DummyMapper, writer: _Writer, row: str) -> str | None:
+    return row
+
+
+def _emit_filter_punctuation(mapper: ops.FilterPunctuation, writer: _Writer, row: str) -> str | None:
+    column = repr(mapper.column)
+    writer.line(f'{row}[{column}] = {row}[{column}].translate({writer.constant(mapper.maketrans)})')
+    return row
+
+
+def _emit_lower_case(mapper: ops.LowerCase, writer: _Writer, row: str) -> str | None:
+    column = repr(mapper.column)
+    writer.line(f'{row}[{column}] = {row}[{column}].lower()')
+    return row
+
+
+def _emit_split(mapper: ops.Split, writer: _Writer, row: str) -> str | None:
+    column = repr(mapper.column)
+    part, value, new_row = writer.variable('part'), writer.variable('value'), writer.variable('row')
+    writer.block(f'for {part} in {writer.constant(re.compile(mapper.split_regex).finditer)}({row}[{column}]):')
+    writer.line(f'{value} = {part}.group().strip()')
+    writer.block(f'if {value}:')
+    writer.line(f'{new_row} = {row}.copy()')
+    writer.line(f'{new_row}[{column}] = {value}')
+    return new_row
+
+
+def _emit_product(mapper: ops.Product, writer: _Writer, row: str) -> str | None:
+    if mapper.result_column in mapper.columns:
+        return None
+    factors = ''.join(f' * {row}[{column!r}]' for column in mapper.columns)
+    writer.line(f'{row}[{mapper.result_column!r}] = 1{factors}')
+    return row
+
+
+def _emit_divide(mapper: ops.Divide, writer: _Writer, row: str) -> str | None:
+    writer.block('try:')
+    writer.line(f'{row}[{mapper.result_column!r}] = {row}[{mapper.column_numerator!r}] '
+                f'/ {row}[{mapper.column_denominator!r}]')
+    writer.indent -= 1
+    writer.block('except ZeroDivisionError:')
+    writer.line("raise ValueError('Denominator column contains zero value')")
+    writer.indent -= 1
+    return row
+
+
+def _emit_filter(mapper: ops.Filter, writer: _Writer, row: str) -> str | None:
+    writer.block(f'if {writer.constant(mapper.condition)}({row}):')
+    return row
+
+
+def _emit_project(mapper: ops.Project, writer: _Writer, row: str) -> str | None:
+    new_row = writer.variable('row')
+    items = ', '.join(f'{column!r}: {row}[{column!r}]' for column in mapper.columns)
+    writer.line(f'{new_row} = {{{items}}}')
+    return new_row
+
+
+def _emit_log_transform(mapper: ops.LogTransform, writer: _Writer, row: str) -> str | None:
+    writer.line(f'{row}[{mapper.result_column!r}] = log({row}[{mapper.column_numerator!r}]) '
+                f'- log({row}[{mapper.column_denominator!r}])')
+    return row
+
+
+def _emit_longer_than_n(mapper: ops.LongerThanN, writer: _Writer, row: str) -> str | None:
+    writer.block(f'if len({row}[{mapper.column!r}]) > {writer.constant(mapper.n)}:')
+    return row
+
+
+def _emit_at_least_n_times(mapper: ops.AtLeastNTimes, writer: _Writer, row: str) -> str | None:
+    writer.block(f'if {row}[{mapper.column!r}] >= {writer.constant(mapper.n)}:')
+    return row
+
+
+def _emit_haversine(mapper: ops.Haversine, writer: _Writer, row: str) -> str | None:
+    lon1, lat1, lon2, lat2 = (writer.variable(name) for name in ('lon', 'lat', 'lon', 'lat'))
+    writer.line(f'{lon1}, {lat1} = {row}[{mapper.first_point!r}]')
+    writer.line(f'{lon2}, {lat2} = {row}[{mapper.second_point!r}]')
+    writer.line(f'{lon1}, {lat1}, {lon2}, {lat2} = radians({lon1}), radians({lat1}), radians({lon2}), radians({lat2})')
+    writer.line(f'{row}[{mapper.column!r}] = 2 * asin(sqrt(sin(({lat2} - {lat1}) / 2) ** 2 + cos({lat1}) * cos({lat2}) '
+                f'* sin(({lon2} - {lon1}) / 2) ** 2)) * {writer.constant(mapper.EARTH_RADIUS_KM)}')
+    return row
+
+
+def _emit_hour_weekday(mapper: ops.HourWeekday, writer: _Writer, row: str) -> str | None:
+    dt = writer.variable('dt')
+    writer.line(f'{dt} = isoparse({row}[{mapper.column!r}])')
+    writer.line(f'{row}[{mapper.weekday_column!r}] = day_abbr[{dt}.weekday()]')
+    writer.line(f'{row}[{mapper.hour_column!r}] = {dt}.hour')
+    return row
+
+
+def _emit_time_diff(mapper: ops.TimeDiff, writer: _Writer, row: str) -> str | None:
+    writer.line(f'{row}[{mapper.column!r}] = (isoparse({row}[{mapper.end_time!r}]) '
+                f'- isoparse({row}[{mapper.start_time!r}])).total_seconds() / 3600')
+    return row
+
+
+EMITTERS: dict[type[ops.Mapper], TEmitter] = {
+    ops.DummyMapper: _emit_dummy,
+    ops.FilterPunctuation: _emit_filter_punctuation,
+    ops.LowerCase: _emit_lower_case,
+    ops.Split: _emit_split,
+    ops.Product: _emit_product,
+    ops.Divide: _emit_divide,
+    ops.Filter: _emit_filter,
+    ops.Project: _emit_project,
+    ops.LogTransform: _emit_log_transform,
+    ops.LongerThanN: _emit_longer_than_n,
+    ops.AtLeastNTimes: _emit_at_least_n_times,
+    ops.Haversine: _emit_haversine,
+    ops.HourWeekday: _emit_hour_weekday,
+    ops.TimeDiff: _emit_time_diff,
+}
+
+GLOBALS: dict[str, tp.Any] = {
+    'log': math.log, 'radians': math.radians, 'asin': math.asin, 'sqrt': math.sqrt, 'sin': math.sin,
+    'cos': math.cos, 'isoparse': dateutil.parser.isoparse, 'day_abbr': calendar.day_abbr,
+}
+
+# generated source -> factory binding the constants of the plan into the fused function
+_factories: dict[str, tp.Callable[..., tp.Callable[[ops.TRowsIterable], ops.TRowsGenerator]]] = {}
+
+
+def can_compile(mapper: ops.Mapper) -> bool:
+    """Only the built-in mappers themselves are compiled, subclasses may override their behaviour"""
+    return type(mapper) in EMITTERS and generate([mapper]) is not None
+
+
+def generate(mappers: tp.Sequence[ops.Mapper]) -> tuple[str, list[tp.Any]] | None:
+    """
+    Source of the function applying the chain of mappers to the rows and the constants it is parametrized with
+    :param mappers: mappers in the order of application
+    """
+    writer = _Writer()
+    writer.block('for row in rows:')
+    row: str | None = 'row'
+    for mapper in mappers:
+        emitter = EMITTERS.get(type(mapper))
+        row = emitter(mapper, writer, row) if emitter is not None and row is not None else None
+        if row is None:
+            return None
+    writer.line(f'yield {row}')
+    arguments = ', '.join(f'_c{index}' for index in range(len(writer.constants)))
+    source = '\n'.join([f'def _factory({arguments}):', '    def fused(rows):'] + writer.lines + ['    return fused'])
+    return source + '\n', writer.constants
+
+
+class CompiledMap(ops.Operation):
+    """Chain of maps executed by a generated function, see Graph.compile"""
+
+    def __init__(self, mappers: tp.Sequence[ops.Mapper]) -> None:
+        """
+        :param mappers: mappers in the order of application, all of them should pass can_compile
+        """
+        generated = generate(mappers)
+        if generated is None:
+            raise ValueError('Mappers can not be compiled')
+        self.mappers = list(mappers)
+        self.source, constants = generated
+        factory = _factories.get(self.source)
+        if factory is None:
+            namespace = dict(GLOBALS)
+            exec(compile(self.source, '<compgraph.codegen>', 'exec'), namespace)
+            factory = _factories.setdefault(self.source, namespace['_factory'])
+        self._function = factory(*constants)
+
+    def __call__(self, rows: ops.TRowsIterable, *args: tp.Any, **kwargs: tp.Any) -> ops.TRowsGenerator:
+        yield from self._function(rows)
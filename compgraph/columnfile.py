@@ -0,0 +1,216 @@
+import os
+import pickle
+import struct
+import tempfile
+import typing as tp
+import zlib
+
+from .batch import TRow
+from . import rowfile
+
+MAGIC = b'CGCF'
+VERSION = 1
+ROW_GROUP_SIZE = 16384  # rows of a row group, the unit of skipping
+
+_HEADER = struct.Struct('<4sH')  # magic and version
+_FOOTER = struct.Struct('<Q4s')  # offset of the metadata and the magic
+
+TRange = tuple[tp.Any, tp.Any]  # inclusive bounds of a column, None for an open side
+
+
+class ColumnChunk(tp.NamedTuple):
+    """Location of the values of a column in a row group, with their statistics"""
+    offset: int
+    length: int
+    min: tp.Any  # of the values other than None, None if they are not comparable (or there are none)
+    max: tp.Any
+    nulls: int  # rows having None or no value
+
+
+class RowGroup(tp.NamedTuple):
+    rows: int
+    chunks: dict[str, ColumnChunk]
+
+
+class _Missing:
+    """Stands for the value of a column absent from a row"""
+
+    def __reduce__(self) -> str:
+        return 'MISSING'
+
+
+MISSING = _Missing()
+
+
+def _statistics(values: list[tp.Any]) -> tuple[tp.Any, tp.Any, int]:
+    present = [value for value in values if value is not None and value is not MISSING]
+    try:
+        return (min(present), max(present), len(values) - len(present)) if present else (None, None, len(values))
+    except TypeError:
+        return None, None, len(values) - len(present)
+
+
+def _write_group(f: tp.BinaryIO, rows: list[TRow], columns: dict[str, None]) -> RowGroup:
+    """Writes the chunks of the row group, adding its new columns to the columns of the file"""
+    columns.update(dict.fromkeys(column for row in rows for column in row))
+    chunks = {}
+    for column in columns:
+        values = [row.get(column, MISSING) for row in rows]
+        data = zlib.compress(pickle.dumps(values, pickle.HIGHEST_PROTOCOL), 1)
+        chunks[column] = ColumnChunk(f.tell(), len(data), *_statistics(values))
+        f.write(data)
+    return RowGroup(len(rows), chunks)
+
+
+def write_stream(rows: tp.Iterable[TRow], f: tp.BinaryIO,
+                 group_size: int | None = None) -> tp.Generator[TRow, None, int]:
+    """
+    Writes the rows passing through to the file: a header, the row groups with a chunk of values per column,
+    and the metadata with the statistics of the chunks
+    :param rows: rows to write
+    :param f: binary file at position 0
+    :param group_size: rows of a row group, ROW_GROUP_SIZE by default
+    :return: number of rows
+    """
+    f.write(_HEADER.pack(MAGIC, VERSION))
+    columns: dict[str, None] = {}  # in the order of their first appearance
+    groups: list[RowGroup] = []
+    group: list[TRow] = []
+    for row in rows:
+        group.append(row)
+        if len(group) == (group_size or ROW_GROUP_SIZE):
+            groups.append(_write_group(f, group, columns))
+            yield from group
+            group = []
+    if group:
+        groups.append(_write_group(f, group, columns))
+        yield from group
+    metadata_offset = f.tell()
+    metadata = {'columns': list(columns),
+                'groups': [(group.rows, {column: tuple(chunk) for column, chunk in group.chunks.items()})
+                           for group in groups]}
+    f.write(pickle.dumps(metadata, pickle.HIGHEST_PROTOCOL))
+    f.write(_FOOTER.pack(metadata_offset, MAGIC))
+    return sum(group.rows for group in groups)
+
+
+def is_column_file(filename: str) -> bool:
+    with open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class ColumnFile:
+    """Reader of a column file, reading only the chunks of the requested columns"""
+
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            magic, version = _HEADER.unpack(f.read(_HEADER.size))
+            size = f.seek(0, os.SEEK_END)
+            if magic != MAGIC or version != VERSION or size < _HEADER.size + _FOOTER.size:
+                raise ValueError(f'{filename} is not a column file')
+            f.seek(size - _FOOTER.size)
+            metadata_offset, footer_magic = _FOOTER.unpack(f.read(_FOOTER.size))
+            if footer_magic != MAGIC:
+                raise ValueError(f'Writing of {filename} was not completed')
+            f.seek(metadata_offset)
+            metadata = pickle.loads(f.read(size - _FOOTER.size - metadata_offset))
+        self.columns: list[str] = metadata['columns']
+        # chunks of the columns that first appear in a later row group are absent from the earlier ones
+        self.groups = [RowGroup(rows, {column: ColumnChunk(*chunk) for column, chunk in chunks.items()})
+                       for rows, chunks in metadata['groups']]
+
+    @property
+    def rows(self) -> int:
+        return sum(group.rows for group in self.groups)
+
+    @staticmethod
+    def may_match(group: RowGroup, where: dict[str, TRange]) -> bool:
+        """Whether the statistics of the row group leave a chance for a row to have the values in the ranges"""
+        for column, (low, high) in where.items():
+            chunk = group.chunks.get(column)
+            if chunk is None or chunk.nulls == group.rows:
+                return False
+            if chunk.min is None:  # not comparable values, the rows are checked one by one
+                continue
+            if (low is not None and chunk.max < low) or (high is not None and chunk.min > high):
+                return False
+        return True
+
+    def read(self, columns: tp.Sequence[str] | None = None, where: dict[str, TRange] | None = None,
+             part: int = 0, parts: int = 1) -> tp.Generator[TRow, None, None]:
+        """
+        Rows of the file
+        :param columns: columns to read, all of them by default; missing values are absent from the rows
+        :param where: inclusive ranges of the values of the columns to keep the rows within, row groups whose
+            statistics rule the ranges out are not read
+        :param part: with parts, read the row groups with the index equal to part modulo parts
+        :param parts: number of parts the row groups are split into
+        """
+        where = where or {}
+        names = list(columns) if columns is not None else self.columns
+        needed = list(dict.fromkeys([*names, *where]))
+        with open(self.filename, 'rb') as f:
+            for group in self.groups[part::parts]:
+                if not self.may_match(group, where):
+                    continue
+                values = {}
+                for column in needed:
+                    chunk = group.chunks.get(column)
+                    if chunk is None:
+                        values[column] = [MISSING] * group.rows
+                    else:
+                        f.seek(chunk.offset)
+                        values[column] = pickle.loads(zlib.decompress(f.read(chunk.length)))
+                checks = [(values[column], low, high) for column, (low, high) in where.items()]
+                rows = zip(*(values[column] for column in names)) if names else [()] * group.rows
+                for index, row in enumerate(rows):
+                    if checks and not all(_within(column_values[index], low, high)
+                                          for column_values, low, high in checks):
+                        continue
+                    yield {column: value for column, value in zip(names, row) if value is not MISSING}
+
+
+def _within(value: tp.Any, low: tp.Any, high: tp.Any) -> bool:
+    if value is None or value is MISSING:
+        return False
+    return (low is None or low <= value) and (high is None or value <= high)
+
+
+def write_file(rows: tp.Iterable[TRow], filename: str,
+               group_size: int | None = None) -> tp.Generator[TRow, None, int]:
+    """
+    Writes the rows passing through to the column file atomically, see rowfile.write_file
+    :return: number of rows
+    """
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(filename) or '.',
+                                             prefix=f'.{os.path.basename(filename)}.')
+    completed = False
+    try:
+        with os.fdopen(descriptor, 'wb') as f:
+            count = yield from write_stream(rows, f, group_size)
+            f.flush()
+            os.fchmod(f.fileno(), rowfile.file_mode(filename))
+            os.fsync(f.fileno())
+        os.replace(temporary, filename)
+        completed = True
+    finally:
+        if not completed:
+            os.unlink(temporary)
+    return count
+
+
+def write(rows: tp.Iterable[TRow], filename: str, group_size: int | None = None) -> int:
+    """
+    Writes the rows to a column file (readable with Graph.graph_from_file(filename))
+    :param rows: rows to write
+    :param filename: file to write, replaced once all the rows are written
+    :param group_size: rows of a row group, ROW_GROUP_SIZE by default
+    :return: number of rows
+    """
+    writer = write_file(rows, filename, group_size)
+    while True:
+        try:
+            next(writer)
+        except StopIteration as stop:
+            return tp.cast(int, stop.value)
@@ -0,0 +1,111 @@
+import bz2
+import codecs
+import gzip
+import io
+import lzma
+import queue
+import threading
+import typing as tp
+
+BLOCK_SIZE = 1 << 20  # bytes decompressed at once
+PENDING_BLOCKS = 8  # decompressed blocks waiting for the reader
+
+# compression -> (extensions, magic bytes, opener)
+COMPRESSIONS: dict[str, tuple[tuple[str, ...], bytes, tp.Callable[..., tp.BinaryIO]]] = {
+    'gzip': (('.gz', '.gzip'), b'\x1f\x8b', gzip.open),
+    'bz2': (('.bz2',), b'BZh', bz2.open),
+    'xz': (('.xz', '.lzma'), b'\xfd7zXZ\x00', lzma.open),
+}
+
+
+def detect(filename: str) -> str | None:
+    """Compression of the file by its extension or, failing that, by its magic bytes; None for a plain file"""
+    for compression, (extensions, _, _) in COMPRESSIONS.items():
+        if filename.endswith(extensions):
+            return compression
+    with open(filename, 'rb') as f:
+        start = f.read(max(len(magic) for _, magic, _ in COMPRESSIONS.values()))
+    for compression, (_, magic, _) in COMPRESSIONS.items():
+        if start.startswith(magic):
+            return compression
+    return None
+
+
+class BackgroundLines:
+    """
+    Lines of a compressed file decompressed in a thread into a bounded buffer, so that decompression (which releases
+    the GIL) overlaps the parsing of the lines and the operations after it
+    """
+
+    def __init__(self, filename: str, compression: str, newline: str | None = None) -> None:
+        """
+        :param filename: compressed file
+        :param compression: one of COMPRESSIONS
+        :param newline: None to translate the line ends to '\\n', '' to keep them (as open does)
+        """
+        self.newline = newline
+        self._queue: queue.Queue[bytes | BaseException | None] = queue.Queue(PENDING_BLOCKS)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._decompress, args=(filename, compression), daemon=True)
+        self._thread.start()
+
+    def _put(self, item: bytes | BaseException | None) -> bool:
+        while not self._closed.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _decompress(self, filename: str, compression: str) -> None:
+        try:
+            with COMPRESSIONS[compression][2](filename, 'rb') as f:
+                while block := f.read(BLOCK_SIZE):
+                    if not self._put(block):
+                        return  # the reader stopped early
+            self._put(None)
+        except BaseException as error:  # raised in the reader
+            self._put(error)
+
+    def __iter__(self) -> tp.Iterator[str]:
+        decoder: codecs.IncrementalDecoder = codecs.getincrementaldecoder('utf-8')()
+        if self.newline is None:
+            decoder = io.IncrementalNewlineDecoder(decoder, translate=True)
+        rest = ''
+        while True:
+            block = self._queue.get()
+            if isinstance(block, BaseException):
+                raise block
+            lines = (rest + decoder.decode(block or b'', final=block is None)).split('\n')
+            rest = lines.pop()
+            for line in lines:
+                yield line + '\n'
+            if block is None:
+                if rest:
+                    yield rest
+                return
+
+    def __enter__(self) -> 'BackgroundLines':
+        return self
+
+    def __exit__(self, *exc_info: tp.Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._closed.set()
+        self._thread.join()
+
+
+def open_lines(filename: str, newline: str | None = None,
+               buffering: int = -1) -> tp.ContextManager[tp.Iterable[str]]:
+    """
+    Lines of the file, decompressed in the background if it is compressed
+    :param filename: plain or compressed (gzip, bz2 or xz) text file
+    :param newline: None to translate the line ends to '\\n', '' to keep them (as open does)
+    :param buffering: buffer size of a plain file, as for open
+    """
+    compression = detect(filename)
+    if compression is None:
+        return open(filename, newline=newline, buffering=buffering)
+    return BackgroundLines(filename, compression, newline)
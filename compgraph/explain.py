@@ -0,0 +1,221 @@
+import io
+import itertools
+import math
+import os
+import typing as tp
+from collections import Counter
+
+from . import operations as ops
+from . import cache
+from . import checkpoint
+from . import compressed
+from . import external_sort as ext_sort
+from . import profiling
+from . import sharing
+
+if tp.TYPE_CHECKING:  # pragma: no cover
+    from .graph import Graph
+
+SAMPLE_LINES = 1000  # lines of a file read to estimate its row count and to run the graph on
+
+# expected number of output rows per input row, used when there is no sample to measure it on
+MAPPER_SELECTIVITY: dict[type[ops.Mapper], float] = {
+    ops.Split: 10.0,
+    ops.Filter: 0.5,
+    ops.LongerThanN: 0.5,
+    ops.AtLeastNTimes: 0.5,
+}
+REDUCE_SELECTIVITY = 0.1
+
+
+class PlanNode:
+    """Node of the explained plan, rows and cost are estimates (None if unknown)"""
+
+    def __init__(self, graph: 'Graph', inputs: list['PlanNode'], runs: int) -> None:
+        self.graph = graph
+        self.inputs = inputs
+        self.runs = runs
+        self.rows: float | None = None
+        self.cost: float | None = None
+
+    @property
+    def total_cost(self) -> float | None:
+        costs = [self.cost] + [node.total_cost for node in self.inputs]
+        return None if any(cost is None for cost in costs) else sum(tp.cast(list[float], costs))
+
+
+def _file_rows(filename: str) -> tuple[float, list[str]]:
+    """
+    Row count of the file estimated by the average length of its first lines (by the compressed bytes read for them
+    for a compressed file), and these lines
+    """
+    compression = compressed.detect(filename)
+    if compression is None:
+        with open(filename) as f:
+            lines = list(itertools.islice(f, SAMPLE_LINES))
+        line_bytes = sum(len(line.encode()) for line in lines) / max(len(lines), 1)
+    else:
+        with open(filename, 'rb') as raw, io.TextIOWrapper(compressed.COMPRESSIONS[compression][2](raw)) as f:
+            lines = list(itertools.islice(f, SAMPLE_LINES))
+            line_bytes = raw.tell() / max(len(lines), 1)
+    if len(lines) < SAMPLE_LINES:
+        return float(len(lines)), lines
+    return os.path.getsize(filename) / line_bytes, lines
+
+
+def _operation_cost(operation: ops.Operation, rows_in: float, rows_out: float) -> float:
+    """Cost in abstract units: one per row processed, n log n for sorts"""
+    if isinstance(operation, ext_sort.ExternalSort):
+        return rows_in * max(math.log2(rows_in), 1.0) if rows_in > 1 else rows_in
+    if isinstance(operation, ops.Top):
+        return rows_in * max(math.log2(operation.n), 1.0) if operation.n > 1 else rows_in
+    return max(rows_in, rows_out)
+
+
+def _estimate_rows(operation: ops.Operation, inputs: list[float]) -> float:
+    if isinstance(operation, ops.Map):
+        return inputs[0] * MAPPER_SELECTIVITY.get(type(operation.mapper), 1.0)
+    if isinstance(operation, ops.Reduce):
+        return inputs[0] * REDUCE_SELECTIVITY if operation.keys else min(inputs[0], 1.0)
+    if isinstance(operation, ops.Join):
+        return max(inputs)
+    if isinstance(operation, (ops.Top, ops.Limit)):
+        return min(inputs[0], operation.n)
+    if inputs:
+        return inputs[0]
+    return 0.0
+
+
+class _Explainer:
+    def __init__(self, graph: 'Graph', row_counts: dict[str, int], samples: dict[str, tp.Any]) -> None:
+        self.row_counts = row_counts
+        self.samples = samples
+        self.memo: dict[int, tp.Hashable] = {}
+        self.runs: Counter[tp.Hashable] = Counter()
+        self._count_runs(graph)
+        self.root = self._build(graph)
+
+    def _count_runs(self, graph: 'Graph') -> None:
+        self.runs[sharing.fingerprint(graph, self.memo)] += 1
+        for parent in graph._parents:
+            self._count_runs(parent)
+
+    def _build(self, graph: 'Graph') -> PlanNode:
+        inputs = [self._build(parent) for parent in graph._parents]
+        return PlanNode(graph, inputs, self.runs[sharing.fingerprint(graph, self.memo)])
+
+    def sources(self, node: PlanNode) -> tp.Generator[PlanNode, None, None]:
+        if not node.inputs:
+            yield node
+        for input_node in node.inputs:
+            yield from self.sources(input_node)
+
+    def can_sample(self) -> bool:
+        return all(not isinstance(node.graph._operation, ops.ReadIterGenerator)
+                   or node.graph._operation.name in self.samples for node in self.sources(self.root))
+
+    def estimate(self) -> None:
+        """Estimates the plan heuristically, or by running it on the samples and scaling the measured row counts"""
+        if self.can_sample():
+            scales = {id(node): self._sample_scale(node) for node in self.sources(self.root)}
+            list(self._run_sample(self.root, scales))
+        else:
+            self._estimate(self.root)
+
+    def _source_rows(self, operation: ops.Operation) -> float | None:
+        if isinstance(operation, ops.ReadIterGenerator):
+            return self.row_counts.get(operation.name)
+        if isinstance(operation, ops.Read):
+            if operation.filename in self.row_counts:
+                return self.row_counts[operation.filename]
+            return _file_rows(operation.filename)[0]
+        if isinstance(operation, ops.ReadRowFile):
+            return self.row_counts.get(operation.filename, operation.row_count())
+        if isinstance(operation, ops.ReadCsv):
+            return self.row_counts.get(operation.filename, _file_rows(operation.filename)[0])
+        return None
+
+    def _estimate(self, node: PlanNode) -> None:
+        for input_node in node.inputs:
+            self._estimate(input_node)
+        operation = node.graph._operation
+        if not node.inputs:
+            node.rows = self._source_rows(operation)
+        elif all(input_node.rows is not None for input_node in node.inputs):
+            inputs = [tp.cast(float, input_node.rows) for input_node in node.inputs]
+            node.rows = _estimate_rows(operation, inputs)
+        if node.rows is not None:
+            rows_in = sum(tp.cast(float, input_node.rows) for input_node in node.inputs) if node.inputs else 0.0
+            node.cost = _operation_cost(operation, rows_in, node.rows)
+
+    def _sample_scale(self, node: PlanNode) -> float:
+        operation = node.graph._operation
+        if isinstance(operation, ops.Read):
+            rows, lines = _file_rows(operation.filename)
+            return self.row_counts.get(operation.filename, rows) / max(len(lines), 1)
+        if isinstance(operation, (ops.ReadRowFile, ops.ReadCsv)):
+            sample_rows = sum(1 for _ in itertools.islice(operation(), SAMPLE_LINES))
+            return tp.cast(float, self._source_rows(operation)) / max(sample_rows, 1)
+        if isinstance(operation, ops.ReadIterGenerator) and operation.name in self.row_counts:
+            sample_rows = sum(1 for _ in self.samples[operation.name]())
+            return self.row_counts[operation.name] / max(sample_rows, 1)
+        return 1.0
+
+    def _run_sample(self, node: PlanNode, scales: dict[int, float]) -> ops.TRowsGenerator:
+        operation = node.graph._operation
+        if isinstance(operation, ops.Read):
+            rows: ops.TRowsIterable = (operation.parser(line) for line in _file_rows(operation.filename)[1])
+        elif isinstance(operation, (ops.ReadRowFile, ops.ReadCsv)):
+            rows = itertools.islice(operation(), SAMPLE_LINES)
+        elif isinstance(operation, (checkpoint.Checkpoint, cache.Cached)):
+            # the samples are passed through, nothing is persisted or read back
+            rows = operation(*[self._run_sample(input_node, scales) for input_node in node.inputs], dry=True)
+        else:
+            rows = operation(*[self._run_sample(input_node, scales) for input_node in node.inputs], **self.samples)
+        # rows are extrapolated with the largest scale of the sources the node depends on
+        scale = max(scales[id(source)] for source in self.sources(node))
+        count = 0
+        for row in rows:
+            count += 1
+            yield row
+        node.rows = count * scale
+        if isinstance(operation, ops.Reduce) and not operation.keys:
+            node.rows = count
+        elif isinstance(operation, (ops.Top, ops.Limit)):
+            node.rows = min(node.rows, operation.n)
+        rows_in = sum(tp.cast(float, input_node.rows) for input_node in node.inputs)
+        node.cost = _operation_cost(operation, rows_in, node.rows)
+
+
+def _format(value: float | None) -> str:
+    if value is None:
+        return '?'
+    for unit in ['', 'K', 'M', 'G']:
+        if abs(value) < 1000:
+            return f'{value:.0f}{unit}'
+        value /= 1000
+    return f'{value:.0f}T'
+
+
+def explain(graph: 'Graph', row_counts: dict[str, int], samples: dict[str, tp.Any]) -> str:
+    """
+    Renders the plan of the graph as an indented tree, the root is the output of the graph
+    :param graph: graph to explain
+    :param row_counts: source name (or filename) -> number of rows in it
+    :param samples: source name -> callable returning a sample of its rows
+    """
+    explainer = _Explainer(graph, row_counts, samples)
+    explainer.estimate()
+    lines: list[str] = []
+
+    def render(node: PlanNode, depth: int) -> None:
+        line = f'{"  " * depth}{profiling.describe(node.graph._operation)}'
+        line += f'  rows~{_format(node.rows)} cost~{_format(node.cost)} total~{_format(node.total_cost)}'
+        if node.runs > 1:
+            line += f'  [computed {node.runs} times]'
+        lines.append(line)
+        for input_node in node.inputs:
+            render(input_node, depth + 1)
+
+    render(explainer.root, 0)
+    return '\n'.join(lines)
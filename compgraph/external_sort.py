@@ -1,23 +1,134 @@
+from array import array
 from collections.abc import Sequence
+import itertools
+import sys
+import time
 import typing as tp
 
 from multiprocessing import Pipe, Process, connection
 from operator import itemgetter
 
 from . import operations as ops
+from . import memory
+from . import profiling
+from .batch import RowBatch, to_batches
 
+SORT_BATCH_SIZE = 1024
 
-def do_sort(endpoint: connection.Connection, keys: tuple[str, ...]) -> None:
-    rows = []
+
+def _phases(receive_start: float, sort_start: float, send_start: float) -> list[tuple[str, float, float]]:
+    return [('receive', receive_start, sort_start), ('sort', sort_start, send_start),
+            ('send', send_start, time.perf_counter())]
+
+
+def _sorted_batches(batches: list[RowBatch], keys: tuple[str, ...]) -> tp.Iterator[ops.TRow]:
+    # rows are kept in columnar batches, only the key values of every row are gathered in one list
+    row_batch_indices = array('I')
+    row_indices = array('I')
+    key_values: list[tp.Any] = []
+    for batch_index, batch in enumerate(batches):
+        row_batch_indices.extend([batch_index] * len(batch))
+        row_indices.extend(range(len(batch)))
+        key_values.extend(zip(*(batch.columns[key] for key in keys)))
+    order = sorted(range(len(key_values)), key=key_values.__getitem__)
+    del key_values
+
+    schemas = [batch.schema for batch in batches]
+    columns = [list(batch.columns.values()) for batch in batches]
+    return (dict(zip(schemas[row_batch_indices[index]],
+                     [column[row_indices[index]] for column in columns[row_batch_indices[index]]]))
+            for index in order)
+
+
+def _buffered_size(chunk: tp.Any) -> int:
+    if isinstance(chunk, RowBatch):
+        return sum(sys.getsizeof(column) for column in chunk.columns.values()) + len(chunk) * 64
+    return sys.getsizeof(chunk) + sum(sys.getsizeof(record) for record in chunk)
+
+
+def _sort_process(endpoint: connection.Connection, sort: tp.Callable[[list[tp.Any]], tp.Iterator[tp.Any]],
+                  key: tp.Callable[[tp.Any], tp.Any], budget: memory.MemoryBudget | None) -> None:
+    """
+    Receives chunks of rows until None, sends back the sorted rows in chunks, None and the process statistics
+    :param sort: received chunks -> sorted items
+    :param key: sorting key of the items, to merge the spilled runs
+    :param budget: memory budget of the run, sorted runs are spilled to temporary files when it is exceeded
+    """
+    receive_start = time.perf_counter()
+    chunks: list[tp.Any] = []
+    runs: list[memory.SpillFile] = []
+    limit = memory.BufferLimit(budget) if budget is not None else None
+    buffered = peak_buffered = 0
+    items = 0
     while True:
-        row = endpoint.recv()
-        if row is None:
+        chunk = endpoint.recv()
+        if chunk is None:
             break
-        rows.append(row)
-    rows.sort(key=itemgetter(*keys))
-    for row in rows:
-        endpoint.send(row)
+        chunks.append(chunk)
+        items += len(chunk)
+        buffered += _buffered_size(chunk)
+        peak_buffered = max(peak_buffered, buffered)
+        if limit is not None and limit.full(items, len(chunk)):
+            run = memory.SpillFile()
+            run.write(sort(chunks))
+            runs.append(run)
+            chunks, items, buffered = [], 0, 0
+
+    sort_start = time.perf_counter()
+    items_sorted = sort(chunks)
+    del chunks
+    if runs:
+        items_sorted = memory.merge_runs(runs, items_sorted, key)
+    send_start = time.perf_counter()
+    for chunk in _chunks(items_sorted):
+        endpoint.send(chunk)
     endpoint.send(None)
+    endpoint.send(profiling.process_stats(_phases(receive_start, sort_start, send_start),
+                                          peak_buffered=peak_buffered, spills=len(runs)))
+
+
+def _chunks(items: tp.Iterator[tp.Any]) -> tp.Iterator[tp.Any]:
+    iterator = iter(items)
+    first = next(iterator, None)
+    if isinstance(first, dict):
+        yield from to_batches(itertools.chain([first], iterator), SORT_BATCH_SIZE)
+    elif first is not None:
+        iterator = itertools.chain([first], iterator)
+        while chunk := list(itertools.islice(iterator, SORT_BATCH_SIZE)):
+            yield chunk
+
+
+def do_sort(endpoint: connection.Connection, keys: tuple[str, ...], budget: memory.MemoryBudget | None = None) -> None:
+    _sort_process(endpoint, lambda batches: _sorted_batches(batches, keys), itemgetter(*keys), budget)
+
+
+def do_sort_records(endpoint: connection.Connection, key_positions: tuple[int, ...],
+                    budget: memory.MemoryBudget | None = None) -> None:
+    key = itemgetter(*key_positions)
+
+    def sort(chunks: list[list[tuple[tp.Any, ...]]]) -> tp.Iterator[tuple[tp.Any, ...]]:
+        records = list(itertools.chain.from_iterable(chunks))
+        chunks.clear()
+        records.sort(key=key)
+        return iter(records)
+
+    _sort_process(endpoint, sort, key, budget)
+
+
+def to_records(rows: ops.TRowsIterable, schema: ops.TSchema) -> tp.Generator[list[tuple[tp.Any, ...]], None, None]:
+    """Chunks of rows as tuples of values ordered by the schema"""
+    width = len(schema)
+    getter = itemgetter(*schema) if width > 1 else lambda row: (row[schema[0]],)
+    chunk = []
+    for row in rows:
+        if len(row) != width:
+            raise ValueError(f'Row columns {list(row)} do not match the declared schema {list(schema)}')
+        chunk.append(getter(row))
+        if len(chunk) >= SORT_BATCH_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
 
 
 class ExternalSort(ops.Operation):
@@ -27,24 +138,54 @@ class ExternalSort(ops.Operation):
     This class illustrates cross-process streaming.
     """
 
-    def __init__(self, keys: Sequence[str]):
+    def __init__(self, keys: Sequence[str], schema: ops.TSchema | None = None):
+        """
+        :param keys: sorting keys
+        :param schema: columns of the rows, if known rows are transferred and sorted as compact tuples
+        """
         self.keys = keys
+        self.schema = schema
+
+    def _decode(self, chunk: tp.Any) -> ops.TRowsIterable:
+        if self.schema is None:
+            return tp.cast(RowBatch, chunk).rows()
+        schema = self.schema
+        return (dict(zip(schema, record)) for record in chunk)
 
     def __call__(self, rows: ops.TRowsIterable, *args: tp.Any, **kwargs: tp.Any) -> ops.TRowsGenerator:
         local_endpoint, remote_endpoint = Pipe()
-        process = Process(target=do_sort, args=(remote_endpoint, self.keys))
+        budget = memory.current()
+        chunks: tp.Iterable[tp.Any]
+        if self.schema is None:
+            process = Process(target=do_sort, args=(remote_endpoint, self.keys, budget))
+            chunks = to_batches(rows, SORT_BATCH_SIZE)
+        else:
+            key_positions = tuple(self.schema.index(key) for key in self.keys)
+            process = Process(target=do_sort_records, args=(remote_endpoint, key_positions, budget))
+            chunks = to_records(rows, self.schema)
         process.start()
-        row_count_before = 0
-        for row in rows:
-            local_endpoint.send(row)
-            row_count_before += 1
-        local_endpoint.send(None)
-        row_count_after = 0
-        while True:
-            local_endpoint_row = local_endpoint.recv()
-            if local_endpoint_row is None:
-                break
-            yield local_endpoint_row
-            row_count_after += 1
-        assert row_count_before == row_count_after
-        process.join()
+        finished = False
+        try:
+            row_count_before = 0
+            for chunk in chunks:
+                local_endpoint.send(chunk)
+                row_count_before += len(chunk)
+            local_endpoint.send(None)
+            row_count_after = 0
+            while True:
+                local_endpoint_chunk = local_endpoint.recv()
+                if local_endpoint_chunk is None:
+                    break
+                yield from self._decode(local_endpoint_chunk)
+                row_count_after += len(local_endpoint_chunk)
+            assert row_count_before == row_count_after
+            stats = local_endpoint.recv()
+            profiling.record_process(stats)
+            if budget is not None:
+                budget.record(f'ExternalSort(keys={list(self.keys)})', stats['peak_buffered'], stats['spills'])
+            finished = True
+        finally:
+            # the sorting process is blocked on the pipe if the stream failed or was not consumed till the end
+            if not finished:
+                process.terminate()
+            process.join()
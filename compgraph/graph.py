@@ -1,42 +1,116 @@
+import contextlib
+import os
 import typing as tp
 from . import operations as ops
 from . import external_sort as ext_sort
+from . import parallel
+from . import aio
+from . import batch
+from . import codegen
+from . import sharing
+from . import profiling
+from . import memory
+from . import columnfile
+from . import compressed
+from . import rowfile
+from . import sink
+from . import checkpoint as ckpt
+from . import cache as result_cache
+from . import incremental as incr
+from . import explain as plan_explain
 
 
 class Graph:
     """Computational graph implementation"""
 
-    def __init__(self, operation: ops.Operation, parents: list['Graph']) -> None:
+    def __init__(self, operation: ops.Operation, parents: list['Graph'], schema: ops.TSchema | None = None) -> None:
         self._operation: ops.Operation = operation
         self._parents: list[Graph] = parents
+        self._schema: ops.TSchema | None = schema
+        self.profiler: profiling.Profiler | None = None  # profiler of the last run with profile=True
+
+    @property
+    def schema(self) -> ops.TSchema | None:
+        """Columns of the rows produced by the graph, if they are known"""
+        return self._schema
 
     def copy(self) -> 'Graph':
         """Copies the graph"""
-        return Graph(self._operation, self._parents)
+        return Graph(self._operation, self._parents, self._schema)
 
     @staticmethod
-    def graph_from_iter(name: str) -> 'Graph':
+    def graph_from_iter(name: str, schema: tp.Sequence[str] | None = None) -> 'Graph':
         """Construct new graph which reads data from row iterator (in form of sequence of Rows
         from 'kwargs' passed to 'run' method) into graph data-flow
         Use ops.ReadIterGenerator
         :param name: name of kwarg to use as data source
+        :param schema: columns every row has (exactly), lets sorts store rows as compact tuples
         """
-        return Graph(ops.ReadIterGenerator(name), [])
+        return Graph(ops.ReadIterGenerator(name), [], tuple(schema) if schema is not None else None)
 
     @staticmethod
-    def graph_from_file(filename: str, parser: tp.Callable[[str], ops.TRow]) -> 'Graph':
+    def graph_from_file(filename: str, parser: tp.Callable[[str], ops.TRow] | None = None,
+                        schema: tp.Sequence[str] | None = None, workers: int = 1, ordered: bool = True,
+                        columns: tp.Sequence[str] | None = None,
+                        where: dict[str, tuple[tp.Any, tp.Any]] | None = None) -> 'Graph':
         """Construct new graph extended with operation for reading rows from file
-        Use ops.Read
+        Use ops.Read, or ops.ReadRowFile for a row file (rowfile.write) and ops.ReadColumnFile for a column file
+        (columnfile.write)
+        :param filename: filename to read from, a gzip, bz2 or xz file (detected by its extension or its first bytes)
+            is decompressed in a background thread
+        :param parser: parser from string to Row, None for a row or column file
+        :param schema: columns every parsed row has (exactly), lets sorts store rows as compact tuples
+        :param workers: number of processes parsing chunks of the memory mapped file (parallel.ParallelRead)
+        :param ordered: with workers > 1, read the rows in the order of the file
+            (otherwise chunks of rows are read as soon as they are parsed)
+        :param columns: columns the graph needs, the others are dropped right after parsing (ops.ProjectedParser),
+            so that they are not copied, sorted and passed between processes; a column file reads only them
+        :param where: for a column file, inclusive ranges (None for an open side) of the values of the columns
+            to keep the rows within, row groups ruled out by their statistics are not read
+        """
+        if workers < 1:
+            raise ValueError('Number of workers should be positive')
+        schema = tuple(schema) if schema is not None else None
+        if where is not None and (parser is not None or not columnfile.is_column_file(filename)):
+            raise ValueError('Ranges of values can only be pushed down to a column file')
+        if parser is None:
+            if workers > 1:
+                raise ValueError('Binary files are read by a single process, run the graph with parallelism instead')
+            if columnfile.is_column_file(filename):
+                return Graph(ops.ReadColumnFile(filename, columns, where), [], schema)
+            if not rowfile.is_row_file(filename):
+                raise ValueError(f'{filename} is neither a row nor a column file, a parser is needed to read it')
+            return Graph(ops.ReadRowFile(filename, columns), [], schema)
+        if columns is not None:
+            parser = ops.ProjectedParser(parser, columns)
+        if workers > 1:
+            if compressed.detect(filename) is not None:
+                raise ValueError('Compressed files are decompressed as a stream, they can not be parsed by workers')
+            return Graph(parallel.ParallelRead(filename, parser, workers, ordered), [], schema)
+        return Graph(ops.Read(filename, parser), [], schema)
+
+    @staticmethod
+    def graph_from_csv(filename: str, columns: tp.Sequence[str] | dict[str, tp.Callable[[str], tp.Any]] | None = None,
+                       delimiter: str | None = None, header: bool = True) -> 'Graph':
+        """Construct new graph reading the records of a CSV or TSV file, the rows have exactly the given columns
+        Use ops.ReadCsv
         :param filename: filename to read from
-        :param parser: parser from string to Row
+        :param columns: columns to read, or columns mapped to converters of their values (e.g. {'edge_id': int,
+            'length': float}); None for all the columns of the header, as strings
+        :param delimiter: field delimiter, '\t' for a .tsv file and ',' for any other by default
+        :param header: the first record names the fields, otherwise the columns name the fields in order
         """
-        return Graph(ops.Read(filename, parser), [])
+        if delimiter is None:
+            delimiter = '\t' if filename.endswith('.tsv') else ','
+        schema = tuple(columns) if columns is not None else None
+        return Graph(ops.ReadCsv(filename, columns, delimiter, header), [], schema)
 
     def map(self, mapper: ops.Mapper) -> 'Graph':
         """Construct new graph extended with map operation with particular mapper
         :param mapper: mapper to use
         """
-        return Graph(ops.Map(mapper), [self])
+        schema = mapper.output_schema(self._schema) if self._schema is not None else None
+        return Graph(ops.Map(mapper), [self], schema)
 
     def reduce(self, reducer: ops.Reducer, keys: tp.Sequence[str]) -> 'Graph':
         """Construct new graph extended with reduce operation with particular reducer
@@ -49,7 +123,30 @@ class Graph:
         """Construct new graph extended with sort operation
         :param keys: sorting keys (typical is tuple of strings)
         """
-        return Graph(ext_sort.ExternalSort(keys), [self])
+        return Graph(ext_sort.ExternalSort(keys, self._schema), [self], self._schema)
+
+    def limit(self, n: int) -> 'Graph':
+        """Construct new graph extended with limit operation, a sort followed by the limit becomes top-n selection
+        Use ops.Limit
+        :param n: number of rows to leave
+        """
+        if isinstance(self._operation, ext_sort.ExternalSort):
+            return Graph(ops.Top(n, self._operation.keys), self._parents, self._schema)
+        if isinstance(self._operation, ops.Top):
+            top = ops.Top(min(n, self._operation.n), self._operation.keys, self._operation.descending)
+            return Graph(top, self._parents, self._schema)
+        if isinstance(self._operation, ops.Limit):
+            return Graph(ops.Limit(min(n, self._operation.n)), self._parents, self._schema)
+        return Graph(ops.Limit(n), [self], self._schema)
+
+    def top(self, n: int, keys: tp.Sequence[str], descending: bool = False) -> 'Graph':
+        """Construct new graph extended with top-n selection, keeping only n rows in memory
+        Use ops.Top
+        :param n: number of rows to leave
+        :param keys: sorting keys
+        :param descending: take the rows with the largest keys first
+        """
+        return Graph(ops.Top(n, keys, descending), [self], self._schema)
 
     def join(self, joiner: ops.Joiner, join_graph: 'Graph', keys: tp.Sequence[str]) -> 'Graph':
         """Construct new graph extended with join operation with another graph
@@ -59,7 +156,161 @@ class Graph:
         """
         return Graph(ops.Join(joiner, keys), [self, join_graph])
 
-    def run(self, **kwargs: tp.Any) -> ops.TRowsIterable:
-        """Single method to start execution; data sources passed as kwargs"""
-        parents_run: list[ops.TRowsIterable] = [parent.run(**kwargs) for parent in self._parents]
+    def checkpoint(self, path: str) -> 'Graph':
+        """Construct new graph extended with a checkpoint: the rows are persisted to the directory, and later runs
+        of the same graph over the same inputs (files unchanged, data sources yielding the same rows) read them
+        back instead of computing everything before the checkpoint
+        :param path: directory to keep the rows in
+        """
+        return Graph(ckpt.Checkpoint(path, self), [self], self._schema)
+
+    def cache(self, cache: result_cache.ResultCache) -> 'Graph':
+        """Construct new graph extended with a cached result: a run finding the result of the same graph over the same
+        inputs in the cache streams the cached rows without computing anything, otherwise the rows are cached
+        once the run reads them all
+        :param cache: cache to look the result up in and to store it to
+        """
+        return Graph(result_cache.Cached(cache, self), [self], self._schema)
+
+    def _with_checkpoints(self, directory: str, rebuilt: dict[int, 'Graph']) -> 'Graph':
+        if id(self) in rebuilt:
+            return rebuilt[id(self)]
+        graph = Graph(self._operation, [parent._with_checkpoints(directory, rebuilt) for parent in self._parents],
+                      self._schema)
+        if isinstance(self._operation, ext_sort.ExternalSort):
+            graph = graph.checkpoint(os.path.join(directory, ckpt.plan_digest(graph)[:16]))
+        rebuilt[id(self)] = graph
+        return graph
+
+    def compile(self) -> 'Graph':
+        """Construct equivalent graph in which the chains of built-in mappers are fused into generated functions
+        (the source of each one is available as CompiledMap.source), other operations are kept as they are
+        """
+        return self._compile({})
+
+    def _compile(self, compiled: dict[int, 'Graph']) -> 'Graph':
+        if id(self) in compiled:
+            return compiled[id(self)]
+        mappers: list[ops.Mapper] = []
+        node = self
+        while isinstance(node._operation, ops.Map) and codegen.can_compile(node._operation.mapper):
+            mappers.append(node._operation.mapper)
+            node = node._parents[0]
+        if mappers:
+            graph = Graph(codegen.CompiledMap(mappers[::-1]), [node._compile(compiled)], self._schema)
+        else:
+            graph = Graph(self._operation, [parent._compile(compiled) for parent in self._parents], self._schema)
+        compiled[id(self)] = graph
+        return graph
+
+    def explain(self, row_counts: dict[str, int] | None = None, **samples: tp.Any) -> str:
+        """Renders the graph as a tree of operations with estimated row counts and costs (in rows processed,
+        n log n for sorts); nodes computed more than once are marked. If every iterator source has a sample,
+        the graph is run on the samples (and on the first lines of the files) and the measured row counts are
+        scaled to the sizes of the sources, otherwise the counts are estimated with fixed selectivities
+        :param row_counts: source name or filename -> number of rows, file sizes are estimated when omitted
+        :param samples: source name -> callable returning sample rows, like the data sources of run
+        """
+        return plan_explain.explain(self, row_counts or {}, samples)
+
+    def run(self, *, parallelism: int = 1, ordered: bool = True, concurrent_branches: bool = False,
+            batch_size: int | None = None, profile: bool | profiling.Profiler = False,
+            memory_budget: int | memory.MemoryBudget | None = None, checkpoint_dir: str | None = None,
+            incremental: incr.IncrementalState | None = None, **kwargs: tp.Any) -> ops.TRowsIterable:
+        """Single method to start execution; data sources passed as kwargs
+        :param parallelism: number of worker processes to partition the execution across
+        :param ordered: with parallelism > 1, merge the partitions by the ordering of the result
+            (otherwise rows are streamed back as soon as any worker produces them)
+        :param concurrent_branches: compute independent branches joined together in separate processes
+        :param batch_size: pass rows between maps (and into combining reducers) in columnar batches of this size,
+            so that the mappers with batch kernels are vectorized
+        :param profile: measure every node, the statistics are collected by the profiler passed
+            (with True, by a new one kept in graph.profiler); runs inside `with Profiler()` are measured as well,
+            if they are executed sequentially
+        :param memory_budget: memory limit in bytes (or MemoryBudget to get the peak buffer of every operator
+            from), sorts, join groups and word frequency tables are spilled to temporary files when it is neared
+        :param checkpoint_dir: checkpoint the output of every sort into a subdirectory of this one, see checkpoint
+        :param incremental: process only the rows appended to the inputs since the previous run with this state,
+            reductions with combining reducers merge them into their persisted states (and reductions of the new rows
+            with any other reducer are not allowed)
+        """
+        if parallelism < 1:
+            raise ValueError('Parallelism should be positive')
+        if sum([parallelism > 1, concurrent_branches, batch_size is not None, profile is not False]) > 1:
+            raise ValueError('Parallelism, concurrent branches, batch execution and profiling can not be combined')
+        graph = self._with_checkpoints(checkpoint_dir, {}) if checkpoint_dir is not None else self
+        if parallelism > 1 and any(isinstance(node._operation, (ckpt.Checkpoint, result_cache.Cached))
+                                   for node in parallel.walk(graph)):
+            # every worker sees only its partition of the rows
+            raise ValueError('Checkpoints and cached results can not be used with parallelism')
+        if incremental is not None and (parallelism > 1 or concurrent_branches):
+            raise ValueError('Incremental runs can not be executed in several processes')
+        incremental_run = incremental.start(graph, kwargs) if incremental is not None else None
+        if incremental_run is not None:
+            graph = incremental_run.graph
+        profiler = profiling.Profiler() if profile is True else profile or profiling.current()
+        if profile is True:
+            self.profiler = profiler
+        budget = memory.MemoryBudget(memory_budget) if isinstance(memory_budget, int) else memory_budget
+        with budget if budget is not None else contextlib.nullcontext():
+            if batch_size is not None:
+                yield from graph._run_vectorized(batch_size, **kwargs)
+            elif concurrent_branches:
+                yield from parallel.run_branches(graph, kwargs)
+            elif parallelism > 1:
+                yield from parallel.run_partitioned(graph, parallelism, ordered, kwargs)
+            elif profiler:
+                yield from profiler.run(graph, kwargs)
+            else:
+                yield from graph._run(**kwargs)
+        if incremental_run is not None:
+            incremental_run.commit()
+
+    def write(self, path: str, format: str = 'jsonl', background: bool = True, **kwargs: tp.Any) -> sink.WriteStats:
+        """Runs the graph and writes the result to the file, which is replaced atomically once all the rows are written
+        :param path: file to write
+        :param format: 'jsonl' (JSON lines serialized in batches), 'rows' (rowfile) or 'columns' (columnfile)
+        :param background: for JSON lines, write the serialized batches in a thread
+        :param kwargs: data sources and options of run
+        :return: number of rows and bytes written, and the time the run and the writing took
+        """
+        return sink.write(self.run(**kwargs), path, format, background)
+
+    @staticmethod
+    def run_many(graphs: dict[str, 'Graph'], consumers: dict[str, sharing.TConsumer] | None = None,
+                 **kwargs: tp.Any) -> dict[str, list[ops.TRow]]:
+        """Runs several graphs together, reading the sources and computing the nodes they have in common once
+        (rows of a shared node are buffered until every consumer of the node has read them)
+        :param graphs: sink name -> graph
+        :param consumers: sink name -> callable receiving the rows or filename to write them to (as json lines),
+            rows of the sinks without consumer are returned
+        :param kwargs: data sources
+        """
+        return sharing.run_many(graphs, consumers or {}, kwargs)
+
+    def arun(self, **kwargs: tp.Any) -> tp.AsyncGenerator[ops.TRow, None]:
+        """Asyncio version of run: data sources may be callables returning async iterables, or async iterables
+        for graphs reading the source once; the graph is executed outside of the event loop thread. Async sources
+        are pulled in the event loop, so they can not be read by the processes of concurrent_branches
+        :param kwargs: data sources and options of run
+        """
+        return aio.arun(self, kwargs)
+
+    def _run_batches(self, batch_size: int, **kwargs: tp.Any) -> tp.Iterable[batch.RowBatch]:
+        if isinstance(self._operation, ops.Map):
+            return self._operation.map_batches(self._parents[0]._run_batches(batch_size, **kwargs))
+        if isinstance(self._operation, ops.ReadCsv):
+            return self._operation.read_batches(batch_size)
+        return batch.to_batches(self._run_vectorized(batch_size, **kwargs), batch_size)
+
+    def _run_vectorized(self, batch_size: int, **kwargs: tp.Any) -> ops.TRowsIterable:
+        if isinstance(self._operation, ops.Map):
+            return batch.from_batches(self._run_batches(batch_size, **kwargs))
+        if isinstance(self._operation, ops.Reduce):
+            return self._operation.reduce_batches(self._parents[0]._run_batches(batch_size, **kwargs))
+        parents_run = [parent._run_vectorized(batch_size, **kwargs) for parent in self._parents]
+        return self._operation(*parents_run, **kwargs)
+
+    def _run(self, **kwargs: tp.Any) -> ops.TRowsIterable:
+        parents_run: list[ops.TRowsIterable] = [parent._run(**kwargs) for parent in self._parents]
         yield from self._operation(*parents_run, **kwargs)
@@ -0,0 +1,267 @@
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import re
+import typing as tp
+from operator import itemgetter
+
+from . import operations as ops
+from . import external_sort as ext_sort
+from . import batch
+from . import checkpoint as ckpt
+from . import rowfile
+from . import codegen
+from . import compressed
+
+if tp.TYPE_CHECKING:  # pragma: no cover
+    from .graph import Graph
+
+MANIFEST_FILE = 'manifest.json'
+TAIL_SIZE = 4096  # bytes before the processed end of a file compared to detect rewritten files
+_STATE_FILE = re.compile(r'[0-9a-f]{16}\.\d+')  # {plan digest}.{generation}, see IncrementalRun._state_file
+
+# operations passing the rows of the new input through as new rows of their output
+_LINEAR = (ops.Map, codegen.CompiledMap, ext_sort.ExternalSort)
+# joiners keeping every row of the given side (0 for the first one) that finds a match: joining only the new rows
+# of that side with all the rows of the other one gives the new rows of the result
+_LINEAR_JOINERS: dict[type[ops.Joiner], set[int]] = {ops.InnerJoiner: {0, 1}, ops.LeftJoiner: {0}, ops.RightJoiner: {1}}
+
+
+def _tail_digest(filename: str, end: int) -> str:
+    with open(filename, 'rb') as f:
+        f.seek(max(end - TAIL_SIZE, 0))
+        return hashlib.sha256(f.read(end - f.tell())).hexdigest()
+
+
+def _resume_offset(filename: str, offset: int) -> int | None:
+    """
+    Start of the lines appended after the offset the previous run stopped at. If that run processed a last line
+    without a line end, the line end appended to it is skipped; None if the line was continued instead
+    """
+    if offset == 0:
+        return 0
+    with open(filename, 'rb') as f:
+        f.seek(offset - 1)
+        last, following = f.read(1), f.read(1)
+    if last == b'\n' or not following:
+        return offset
+    return offset + 1 if following == b'\n' else None
+
+
+def _complete_end(filename: str) -> int:
+    """End of the last complete line of the file, a line being appended right now is left for the next run"""
+    with open(filename, 'rb') as f:
+        end = f.seek(0, os.SEEK_END)
+        while end > 0:
+            f.seek(max(end - TAIL_SIZE, 0))
+            block = f.read(end - f.tell())
+            newline = block.rfind(b'\n')
+            if newline >= 0:
+                return end - len(block) + newline + 1
+            end -= len(block)
+    return 0
+
+
+class AppendedRows(ops.Operation):
+    """Reads the lines appended to the file since the previous incremental run"""
+
+    def __init__(self, read: ops.Read, start: int, end: int) -> None:
+        """
+        :param read: operation reading the whole file
+        :param start: offset the previous run stopped at
+        :param end: offset to stop at, at the end of a line or of the file
+        """
+        self.read = read
+        self.start = start
+        self.end = end
+
+    def __call__(self, *args: tp.Any, **kwargs: tp.Any) -> ops.TRowsGenerator:
+        with open(self.read.filename, 'rb') as f:
+            f.seek(self.start)
+            position = self.start
+            for line in f:
+                if position >= self.end:
+                    break
+                position += len(line)
+                yield self.read.parser(line.decode())
+
+
+class IncrementalReduce(ops.Operation):
+    """
+    Reduce with a combining reducer over the new rows only: the states of the groups are merged with the states
+    persisted by the previous run, the result has a row for every group ever seen
+    """
+
+    def __init__(self, reduce: ops.Reduce, previous: str | None, current: str) -> None:
+        """
+        :param reduce: reduce to compute
+        :param previous: file with the states of the previous run, None for the first run
+        :param current: file to persist the merged states to
+        """
+        self.reduce = reduce
+        self.previous = previous
+        self.current = current
+        self.finished = False
+
+    def __call__(self, rows: ops.TRowsIterable, *args: tp.Any, **kwargs: tp.Any) -> ops.TRowsGenerator:
+        reducer = tp.cast(ops.CombiningReducer, self.reduce.reducer)
+        new = self.reduce.group_states(batch.to_batches(rows))
+        previous: tp.Iterable[tuple[ops.TKey, tp.Any]] = []
+        if self.previous is not None:
+            previous = ((tuple(row['key']), row['state']) for row in rowfile.read_stream(open(self.previous, 'rb')))
+        # both streams are sorted by key, the previous states come first among the equal keys
+        merged = heapq.merge(previous, new, key=itemgetter(0))
+        states = ({'key': key, 'state': _merge_states(reducer, [state for _, state in group])}
+                  for key, group in itertools.groupby(merged, itemgetter(0)))
+        for row in rowfile.write_file(states, self.current):
+            yield reducer.finalize(dict(zip(self.reduce.keys, row['key'])), row['state'])
+        self.finished = True
+
+
+def _merge_states(reducer: ops.CombiningReducer, states: list[tp.Any]) -> tp.Any:
+    state = states[0]
+    for other in states[1:]:
+        state = reducer.merge(state, other)
+    return state
+
+
+class IncrementalState:
+    """
+    State of the incremental runs of a graph (Graph.run(incremental=...)) over inputs that only grow: every run
+    processes only the rows appended since the previous one, the reductions merge them into their persisted states
+    """
+
+    def __init__(self, directory: str, append_only: tp.Collection[str]) -> None:
+        """
+        :param directory: directory to keep the states in
+        :param append_only: names of the data sources and filenames that only grow; files are read from the offset
+            the previous run stopped at, data sources should yield only the rows added since the previous run.
+            The other inputs are read whole and should stay the same, otherwise the state is computed anew
+        """
+        self.directory = directory
+        self.append_only = set(append_only)
+
+    def _manifest(self) -> dict[str, tp.Any] | None:
+        try:
+            with open(os.path.join(self.directory, MANIFEST_FILE)) as f:
+                return tp.cast(dict[str, tp.Any], json.load(f))
+        except (OSError, ValueError):
+            return None
+
+    def _is_append_only(self, source: ops.Operation) -> bool:
+        if isinstance(source, ops.Read):
+            return source.filename in self.append_only
+        return isinstance(source, ops.ReadIterGenerator) and source.name in self.append_only
+
+    def start(self, graph: 'Graph', kwargs: dict[str, tp.Any]) -> 'IncrementalRun':
+        """
+        Plans the run of the graph over the new rows of the inputs
+        :param graph: graph to run
+        :param kwargs: data sources
+        """
+        for source in ckpt.sources(graph):
+            whole = isinstance(source, (ops.ReadRowFile, ops.ReadCsv)) or (
+                isinstance(source, ops.Read) and compressed.detect(source.filename) is not None)
+            if whole and source.filename in self.append_only:
+                raise ValueError(f'{source.filename} can not be read incrementally, it is read whole')
+        digest = hashlib.sha256(ckpt.plan_digest(graph).encode())
+        for source in ckpt.sources(graph):
+            if not self._is_append_only(source):
+                digest.update(ckpt.source_digest(source, kwargs))
+        inputs = digest.hexdigest()
+
+        previous = manifest = self._manifest()
+        if manifest is not None and manifest['inputs'] != inputs:
+            manifest = None
+        for filename, (offset, tail, *_) in manifest['offsets'].items() if manifest is not None else []:
+            if (os.path.getsize(filename) < offset or _tail_digest(filename, offset) != tail
+                    or _resume_offset(filename, offset) is None):
+                manifest = None  # the file was rewritten rather than appended to
+        if manifest is None and previous is not None and any(
+                isinstance(source, ops.ReadIterGenerator) and self._is_append_only(source)
+                for source in ckpt.sources(graph)):
+            raise ValueError(f'State in {self.directory} was computed from other inputs, '
+                             'remove it to compute the state from all the rows')
+        os.makedirs(self.directory, exist_ok=True)
+        if manifest is None:
+            return IncrementalRun(self, graph, 0, inputs, {})
+        return IncrementalRun(self, graph, manifest['generation'] + 1, inputs, manifest['offsets'])
+
+
+class IncrementalRun:
+    """Graph rewritten to process the new rows, commits the new states once the run is finished"""
+
+    def __init__(self, state: IncrementalState, graph: 'Graph', generation: int, inputs: str,
+                 offsets: dict[str, list[tp.Any]]) -> None:
+        self.state = state
+        self.generation = generation
+        self.inputs = inputs
+        self.previous_offsets = offsets
+        self.offsets: dict[str, list[tp.Any]] = {}
+        self.reduces: list[IncrementalReduce] = []
+        self._rewritten: dict[int, tuple['Graph', bool]] = {}
+        self.graph, appended = self._rewrite(graph)
+        if appended:
+            raise ValueError('Result of the graph should be reduced to be computed incrementally')
+
+    def _state_file(self, graph: 'Graph', generation: int) -> str:
+        return os.path.join(self.state.directory, f'{ckpt.plan_digest(graph)[:16]}.{generation}')
+
+    def _rewrite(self, graph: 'Graph') -> tuple['Graph', bool]:
+        """Graph computing the new rows (if the flag is set) or all the rows of the node"""
+        from .graph import Graph
+        if id(graph) in self._rewritten:
+            return self._rewritten[id(graph)]
+        operation = graph._operation
+        parents = [self._rewrite(parent) for parent in graph._parents]
+        appended = [index for index, (_, is_appended) in enumerate(parents) if is_appended]
+        rewritten_parents = [parent for parent, _ in parents]
+
+        result: tuple[Graph, bool]
+        if not graph._parents and self.state._is_append_only(operation):
+            if isinstance(operation, ops.Read):
+                previous = self.previous_offsets.get(operation.filename, [0])
+                start = tp.cast(int, _resume_offset(operation.filename, previous[0]))
+                status = os.stat(operation.filename)
+                end = _complete_end(operation.filename)
+                if previous[2:] == [status.st_size, status.st_mtime_ns]:
+                    # the file is unchanged since the previous run, so its last line is complete without a line end
+                    end = status.st_size
+                self.offsets[operation.filename] = [end, _tail_digest(operation.filename, end), status.st_size,
+                                                    status.st_mtime_ns]
+                result = Graph(AppendedRows(operation, start, end), [], graph._schema), True
+            else:
+                result = graph, True
+        elif not appended:
+            result = Graph(operation, rewritten_parents, graph._schema), False
+        elif isinstance(operation, ops.Reduce) and isinstance(operation.reducer, ops.CombiningReducer):
+            previous = self._state_file(graph, self.generation - 1) if self.generation else None
+            reduce = IncrementalReduce(operation, previous, self._state_file(graph, self.generation))
+            self.reduces.append(reduce)
+            result = Graph(reduce, rewritten_parents, graph._schema), False
+        elif isinstance(operation, _LINEAR):
+            result = Graph(operation, rewritten_parents, graph._schema), True
+        elif (isinstance(operation, ops.Join) and len(appended) == 1
+              and appended[0] in _LINEAR_JOINERS.get(type(operation.joiner), set())):
+            result = Graph(operation, rewritten_parents, graph._schema), True
+        else:
+            raise ValueError(f'{type(operation).__name__} can not be computed incrementally')
+        self._rewritten[id(graph)] = result
+        return result
+
+    def commit(self) -> None:
+        """Makes the states of this run the current ones, if every incremental reduce has finished"""
+        if not all(reduce.finished for reduce in self.reduces):
+            return
+        manifest = {'generation': self.generation, 'inputs': self.inputs, 'offsets': self.offsets}
+        temporary = os.path.join(self.state.directory, f'.{MANIFEST_FILE}.{os.getpid()}')
+        with open(temporary, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(temporary, os.path.join(self.state.directory, MANIFEST_FILE))
+        # states of the previous runs (and of the unfinished ones) are not needed anymore
+        current = {os.path.basename(reduce.current) for reduce in self.reduces}
+        for entry in os.scandir(self.state.directory):
+            if _STATE_FILE.fullmatch(entry.name) and entry.name not in current:
+                os.unlink(entry.path)
@@ -0,0 +1,257 @@
+import bisect
+import heapq
+import itertools
+import json
+import mmap
+import os
+import pickle
+import struct
+import typing as tp
+import zlib
+from operator import itemgetter
+
+from . import operations as ops
+
+MAGIC = b'CGIX'
+VERSION = 1
+BLOCK_WORDS = 64  # words in a block, the sparse index keeps the first word of every block
+MANIFEST_FILE = 'segments.json'
+
+_FOOTER = struct.Struct('<Q4s')  # offset of the sparse index and the magic
+_HEADER = struct.Struct('<4sI')  # magic and version
+
+TPostings = list[tuple[tp.Any, ...]]
+
+
+def _encode(payload: tp.Any) -> bytes:
+    return zlib.compress(pickle.dumps(payload, pickle.HIGHEST_PROTOCOL), 1)
+
+
+def _decode(data: bytes | mmap.mmap) -> tp.Any:
+    return pickle.loads(zlib.decompress(data))
+
+
+def write_segment(filename: str, words: tp.Iterable[tuple[str, TPostings]], columns: tuple[str, ...]) -> int:
+    """
+    Writes a segment: blocks of words with their postings, followed by the sparse index of the blocks
+    :param filename: file to write
+    :param words: words in ascending order with their postings (tuples of the values of the columns)
+    :param columns: columns of the postings
+    :return: number of words
+    """
+    sparse: list[tuple[str, int, int]] = []
+    count = 0
+    try:
+        with open(filename + '.tmp', 'wb') as f:
+            f.write(_HEADER.pack(MAGIC, VERSION))
+            iterator = iter(words)
+            while block := list(itertools.islice(iterator, BLOCK_WORDS)):
+                data = _encode(([word for word, _ in block], [postings for _, postings in block]))
+                sparse.append((block[0][0], f.tell(), len(data)))
+                f.write(data)
+                count += len(block)
+            index_offset = f.tell()
+            f.write(_encode({'columns': columns, 'blocks': sparse, 'words': count}))
+            f.write(_FOOTER.pack(index_offset, MAGIC))
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        os.unlink(filename + '.tmp')
+        raise
+    os.replace(filename + '.tmp', filename)
+    return count
+
+
+class Segment:
+    """Memory mapped segment, only the sparse index is kept in memory"""
+
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = _HEADER.unpack_from(self._map, 0)
+        index_offset, footer_magic = _FOOTER.unpack_from(self._map, len(self._map) - _FOOTER.size)
+        if magic != MAGIC or footer_magic != MAGIC or version != VERSION:
+            raise ValueError(f'{filename} is not an index segment')
+        index = _decode(self._map[index_offset:len(self._map) - _FOOTER.size])
+        self.columns: tuple[str, ...] = index['columns']
+        self.words: int = index['words']
+        self._blocks: list[tuple[str, int, int]] = index['blocks']
+        self._first_words = [first_word for first_word, _, _ in self._blocks]
+
+    def _block(self, index: int) -> tuple[list[str], list[TPostings]]:
+        _, offset, length = self._blocks[index]
+        return tp.cast(tuple[list[str], list[TPostings]], _decode(self._map[offset:offset + length]))
+
+    def get(self, word: str) -> TPostings:
+        """Postings of the word, empty if it is not in the segment"""
+        index = bisect.bisect_right(self._first_words, word) - 1
+        if index < 0:
+            return []
+        words, postings = self._block(index)
+        position = bisect.bisect_left(words, word)
+        return postings[position] if position < len(words) and words[position] == word else []
+
+    def scan(self, start: str = '') -> tp.Generator[tuple[str, TPostings], None, None]:
+        """Words not less than start in ascending order with their postings"""
+        for index in range(max(bisect.bisect_right(self._first_words, start) - 1, 0), len(self._blocks)):
+            words, postings = self._block(index)
+            position = bisect.bisect_left(words, start)
+            yield from zip(words[position:], postings[position:])
+
+    def close(self) -> None:
+        self._map.close()
+
+
+class InvertedIndex:
+    """
+    On-disk index of the rows of inverted_index_graph (or of any rows sorted by a word column): each added batch
+    of rows becomes a segment, lookups combine the postings of the word from all the segments
+    """
+
+    def __init__(self, directory: str, word_column: str = 'text', score_column: str | None = 'tf_idf',
+                 top: int | None = 3) -> None:
+        """
+        :param directory: directory of the segments
+        :param word_column: column of the rows holding the word
+        :param score_column: column to rank the rows of a word by (descending), None to keep them in order of addition
+        :param top: number of rows of a word to return (and to keep when merging segments), None for all of them
+        """
+        self.directory = directory
+        self.word_column = word_column
+        self.score_column = score_column
+        self.top = top
+        self._segments: dict[str, Segment] = {}
+        os.makedirs(directory, exist_ok=True)
+        self.refresh()
+
+    def __enter__(self) -> 'InvertedIndex':
+        return self
+
+    def __exit__(self, *exc_info: tp.Any) -> None:
+        self.close()
+
+    def _manifest(self) -> dict[str, tp.Any]:
+        try:
+            with open(os.path.join(self.directory, MANIFEST_FILE)) as f:
+                return tp.cast(dict[str, tp.Any], json.load(f))
+        except FileNotFoundError:
+            return {'segments': [], 'next': 0}
+
+    def _write_manifest(self, manifest: dict[str, tp.Any]) -> None:
+        temporary = os.path.join(self.directory, f'.{MANIFEST_FILE}.{os.getpid()}')
+        with open(temporary, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(temporary, os.path.join(self.directory, MANIFEST_FILE))
+
+    def refresh(self) -> None:
+        """Opens the segments added (and merged) since the index was opened, possibly by another process"""
+        names = self._manifest()['segments']
+        for name in set(self._segments) - set(names):
+            self._segments.pop(name).close()
+        self._segments = {name: self._segments.get(name) or Segment(os.path.join(self.directory, name))
+                          for name in names}
+
+    @property
+    def segments(self) -> list[Segment]:
+        return list(self._segments.values())
+
+    def _postings(self, rows: ops.TRowsIterable) -> tuple[tuple[str, ...], tp.Iterator[tuple[str, TPostings]]]:
+        iterator = iter(rows)
+        first = next(iterator, None)
+        if first is None:
+            return (), iter([])
+        columns = tuple(column for column in first if column != self.word_column)
+
+        def words() -> tp.Generator[tuple[str, TPostings], None, None]:
+            previous: str | None = None
+            for word, group in itertools.groupby(itertools.chain([first], iterator), itemgetter(self.word_column)):
+                if previous is not None and word <= previous:
+                    raise ValueError('Rows should be sorted by the word column')
+                previous = word
+                yield word, [tuple(row[column] for column in columns) for row in group]
+
+        return columns, words()
+
+    def add(self, rows: ops.TRowsIterable) -> int:
+        """
+        Writes the rows as a new segment
+        :param rows: rows sorted by the word column, all with the same columns
+        :return: number of words in the segment
+        """
+        columns, words = self._postings(rows)
+        if not columns:
+            return 0
+        if self.segments and self.segments[0].columns != columns:
+            raise ValueError(f'Rows should have the columns of the index: {self.segments[0].columns}')
+        manifest = self._manifest()
+        name = f'{manifest["next"]:06d}.seg'
+        count = write_segment(os.path.join(self.directory, name), words, columns)
+        manifest['segments'].append(name)
+        manifest['next'] += 1
+        self._write_manifest(manifest)
+        self.refresh()
+        return count
+
+    def _combine(self, columns: tuple[str, ...], postings: list[TPostings]) -> TPostings:
+        combined = [posting for part in postings for posting in part]
+        if self.score_column is not None and self.score_column in columns:
+            score = itemgetter(columns.index(self.score_column))
+            combined.sort(key=score, reverse=True)
+        return combined if self.top is None else combined[:self.top]
+
+    def _rows(self, word: str, columns: tuple[str, ...], postings: TPostings) -> list[ops.TRow]:
+        return [dict(zip(columns, posting), **{self.word_column: word}) for posting in postings]
+
+    def lookup(self, word: str) -> list[ops.TRow]:
+        """Rows of the word"""
+        segments = self.segments
+        if not segments:
+            return []
+        columns = segments[0].columns
+        return self._rows(word, columns, self._combine(columns, [segment.get(word) for segment in segments]))
+
+    def _scan(self, start: str) -> tp.Generator[tuple[str, TPostings], None, None]:
+        segments = self.segments
+        if not segments:
+            return
+        columns = segments[0].columns
+        # words of the segments are merged in order, postings of equal words are combined
+        merged = heapq.merge(*(segment.scan(start) for segment in segments), key=itemgetter(0))
+        for word, group in itertools.groupby(merged, itemgetter(0)):
+            yield word, self._combine(columns, [postings for _, postings in group])
+
+    def prefix(self, prefix: str, limit: int | None = None) -> tp.Generator[ops.TRow, None, None]:
+        """
+        Rows of the words starting with the prefix, in the order of the words
+        :param prefix: prefix of the words
+        :param limit: maximal number of words
+        """
+        columns = self.segments[0].columns if self.segments else ()
+        words = itertools.takewhile(lambda item: item[0].startswith(prefix), self._scan(prefix))
+        for word, postings in itertools.islice(words, limit):
+            yield from self._rows(word, columns, postings)
+
+    def merge(self) -> None:
+        """Merges all the segments into one, keeping the top rows of every word"""
+        self.refresh()
+        if len(self._segments) < 2:
+            return
+        merged = list(self._segments)
+        manifest = self._manifest()
+        name = f'{manifest["next"]:06d}.seg'
+        write_segment(os.path.join(self.directory, name), self._scan(''), self.segments[0].columns)
+        # segments added by other processes in the meantime stay as they are
+        manifest = self._manifest()
+        manifest['segments'] = [name] + [segment for segment in manifest['segments'] if segment not in merged]
+        manifest['next'] = max(manifest['next'], int(name.split('.')[0]) + 1)
+        self._write_manifest(manifest)
+        self.refresh()
+        # readers which have the merged segments mapped keep reading them
+        for old in merged:
+            os.unlink(os.path.join(self.directory, old))
+
+    def close(self) -> None:
+        for segment in self._segments.values():
+            segment.close()
+        self._segments = {}
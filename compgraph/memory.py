@@ -0,0 +1,283 @@
+import heapq
+import itertools
+import os
+import resource
+import sys
+import struct
+import tempfile
+import typing as tp
+from operator import itemgetter
+
+from . import rowfile
+from .batch import BatchList, COLUMNAR_GROUP_SIZE, TRow, to_batches
+
+T = tp.TypeVar('T')
+
+CHECK_EVERY = 1024  # buffered items between two measurements of the memory usage
+SPILL_FRACTION = 0.8  # buffers are spilled once the usage reaches this fraction of the limit
+SPILL_CHUNK_SIZE = 1024  # items encoded together into a spill file
+
+_SPILL_LENGTH = struct.Struct('<I')
+
+_active: list['MemoryBudget'] = []
+
+
+def current() -> tp.Optional['MemoryBudget']:
+    """Budget of the run being executed, if any"""
+    return _active[-1] if _active else None
+
+
+def resident_memory(pid: int | None = None) -> int:
+    """Current resident memory of the process in bytes (the peak one where /proc is not available)"""
+    try:
+        with open(f'/proc/{pid or "self"}/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class MemoryBudget:
+    """
+    Memory limit of a run (Graph.run(memory_budget=...)): the buffering operators (sorts, join groups and word
+    frequency tables) spill their buffers to temporary files when the memory of the process running the graph,
+    together with the process doing the buffering (such as a sorting one), approaches the limit
+    """
+
+    def __init__(self, limit: int, spill_fraction: float = SPILL_FRACTION) -> None:
+        """
+        :param limit: limit in bytes
+        :param spill_fraction: fraction of the limit at which the buffers are spilled
+        """
+        if limit <= 0:
+            raise ValueError('Memory limit should be positive')
+        self.limit = limit
+        self.threshold = limit * spill_fraction
+        self.owner = os.getpid()
+        self.peaks: dict[str, int] = {}
+        self.spills: dict[str, int] = {}
+        self._countdown = -1
+        self._exceeded = False
+
+    def __enter__(self) -> 'MemoryBudget':
+        _active.append(self)
+        return self
+
+    def __exit__(self, *exc_info: tp.Any) -> None:
+        _active.remove(self)
+
+    def usage(self) -> int:
+        """Resident memory of the running process and of the one the budget was created in"""
+        usage = resident_memory()
+        if os.getpid() != self.owner:
+            try:
+                usage += resident_memory(self.owner)
+            except (OSError, ValueError):
+                pass
+        return usage
+
+    def exceeded(self, items: int = 1) -> bool:
+        """
+        Whether the buffers should be spilled, the memory is measured once CHECK_EVERY items were buffered
+        :param items: number of items buffered since the previous call
+        """
+        self._countdown -= items
+        if self._countdown < 0:
+            self._countdown = CHECK_EVERY
+            self._exceeded = self.usage() >= self.threshold
+        return self._exceeded
+
+    def record(self, operator: str, buffered: int, spills: int = 0) -> None:
+        """
+        Accounts the buffer of an operator
+        :param operator: operator description
+        :param buffered: approximate size of the buffer in bytes
+        :param spills: number of times the buffer was spilled
+        """
+        self.peaks[operator] = max(self.peaks.get(operator, 0), buffered)
+        self.spills[operator] = self.spills.get(operator, 0) + spills
+
+    def report(self) -> dict[str, dict[str, int]]:
+        """Peak buffered bytes and number of spills of every operator"""
+        return {operator: {'peak_buffered': peak, 'spills': self.spills.get(operator, 0)}
+                for operator, peak in self.peaks.items()}
+
+
+class BufferLimit:
+    """
+    Decides when a growing buffer is spilled: the first time once the budget is exceeded, then every time
+    it reaches the size it had then (memory freed by a spill is reused by the process rather than returned
+    to the system, so the resident memory does not decrease after it)
+    """
+
+    def __init__(self, budget: MemoryBudget) -> None:
+        self.budget = budget
+        self.size: int | None = None
+
+    def full(self, buffered: int, added: int = 1) -> bool:
+        """
+        :param buffered: number of items in the buffer
+        :param added: number of items added since the previous call
+        """
+        if self.size is not None:
+            return buffered >= self.size
+        if self.budget.exceeded(added):
+            self.size = max(buffered, CHECK_EVERY)
+            return True
+        return False
+
+
+class SpillFile:
+    """Items written to a temporary file, may be read back any number of times"""
+
+    def __init__(self) -> None:
+        self._file = tempfile.TemporaryFile()
+        self.size = 0
+
+    def write(self, items: tp.Iterable[tp.Any]) -> None:
+        self._file.seek(0, os.SEEK_END)
+        for chunk in _chunks(items, SPILL_CHUNK_SIZE):
+            data = rowfile.encode_batch(chunk)
+            self._file.write(_SPILL_LENGTH.pack(len(data)))
+            self._file.write(data)
+            self.size += len(chunk)
+
+    def __iter__(self) -> tp.Iterator[tp.Any]:
+        position = 0
+        while True:
+            # the position is kept between the chunks, so the file may be read by several iterators at once
+            self._file.seek(position)
+            header = self._file.read(_SPILL_LENGTH.size)
+            if not header:
+                return
+            (length,) = _SPILL_LENGTH.unpack(header)
+            chunk = rowfile.decode_batch(self._file.read(length))
+            position = self._file.tell()
+            yield from chunk
+
+    def __len__(self) -> int:
+        return self.size
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def _chunks(items: tp.Iterable[T], size: int) -> tp.Iterator[list[T]]:
+    iterator = iter(items)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+def spill_sorted(items: tp.Iterable[T], key: tp.Callable[[T], tp.Any]) -> SpillFile:
+    """Sorted run of the items written to a spill file"""
+    run = SpillFile()
+    run.write(sorted(items, key=key))
+    return run
+
+
+def merge_runs(runs: list[SpillFile], last: tp.Iterable[T], key: tp.Callable[[T], tp.Any]) -> tp.Iterator[T]:
+    """Merges sorted runs, items with equal keys keep the order of the runs (so that the sort stays stable)"""
+    return heapq.merge(*runs, last, key=key)
+
+
+def external_sorted(items: tp.Iterable[T], key: tp.Callable[[T], tp.Any], budget: MemoryBudget | None,
+                    operator: str) -> tp.Iterator[T]:
+    """
+    Stable sort of the items, spilling sorted runs when the memory budget is exceeded
+    :param items: items to sort
+    :param key: sorting key
+    :param budget: memory budget, everything is sorted in memory without it
+    :param operator: operator description to account the buffer to
+    """
+    if budget is None:
+        return iter(sorted(items, key=key))
+    runs: list[SpillFile] = []
+    buffer: list[T] = []
+    limit = BufferLimit(budget)
+    for item in items:
+        buffer.append(item)
+        if limit.full(len(buffer)):
+            budget.record(operator, sys.getsizeof(buffer), spills=1)
+            runs.append(spill_sorted(buffer, key))
+            buffer = []
+    budget.record(operator, sys.getsizeof(buffer))
+    buffer.sort(key=key)
+    return merge_runs(runs, buffer, key) if runs else iter(buffer)
+
+
+def materialize(rows: tp.Iterable[TRow], operator: str) -> list[TRow] | BatchList | SpillFile:
+    """
+    Materializes a group of rows (to be iterated several times). Without a memory budget the rows are kept
+    as they are; under a budget large groups are stored as columnar batches, which take less memory but are
+    decoded on every iteration, and spilled to a file if the budget is exceeded while they are buffered
+    :param rows: rows of the group
+    :param operator: operator description to account the buffer to
+    """
+    budget = current()
+    if budget is None:
+        return list(rows)
+    iterator = iter(rows)
+    head = list(itertools.islice(iterator, COLUMNAR_GROUP_SIZE))
+    if len(head) < COLUMNAR_GROUP_SIZE:
+        return head
+    batches = []
+    buffered = 0
+    for batch in to_batches(itertools.chain(head, iterator)):
+        batches.append(batch)
+        buffered += sum(sys.getsizeof(column) for column in batch.columns.values())
+        if budget.exceeded(len(batch)):
+            budget.record(operator, buffered, spills=1)
+            spilled = SpillFile()
+            spilled.write(row for batch in batches for row in batch.rows())
+            spilled.write(iterator)
+            return spilled
+    budget.record(operator, buffered)
+    return BatchList(batches)
+
+
+def count_values(pairs: tp.Iterable[tuple[tp.Any, tp.Any]],
+                 operator: str) -> tuple[tp.Any, tp.Iterable[tuple[tp.Any, tp.Any]]]:
+    """
+    Sums the weights of equal values, the table is spilled (as runs sorted by value) when the memory budget
+    of the run is exceeded
+    :param pairs: (value, weight) pairs
+    :param operator: operator description to account the table to
+    :return: total weight and (value, summed weight) pairs in the order of first occurrence of the values
+    """
+    budget = current()
+    counts: dict[tp.Any, tp.Any] = {}
+    total = 0
+    if budget is None:
+        for value, weight in pairs:
+            counts[value] = counts.get(value, 0) + weight
+            total += weight
+        return total, counts.items()
+
+    # the order of the first occurrences is kept as the index of the value in the table of the first occurrence
+    runs: list[SpillFile] = []
+    first_seen: dict[tp.Any, int] = {}
+    seen = 0
+    limit = BufferLimit(budget)
+    for value, weight in pairs:
+        total += weight
+        if value in counts:
+            counts[value] += weight
+            continue
+        counts[value] = weight
+        first_seen[value] = seen
+        seen += 1
+        if limit.full(len(counts)):
+            budget.record(operator, sys.getsizeof(counts) * 2, spills=1)
+            runs.append(spill_sorted(((value, counts[value], first_seen[value]) for value in counts), itemgetter(0)))
+            counts, first_seen = {}, {}
+    budget.record(operator, sys.getsizeof(counts) * 2)
+    if not runs:
+        return total, counts.items()
+
+    # the same value may be in several runs: their weights are summed and the first occurrence is the earliest one
+    last = sorted(((value, counts[value], first_seen[value]) for value in counts), key=itemgetter(0))
+    merged = ((value, sum(weight for _, weight, _ in group), min(index for _, _, index in group))
+              for value, group in ((value, list(group)) for value, group in
+                                   itertools.groupby(merge_runs(runs, last, itemgetter(0)), itemgetter(0))))
+    ordered = external_sorted(merged, itemgetter(2), budget, operator)
+    return total, ((value, weight) for value, weight, _ in ordered)
@@ -1,7 +1,7 @@
 from abc import abstractmethod, ABC
 from collections.abc import Callable, Sequence
-from collections import defaultdict
 import calendar
+import csv
 import dateutil.parser
 import heapq
 import itertools
@@ -11,9 +11,21 @@ import re
 import typing as tp
 from operator import itemgetter
 
+from .batch import BatchList, RowBatch, as_list, datetime_column, exact_integers, from_batches, numeric_columns, \
+    segment_starts, to_batches, np
+from . import columnfile
+from . import compressed
+from . import memory
+from . import rowfile
+
 TRow = dict[str, tp.Any]
 TRowsIterable = tp.Iterable[TRow]
 TRowsGenerator = tp.Generator[TRow, None, None]
+TSchema = tuple[str, ...]
+TKey = tuple[tp.Any, ...]
+
+CSV_BUFFER_SIZE = 1 << 20  # bytes read from a CSV file at once
+CSV_CHUNK_SIZE = 4096  # records converted together, column by column
 
 
 class Operation(ABC):  # pragma: no cover
@@ -28,11 +40,145 @@ class Read(Operation):
         self.parser = parser
 
     def __call__(self, *args: tp.Any, **kwargs: tp.Any) -> TRowsGenerator:
-        with open(self.filename) as f:
-            for line in f:
+        with compressed.open_lines(self.filename) as lines:
+            for line in lines:
                 yield self.parser(line)
 
 
+class ProjectedParser:
+    """Parser keeping only the given columns of the rows parsed by another one, see Graph.graph_from_file"""
+
+    def __init__(self, parser: Callable[[str], TRow], columns: Sequence[str]) -> None:
+        """
+        :param parser: parser from string to Row
+        :param columns: columns to keep, the missing ones are absent from the rows
+        """
+        self.parser = parser
+        self.columns = tuple(columns)
+
+    def __call__(self, line: str) -> TRow:
+        row = self.parser(line)
+        return {column: row[column] for column in self.columns if column in row}
+
+
+class ReadRowFile(Operation):
+    """Reads the rows of a row file (rowfile.write), see Graph.graph_from_file"""
+
+    def __init__(self, filename: str, columns: Sequence[str] | None = None) -> None:
+        """
+        :param filename: row file to read from
+        :param columns: columns to keep, the missing ones are absent from the rows; None to keep all of them
+        """
+        self.filename = filename
+        self.columns = tuple(columns) if columns is not None else None
+
+    def read(self, part: int = 0, parts: int = 1) -> TRowsGenerator:
+        """Rows of the batches of the file with the index equal to part modulo parts (of all of them by default)"""
+        index = rowfile.batch_index(self.filename) if parts > 1 else None
+        if index is not None:
+            rows: TRowsIterable = rowfile.read_batches(self.filename, range(part, len(index), parts))
+        elif part == 0:  # the file is read sequentially when its writing was interrupted
+            rows = rowfile.read_stream(open(self.filename, 'rb'))
+        else:
+            rows = []
+        if self.columns is None:
+            yield from rows
+            return
+        for row in rows:
+            yield {column: row[column] for column in self.columns if column in row}
+
+    def row_count(self) -> int:
+        index = rowfile.batch_index(self.filename)
+        if index is None:
+            return sum(1 for _ in rowfile.read_stream(open(self.filename, 'rb')))
+        return sum(rows for _, rows in index)
+
+    def __call__(self, *args: tp.Any, **kwargs: tp.Any) -> TRowsGenerator:
+        return self.read()
+
+
+class ReadColumnFile(ReadRowFile):
+    """Reads the rows of a column file (columnfile.write) column by column, see Graph.graph_from_file"""
+
+    def __init__(self, filename: str, columns: Sequence[str] | None = None,
+                 where: dict[str, columnfile.TRange] | None = None) -> None:
+        """
+        :param filename: column file to read from
+        :param columns: columns to read, the missing ones are absent from the rows; None to read all of them
+        :param where: inclusive ranges (None for an open side) of the values of the columns to keep the rows within,
+            row groups ruled out by the statistics of their values are skipped
+        """
+        super().__init__(filename, columns)
+        self.where = dict(where or {})
+
+    def read(self, part: int = 0, parts: int = 1) -> TRowsGenerator:
+        """Rows of the row groups with the index equal to part modulo parts (of all of them by default)"""
+        return columnfile.ColumnFile(self.filename).read(self.columns, self.where, part, parts)
+
+    def row_count(self) -> int:
+        return columnfile.ColumnFile(self.filename).rows
+
+
+class ReadCsv(Operation):
+    """
+    Reads the records of a CSV (or TSV) file, possibly compressed, with the csv module, converting the values
+    column by column
+    """
+
+    def __init__(self, filename: str, columns: Sequence[str] | dict[str, Callable[[str], tp.Any]] | None = None,
+                 delimiter: str = ',', header: bool = True) -> None:
+        """
+        :param filename: file to read from
+        :param columns: columns to read, or columns mapped to the converters of their values (str keeps the strings,
+            empty values of the other columns become None); None for all the columns named by the header.
+            With a header the columns are picked by name, without it they name the fields in order
+        :param delimiter: ',' for CSV, '\t' for TSV
+        :param header: the first record names the fields
+        """
+        if columns is None and not header:
+            raise ValueError('Columns of a file without a header should be given')
+        self.filename = filename
+        self.delimiter = delimiter
+        self.header = header
+        self.converters: dict[str, Callable[[str], tp.Any]] | None = None
+        if columns is not None:
+            self.converters = dict(columns) if isinstance(columns, dict) else dict.fromkeys(columns, str)
+
+    def _chunks(self, size: int) -> tp.Generator[tuple[list[str], list[list[tp.Any]]], None, None]:
+        """Names of the columns with chunks of their converted values"""
+        with compressed.open_lines(self.filename, newline='', buffering=CSV_BUFFER_SIZE) as f:
+            records = csv.reader(f, delimiter=self.delimiter)
+            if self.header:
+                fields = next(records, [])
+                converters = self.converters if self.converters is not None else dict.fromkeys(fields, str)
+                if missing := [name for name in converters if name not in fields]:
+                    raise ValueError(f'Columns {missing} are not in the header of {self.filename}')
+                positions = [fields.index(name) for name in converters]
+            else:
+                converters = tp.cast(dict[str, Callable[[str], tp.Any]], self.converters)
+                positions = list(range(len(converters)))
+            names, functions = list(converters), list(converters.values())
+            while chunk := list(itertools.islice(records, size)):
+                chunk = [record for record in chunk if record]  # blank lines
+                try:
+                    fields_columns = [[record[position] for record in chunk] for position in positions]
+                except IndexError:
+                    raise ValueError(f'A record of {self.filename} has fewer fields than the columns') from None
+                yield names, [values if convert is str else [convert(value) if value else None for value in values]
+                              for convert, values in zip(functions, fields_columns)]
+
+    def read_batches(self, size: int) -> tp.Generator[RowBatch, None, None]:
+        """Records as columnar batches of at most size rows"""
+        for names, columns in self._chunks(size):
+            if columns and columns[0]:
+                yield RowBatch(dict(zip(names, columns)))
+
+    def __call__(self, *args: tp.Any, **kwargs: tp.Any) -> TRowsGenerator:
+        for names, columns in self._chunks(CSV_CHUNK_SIZE):
+            for values in zip(*columns):
+                yield dict(zip(names, values))
+
+
 class ReadIterGenerator(Operation):
     def __init__(self, name: str) -> None:
         self.name = name
@@ -55,6 +201,20 @@ class Mapper(ABC):  # pragma: no cover
         """
         pass
 
+    def output_schema(self, schema: TSchema) -> TSchema | None:
+        """
+        Columns of the rows produced by the mapper (None if they are not known)
+        :param schema: columns of the input rows
+        """
+        return None
+
+    def map_batch(self, batch: RowBatch) -> tp.Iterable[RowBatch]:
+        """
+        Batch version of the mapper, by default the mapper is applied row by row
+        :param batch: rows with the same columns
+        """
+        return to_batches(itertools.chain.from_iterable(self(row) for row in batch.rows()), max(len(batch), 1))
+
 
 class Map(Operation):
     def __init__(self, mapper: Mapper) -> None:
@@ -64,6 +224,10 @@ class Map(Operation):
         for row in rows:
             yield from self.mapper(row)
 
+    def map_batches(self, batches: tp.Iterable[RowBatch]) -> tp.Generator[RowBatch, None, None]:
+        for batch in batches:
+            yield from self.mapper.map_batch(batch)
+
 
 class Reducer(ABC):  # pragma: no cover
     """Base class for reducers"""
@@ -76,11 +240,54 @@ class Reducer(ABC):  # pragma: no cover
         pass
 
 
+class CombiningReducer(Reducer):
+    """Base class for reducers which result can be computed from partial states of parts of the group"""
+
+    @abstractmethod
+    def partial_states(self, batch: RowBatch, starts: list[int]) -> list[tp.Any]:
+        """
+        :param batch: rows sorted by group keys
+        :param starts: indices of the first rows of the groups in the batch
+        :return: partial state of each group
+        """
+        pass
+
+    @abstractmethod
+    def merge(self, state_a: tp.Any, state_b: tp.Any) -> tp.Any:
+        """Combine partial states of two parts of the same group"""
+        pass
+
+    @abstractmethod
+    def finalize(self, key_row: TRow, state: tp.Any) -> TRow:
+        """
+        :param key_row: group keys values
+        :param state: state of the whole group
+        """
+        pass
+
+
+def _segment_sums(batch: RowBatch, column: str, starts: list[int]) -> list[tp.Any]:
+    arrays = numeric_columns(batch, [column])
+    if arrays is not None:
+        return as_list(np.add.reduceat(exact_integers(arrays[0]), starts))
+    values = batch.columns[column]
+    ends = starts[1:] + [len(batch)]
+    return [sum(values[start + 1:end], values[start]) for start, end in zip(starts, ends)]
+
+
+def _segment_counts(batch: RowBatch, starts: list[int]) -> list[int]:
+    ends = starts[1:] + [len(batch)]
+    return [end - start for start, end in zip(starts, ends)]
+
+
 def _safe_groupby(rows: TRowsIterable, keys: Sequence[str]) -> \
         tp.Generator[tuple[tp.Any, tp.Iterable[dict[str, tp.Any]]], None, None]:
     if keys:
         groups = itertools.groupby(rows, itemgetter(*keys))
-        prev_keys, group = next(groups)
+        first = next(groups, None)
+        if first is None:
+            return
+        prev_keys, group = first
         yield prev_keys, group
 
         for keys, group in groups:
@@ -101,6 +308,36 @@ class Reduce(Operation):
         for _, group in _safe_groupby(rows, self.keys):
             yield from self.reducer(tuple(self.keys), group)
 
+    def reduce_batches(self, batches: tp.Iterable[RowBatch]) -> TRowsGenerator:
+        """Reduce stream of batches sorted by keys; only combining reducers are vectorized"""
+        if not isinstance(self.reducer, CombiningReducer):
+            yield from self(from_batches(batches))
+            return
+        for key, state in self.group_states(batches):
+            yield self.reducer.finalize(dict(zip(self.keys, key)), state)
+
+    def group_states(self, batches: tp.Iterable[RowBatch]) -> tp.Generator[tuple[TKey, tp.Any], None, None]:
+        """Key and state of every group of a stream of batches sorted by keys, the reducer should be combining"""
+        reducer = tp.cast(CombiningReducer, self.reducer)
+        keys = tuple(self.keys)
+        current_key: tuple[tp.Any, ...] | None = None
+        state: tp.Any = None
+        for batch in batches:
+            starts = segment_starts(batch, keys)
+            key_columns = [as_list(batch.columns[key]) for key in keys]
+            for start, partial_state in zip(starts, reducer.partial_states(batch, starts)):
+                key = tuple(column[start] for column in key_columns)
+                if current_key is not None and key == current_key:
+                    state = reducer.merge(state, partial_state)
+                    continue
+                if current_key is not None:
+                    if current_key > key:
+                        raise ValueError('Stream is not sorted by keys')
+                    yield current_key, state
+                current_key, state = key, partial_state
+        if current_key is not None:
+            yield current_key, state
+
 
 class Joiner(ABC):
     """Base class for joiners"""
@@ -118,26 +355,57 @@ class Joiner(ABC):
         """
         pass
 
-    def common_join_part(self, keys: Sequence[str], left_rows: TRowsIterable, right_rows: list[TRow],
+    def common_join_part(self, keys: Sequence[str], left_rows: TRowsIterable,
+                         right_rows: list[TRow] | BatchList | memory.SpillFile,
                          join_type: str = 'any') -> TRowsGenerator:
         if join_type == 'right':
             relevant_suffix_a, relevant_suffix_b = self._b_suffix, self._a_suffix
         else:
             relevant_suffix_a, relevant_suffix_b = self._a_suffix, self._b_suffix
 
+        # layouts of the joined rows by the columns of the left and the right rows, a group has few of them
+        plans: dict[tuple[TSchema, TSchema], tuple[TSchema, tuple[tuple[str, bool, str], ...]]] = {}
+        right_runs = _schema_runs(right_rows) if isinstance(right_rows, list) else None
         for left_row in left_rows:
-            for right_row in right_rows:
-                new_row = right_row.copy()
-                for key, value in left_row.items():
-                    if key not in new_row:
-                        new_row.update({key: value})
-                    else:
-                        if key not in keys:
-                            old_right_value = new_row[key]
-                            del new_row[key]
-                            new_row.update({key + relevant_suffix_a: value})
-                            new_row.update({key + relevant_suffix_b: old_right_value})
-                yield new_row
+            left_schema = tuple(left_row)
+            for right_schema, rows in right_runs if right_runs is not None else _schema_runs(right_rows):
+                plan = plans.get((left_schema, right_schema))
+                if plan is None:
+                    plan = plans[left_schema, right_schema] = _join_plan(left_schema, right_schema, keys,
+                                                                         relevant_suffix_a, relevant_suffix_b)
+                kept, appended = plan
+                whole = len(kept) == len(right_schema)
+                for right_row in rows:
+                    new_row = right_row.copy() if whole else {key: right_row[key] for key in kept}
+                    for new_key, from_left, key in appended:
+                        new_row[new_key] = left_row[key] if from_left else right_row[key]
+                    yield new_row
+
+
+def _schema_runs(rows: list[TRow] | BatchList | memory.SpillFile) -> tp.Iterable[tuple[TSchema, tp.Iterable[TRow]]]:
+    """Consecutive rows with the same columns, together with the columns"""
+    if isinstance(rows, BatchList):
+        return ((batch.schema, batch.rows()) for batch in rows.batches)
+    if isinstance(rows, list):
+        return [(schema, list(run)) for schema, run in itertools.groupby(rows, key=tuple)]
+    return itertools.groupby(rows, key=tuple)
+
+
+def _join_plan(left_schema: TSchema, right_schema: TSchema, keys: Sequence[str], suffix_a: str,
+               suffix_b: str) -> tuple[TSchema, tuple[tuple[str, bool, str], ...]]:
+    """
+    Precompiled layout of joined rows for given columns of the left and right rows
+    :return: right columns kept in place, (new column, is taken from left row, column) appended after them
+    """
+    kept = list(right_schema)
+    appended = []
+    for key in left_schema:
+        if key not in right_schema:
+            appended.append((key, True, key))
+        elif key not in keys:
+            kept.remove(key)
+            appended += [(key + suffix_a, True, key), (key + suffix_b, False, key)]
+    return tuple(kept), tuple(appended)
 
 
 class Join(Operation):
@@ -178,12 +446,63 @@ class Join(Operation):
                 break
 
 
+class Limit(Operation):
+    """Leave only first n rows, the input is not read further"""
+
+    def __init__(self, n: int) -> None:
+        """
+        :param n: number of rows to leave
+        """
+        if n < 0:
+            raise ValueError('Limit should be non-negative')
+        self.n = n
+
+    def __call__(self, rows: TRowsIterable, *args: tp.Any, **kwargs: tp.Any) -> TRowsGenerator:
+        iterator = iter(rows)
+        try:
+            yield from itertools.islice(iterator, self.n)
+        finally:
+            # stops the upstream generators right away: files are closed and sorting processes terminated
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+
+
+class Top(Operation):
+    """Leave first n rows in the order of keys (the same rows sort + limit leave) keeping only n rows in memory"""
+
+    def __init__(self, n: int, keys: Sequence[str], descending: bool = False) -> None:
+        """
+        :param n: number of rows to leave
+        :param keys: sorting keys
+        :param descending: take the rows with the largest keys first
+        """
+        if n < 0:
+            raise ValueError('Limit should be non-negative')
+        if not keys:
+            raise ValueError('Keys should not be empty')
+        self.n = n
+        self.keys = keys
+        self.descending = descending
+
+    def __call__(self, rows: TRowsIterable, *args: tp.Any, **kwargs: tp.Any) -> TRowsGenerator:
+        select = heapq.nlargest if self.descending else heapq.nsmallest
+        yield from select(self.n, rows, key=itemgetter(*self.keys))
+
+
+def _with_columns(schema: TSchema, *columns: str) -> TSchema:
+    return schema + tuple(column for column in columns if column not in schema)
+
+
 # Dummy operators
 
 
 class DummyMapper(Mapper):
     """Yield exactly the row passed"""
 
+    def output_schema(self, schema: TSchema) -> TSchema | None:
+        return schema
+
     def __call__(self, row: TRow) -> TRowsGenerator:
         yield row
 
@@ -210,6 +529,9 @@ class FilterPunctuation(Mapper):
         self.column = column
         self.maketrans = str.maketrans('', '', string.punctuation)
 
+    def output_schema(self, schema: TSchema) -> TSchema | None:
+        return schema
+
     def __call__(self, row: TRow) -> TRowsGenerator:
         row[self.column] = row[self.column].translate(self.maketrans)
         yield row
@@ -228,6 +550,9 @@ class LowerCase(Mapper):
     def _lower_case(txt: str) -> str:
         return txt.lower()
 
+    def output_schema(self, schema: TSchema) -> TSchema | None:
+        return schema
+
     def __call__(self, row: TRow) -> TRowsGenerator:
         row[self.column] = self._lower_case(row[self.column])
         yield row
@@ -244,6 +569,9 @@ class Split(Mapper):
         self.column = column
         self.split_regex = f'[^{separator}]*{separator}' if separator is not None else '(\S*)\s*'  # noqa
 
+    def output_schema(self, schema: TSchema) -> TSchema | None:
+        return schema
+
     def __call__(self, row: TRow) -> TRowsGenerator:
         for part in re.finditer(self.split_regex, row[self.column]):
             value = part.group().strip()
@@ -264,12 +592,24 @@ class Product(Mapper):
         self.columns = columns
         self.result_column = result_column
 
+    def output_schema(self, schema: TSchema) -> TSchema | None:
+        return _with_columns(schema, self.result_column)
+
     def __call__(self, row: TRow) -> TRowsGenerator:
         row[self.result_column] = 1
         for column in self.columns:
             row[self.result_column] *= row[column]
         yield row
 
+    def map_batch(self, batch: RowBatch) -> tp.Iterable[RowBatch]:
+        arrays = numeric_columns(batch, self.columns)
+        if arrays is None:
+            return super().map_batch(batch)
+        product = np.ones(len(batch), dtype=int)
+        for array in arrays:
+            product = product * exact_integers(array)
+        return [batch.with_column(self.result_column, product)]
+
 
 class Divide(Mapper):
     """Calculates product of multiple columns"""
@@ -284,6 +624,9 @@ class Divide(Mapper):
         self.column_denominator = column_denominator
         self.result_column = result_column
 
+    def output_schema(self, schema: TSchema) -> TSchema | None:
+        return _with_columns(schema, self.result_column)
+
     def __call__(self, row: TRow) -> TRowsGenerator:
         try:
             row[self.result_column] = row[self.column_numerator] / row[self.column_denominator]
@@ -291,6 +634,15 @@ class Divide(Mapper):
             raise ValueError('Denominator column contains zero value')
         yield row
 
+    def map_batch(self, batch: RowBatch) -> tp.Iterable[RowBatch]:
+        arrays = numeric_columns(batch, [self.column_numerator, self.column_denominator])
+        if arrays is None:
+            return super().map_batch(batch)
+        numerator, denominator = arrays
+        if (denominator == 0).any():
+            raise ValueError('Denominator column contains zero value')
+        return [batch.with_column(self.result_column, numerator / denominator)]
+
 
 class Filter(Mapper):
     """Remove records that don't satisfy some condition"""
@@ -301,6 +653,9 @@ class Filter(Mapper):
         """
         self.condition = condition
 
+    def output_schema(self, schema: TSchema) -> TSchema | None:
+        return schema
+
     def __call__(self, row: TRow) -> TRowsGenerator:
         if self.condition(row):
             yield row
@@ -315,9 +670,15 @@ class Project(Mapper):
         """
         self.columns = columns
 
+    def output_schema(self, schema: TSchema) -> TSchema | None:
+        return tuple(self.columns)
+
     def __call__(self, row: TRow) -> TRowsGenerator:
         yield {column: row[column] for column in self.columns}
 
+    def map_batch(self, batch: RowBatch) -> tp.Iterable[RowBatch]:
+        return [RowBatch({column: batch.columns[column] for column in self.columns})]
+
 
 class LogTransform(Mapper):
     """Maps the point (x, y) -> log(x / y) = log(x) - log(y)"""
@@ -332,10 +693,22 @@ class LogTransform(Mapper):
         self.column_denominator = column_denominator
         self.result_column = result_column
 
+    def output_schema(self, schema: TSchema) -> TSchema | None:
+        return _with_columns(schema, self.result_column)
+
     def __call__(self, row: TRow) -> TRowsGenerator:
         row[self.result_column] = math.log(row[self.column_numerator]) - math.log(row[self.column_denominator])
         yield row
 
+    def map_batch(self, batch: RowBatch) -> tp.Iterable[RowBatch]:
+        arrays = numeric_columns(batch, [self.column_numerator, self.column_denominator])
+        if arrays is None:
+            return super().map_batch(batch)
+        numerator, denominator = arrays
+        if (numerator <= 0).any() or (denominator <= 0).any():
+            raise ValueError('math domain error')
+        return [batch.with_column(self.result_column, np.log(numerator) - np.log(denominator))]
+
 
 class LongerThanN(Mapper):
     """Leaves only strings that contains more than n chars"""
@@ -348,6 +721,9 @@ class LongerThanN(Mapper):
         self.column = column
         self.n = n
 
+    def output_schema(self, schema: TSchema) -> TSchema | None:
+        return schema
+
     def __call__(self, row: TRow) -> TRowsGenerator:
         if len(row[self.column]) > self.n:
             yield row
@@ -364,6 +740,9 @@ class AtLeastNTimes(Mapper):
         self.column = column
         self.n = n
 
+    def output_schema(self, schema: TSchema) -> TSchema | None:
+        return schema
+
     def __call__(self, row: TRow) -> TRowsGenerator:
         if row[self.column] >= self.n:
             yield row
@@ -385,6 +764,9 @@ class Haversine(Mapper):
         self.first_point = first_point
         self.second_point = second_point
 
+    def output_schema(self, schema: TSchema) -> TSchema | None:
+        return _with_columns(schema, self.column)
+
     def __call__(self, row: TRow) -> TRowsGenerator:
         lon1, lat1 = row[self.first_point]
         lon2, lat2 = row[self.second_point]
@@ -396,6 +778,16 @@ class Haversine(Mapper):
         row[self.column] = haversine_dist
         yield row
 
+    def map_batch(self, batch: RowBatch) -> tp.Iterable[RowBatch]:
+        if np is None:
+            return super().map_batch(batch)
+        first = np.radians(np.asarray(batch.columns[self.first_point], dtype=float).reshape(-1, 2))
+        second = np.radians(np.asarray(batch.columns[self.second_point], dtype=float).reshape(-1, 2))
+        lon1, lat1, lon2, lat2 = first[:, 0], first[:, 1], second[:, 0], second[:, 1]
+
+        arg = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+        return [batch.with_column(self.column, 2 * np.arcsin(np.sqrt(arg)) * self.EARTH_RADIUS_KM)]
+
 
 class HourWeekday(Mapper):
     """Splits datetime to two different columns with weekday and hour"""
@@ -410,12 +802,25 @@ class HourWeekday(Mapper):
         self.weekday_column = weekday_column
         self.hour_column = hour_column
 
+    def output_schema(self, schema: TSchema) -> TSchema | None:
+        return _with_columns(schema, self.weekday_column, self.hour_column)
+
     def __call__(self, row: TRow) -> TRowsGenerator:
         dt = dateutil.parser.isoparse(row[self.column])
         row[self.weekday_column] = calendar.day_abbr[dt.weekday()]
         row[self.hour_column] = dt.hour
         yield row
 
+    def map_batch(self, batch: RowBatch) -> tp.Iterable[RowBatch]:
+        times = datetime_column(batch, self.column)
+        if times is None:
+            return super().map_batch(batch)
+        days = times.astype('datetime64[D]')
+        weekdays = (days.astype(int) + 3) % 7  # 1970-01-01 was a Thursday
+        hours = (times - days) // np.timedelta64(1, 'h')
+        weekday_names = np.array(calendar.day_abbr, dtype=object)[weekdays]
+        return [batch.with_column(self.weekday_column, weekday_names).with_column(self.hour_column, hours)]
+
 
 class TimeDiff(Mapper):
     """Calculate the inverse of the difference between two datetimes (in hours)"""
@@ -430,6 +835,9 @@ class TimeDiff(Mapper):
         self.start_time = start_time
         self.end_time = end_time
 
+    def output_schema(self, schema: TSchema) -> TSchema | None:
+        return _with_columns(schema, self.column)
+
     def __call__(self, row: TRow) -> TRowsGenerator:
         dt_start = dateutil.parser.isoparse(row[self.start_time])
         dt_end = dateutil.parser.isoparse(row[self.end_time])
@@ -438,6 +846,14 @@ class TimeDiff(Mapper):
         row[self.column] = diff
         yield row
 
+    def map_batch(self, batch: RowBatch) -> tp.Iterable[RowBatch]:
+        start = datetime_column(batch, self.start_time)
+        end = datetime_column(batch, self.end_time)
+        if start is None or end is None:
+            return super().map_batch(batch)
+        microseconds = (end - start).astype(int)
+        return [batch.with_column(self.column, microseconds / 10 ** 6 / 3600)]
+
 
 # Reducers
 
@@ -469,20 +885,15 @@ class TermFrequency(Reducer):
         self.result_column = result_column
 
     def __call__(self, group_key: tuple[str, ...], rows: TRowsIterable) -> TRowsGenerator:
-        new_row: dict[str, tp.Any] = defaultdict(int)
-
-        row = next(iter(rows))
+        rows = iter(rows)
+        row = next(rows)
         common_dict: dict[str, tp.Any] = {key: row[key] for key in group_key}
 
-        new_row[row[self.words_column]] += 1
-        stream_size = 1
-
-        for row in rows:
-            new_row[row[self.words_column]] += 1
-            stream_size += 1
+        words = ((row[self.words_column], 1) for row in itertools.chain([row], rows))
+        stream_size, counts = memory.count_values(words, 'TermFrequency')
 
         yield from (dict(common_dict, **{self.words_column: column, self.result_column: value / stream_size})
-                    for column, value in new_row.items())
+                    for column, value in counts)
 
 
 class TermFrequencyFromCounts(Reducer):
@@ -499,20 +910,15 @@ class TermFrequencyFromCounts(Reducer):
         self.result_column = result_column
 
     def __call__(self, group_key: tuple[str, ...], rows: TRowsIterable) -> TRowsGenerator:
-        new_row: dict[str, tp.Any] = defaultdict(int)
-
-        row = next(iter(rows))
+        rows = iter(rows)
+        row = next(rows)
         common_dict: dict[str, tp.Any] = {key: row[key] for key in group_key}
 
-        new_row[row[self.words_column]] += row[self.count_column]
-        stream_size = row[self.count_column]
-
-        for row in rows:
-            new_row[row[self.words_column]] += row[self.count_column]
-            stream_size += row[self.count_column]
+        words = ((row[self.words_column], row[self.count_column]) for row in itertools.chain([row], rows))
+        stream_size, counts = memory.count_values(words, 'TermFrequencyFromCounts')
 
         yield from (dict(common_dict, **{self.words_column: column, self.result_column: value / stream_size})
-                    for column, value in new_row.items())
+                    for column, value in counts)
 
 
 class CountRows(Reducer):
@@ -532,7 +938,7 @@ class CountRows(Reducer):
         yield {self.column: rows_ctr}
 
 
-class Count(Reducer):
+class Count(CombiningReducer):
     """
     Count records by key
     Example for group_key=('a',) and column='d'
@@ -559,8 +965,17 @@ class Count(Reducer):
 
         yield new_row
 
+    def partial_states(self, batch: RowBatch, starts: list[int]) -> list[tp.Any]:
+        return _segment_counts(batch, starts)
+
+    def merge(self, state_a: tp.Any, state_b: tp.Any) -> tp.Any:
+        return state_a + state_b
 
-class Sum(Reducer):
+    def finalize(self, key_row: TRow, state: tp.Any) -> TRow:
+        return dict(key_row, **{self.column: state})
+
+
+class Sum(CombiningReducer):
     """
     Sum values aggregated by key
     Example for key=('a',) and column='b'
@@ -587,8 +1002,17 @@ class Sum(Reducer):
 
         yield new_row
 
+    def partial_states(self, batch: RowBatch, starts: list[int]) -> list[tp.Any]:
+        return _segment_sums(batch, self.column, starts)
+
+    def merge(self, state_a: tp.Any, state_b: tp.Any) -> tp.Any:
+        return state_a + state_b
+
+    def finalize(self, key_row: TRow, state: tp.Any) -> TRow:
+        return dict(key_row, **{self.column: state})
 
-class Mean(Reducer):
+
+class Mean(CombiningReducer):
     """
     Mean values aggregated by key
     Example for key=('a',) and column='b'
@@ -619,6 +1043,15 @@ class Mean(Reducer):
         new_row[self.column] /= stream_size
         yield new_row
 
+    def partial_states(self, batch: RowBatch, starts: list[int]) -> list[tp.Any]:
+        return list(zip(_segment_sums(batch, self.column, starts), _segment_counts(batch, starts)))
+
+    def merge(self, state_a: tp.Any, state_b: tp.Any) -> tp.Any:
+        return state_a[0] + state_b[0], state_a[1] + state_b[1]
+
+    def finalize(self, key_row: TRow, state: tp.Any) -> TRow:
+        return dict(key_row, **{self.column: state[0] / state[1]})
+
 
 # Joiners
 
@@ -627,15 +1060,15 @@ class InnerJoiner(Joiner):
     """Join with inner strategy"""
 
     def __call__(self, keys: Sequence[str], rows_a: TRowsIterable, rows_b: TRowsIterable) -> TRowsGenerator:
-        yield from self.common_join_part(keys, rows_a, list(rows_b))
+        yield from self.common_join_part(keys, rows_a, memory.materialize(rows_b, type(self).__name__))
 
 
 class OuterJoiner(Joiner):
     """Join with outer strategy"""
 
     def __call__(self, keys: Sequence[str], rows_a: TRowsIterable, rows_b: TRowsIterable) -> TRowsGenerator:
-        materialized_a = list(rows_a)
-        materialized_b = list(rows_b)
+        materialized_a = memory.materialize(rows_a, type(self).__name__)
+        materialized_b = memory.materialize(rows_b, type(self).__name__)
 
         if materialized_a and materialized_b:
             yield from self.common_join_part(keys, materialized_a, materialized_b)
@@ -649,7 +1082,7 @@ class LeftJoiner(Joiner):
     """Join with left strategy"""
 
     def __call__(self, keys: Sequence[str], rows_a: TRowsIterable, rows_b: TRowsIterable) -> TRowsGenerator:
-        materialized_b = list(rows_b)
+        materialized_b = memory.materialize(rows_b, type(self).__name__)
 
         if materialized_b:
             yield from self.common_join_part(keys, rows_a, materialized_b)
@@ -661,7 +1094,7 @@ class RightJoiner(Joiner):
     """Join with right strategy"""
 
     def __call__(self, keys: Sequence[str], rows_a: TRowsIterable, rows_b: TRowsIterable) -> TRowsGenerator:
-        materialized_a = list(rows_a)
+        materialized_a = memory.materialize(rows_a, type(self).__name__)
 
         if materialized_a:
             yield from self.common_join_part(keys, rows_b, materialized_a, join_type='right')
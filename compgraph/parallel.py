@@ -0,0 +1,545 @@
+import heapq
+import itertools
+import mmap
+import multiprocessing
+import multiprocessing.pool
+import os
+import tempfile
+import threading
+import traceback
+import typing as tp
+import zlib
+from collections import defaultdict, deque
+from multiprocessing import queues
+from operator import itemgetter
+from queue import Empty, Full
+
+from . import operations as ops
+from . import external_sort as ext_sort
+from . import codegen
+from . import compressed
+from . import rowfile
+
+if tp.TYPE_CHECKING:  # pragma: no cover
+    from .graph import Graph
+
+BATCH_SIZE = 1024
+READ_CHUNK_SIZE = 4 * 2 ** 20  # bytes of a file parsed by a reading process at once
+PARENT = -1  # sender id of the rows fed by the coordinating process
+QUEUE_BATCHES = 8  # batches a queue between the processes holds before the sender waits
+MAILBOX_BATCHES = 64  # batches received but not consumed yet kept in memory, the others are spilled
+RECEIVE_TIMEOUT = 0.1  # seconds between the checks of a mailbox being closed
+
+TChannel = tuple[int, ...]
+TBatch = list[ops.TRow]
+
+
+def _normalized(value: tp.Any) -> tp.Any:
+    """Value represented as the values equal to it are: bools and integral floats become ints"""
+    if isinstance(value, bool) or isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, (tuple, list)):
+        return tuple(_normalized(item) for item in value)
+    return value
+
+
+def partition_of(key: tp.Any, parallelism: int) -> int:
+    """Stable (process independent) hash partitioning of a key, equal keys (such as 1, 1.0 and True) go together"""
+    return zlib.crc32(repr(_normalized(key)).encode()) % parallelism
+
+
+def batched(rows: ops.TRowsIterable, size: int = BATCH_SIZE) -> tp.Generator[TBatch, None, None]:
+    batch: TBatch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def walk(graph: 'Graph') -> tp.Generator['Graph', None, None]:
+    """Preorder traversal of the graph expanded into a tree, the way Graph.run evaluates it"""
+    yield graph
+    for parent in graph._parents:
+        yield from walk(parent)
+
+
+def ordering_of(operation: ops.Operation, parent_orderings: list[list[str] | None]) -> list[str] | None:
+    """Columns the output stream of the operation is sorted by, if known"""
+    if isinstance(operation, ext_sort.ExternalSort):
+        # the sort is stable, so the previous ordering still holds for the rows with equal keys
+        ordering = list(operation.keys)
+        ordering += [column for column in parent_orderings[0] or [] if column not in ordering]
+        return ordering or None
+    if isinstance(operation, (ops.Reduce, ops.Join)):
+        return list(operation.keys) or None
+    if isinstance(operation, ops.Top):
+        return None if operation.descending else list(operation.keys)
+    if isinstance(operation, ops.Limit):
+        return parent_orderings[0]
+    if isinstance(operation, (ops.Map, codegen.CompiledMap)) and parent_orderings:
+        ordering = parent_orderings[0]
+        mappers = operation.mappers if isinstance(operation, codegen.CompiledMap) else [operation.mapper]
+        for mapper in mappers:
+            if ordering is not None and isinstance(mapper, ops.Project) and not set(ordering) <= set(mapper.columns):
+                return None
+        return ordering
+    return None
+
+
+def read_byte_range(read: ops.Read, start: int, end: int) -> ops.TRowsGenerator:
+    """Parse the lines of the file which start inside [start, end) byte range"""
+    with open(read.filename, 'rb') as f:
+        if start > 0:
+            f.seek(start - 1)
+            start += len(f.readline()) - 1
+        position = start
+        while position < end:
+            line = f.readline()
+            if not line:
+                break
+            position += len(line)
+            yield read.parser(line.decode())
+
+
+_mapped_file: tuple[mmap.mmap, tp.Callable[[str], ops.TRow]] | None = None  # file of a reading process
+
+
+def _map_file(filename: str, parser: tp.Callable[[str], ops.TRow]) -> None:
+    global _mapped_file
+    with open(filename, 'rb') as f:
+        _mapped_file = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), parser
+
+
+def _parse_range(byte_range: tuple[int, int]) -> TBatch:
+    """Parse the lines of the mapped file which start inside [start, end) byte range"""
+    data, parser = tp.cast(tuple[mmap.mmap, tp.Callable[[str], ops.TRow]], _mapped_file)
+    start, end = byte_range
+    if start > 0:
+        newline = data.find(b'\n', start - 1)
+        if newline < 0:
+            return []
+        start = newline + 1
+    rows = []
+    while start < end:
+        newline = data.find(b'\n', start)
+        stop = newline + 1 if newline >= 0 else len(data)
+        rows.append(parser(data[start:stop].decode()))
+        start = stop
+    return rows
+
+
+class ParallelRead(ops.Read):
+    """Read parsing newline aligned chunks of the memory mapped file in a pool of processes"""
+
+    def __init__(self, filename: str, parser: tp.Callable[[str], ops.TRow], workers: int, ordered: bool = True) -> None:
+        """
+        :param filename: filename to read from
+        :param parser: parser from string to Row
+        :param workers: number of parsing processes
+        :param ordered: yield the rows in the order of the file, otherwise chunks are yielded as soon as they are parsed
+        """
+        super().__init__(filename, parser)
+        self.workers = workers
+        self.ordered = ordered
+
+    def __call__(self, *args: tp.Any, **kwargs: tp.Any) -> ops.TRowsGenerator:
+        size = os.path.getsize(self.filename)
+        if size == 0:
+            return
+        chunks = iter([(start, min(start + READ_CHUNK_SIZE, size)) for start in range(0, size, READ_CHUNK_SIZE)])
+        # parsers may be lambdas, so they get to the processes by forking
+        context = multiprocessing.get_context('fork')
+        with context.Pool(self.workers, initializer=_map_file, initargs=(self.filename, self.parser)) as pool:
+            # a few chunks per process are parsed ahead, so that a slow consumer does not make them pile up
+            pending: deque[multiprocessing.pool.AsyncResult[TBatch]] = deque()
+            while True:
+                for chunk in itertools.islice(chunks, 2 * self.workers - len(pending)):
+                    pending.append(pool.apply_async(_parse_range, (chunk,)))
+                if not pending:
+                    break
+                parsed = pending[0]
+                if not self.ordered:
+                    parsed = next((result for result in pending if result.ready()), parsed)
+                pending.remove(parsed)
+                yield from parsed.get()
+
+
+class _Spilled(tp.NamedTuple):
+    """Batch written to the spill file of a mailbox"""
+    offset: int
+    length: int
+
+
+class _Mailbox:
+    """
+    Demultiplexes the messages of a queue into streams of batches per (channel, sender). A thread receives the
+    messages as soon as they arrive, so that the bounded queues of the senders never block for long; the batches
+    beyond MAILBOX_BATCHES not consumed yet are spilled to a temporary file
+    """
+
+    def __init__(self, queue: queues.Queue, by_sender: bool = True) -> None:  # type: ignore[type-arg]
+        """
+        :param queue: queue to receive the messages from
+        :param by_sender: keep a stream per sender, otherwise the batches of a channel form one stream
+            in order of arrival (see any_rows)
+        """
+        self._queue = queue
+        self._by_sender = by_sender
+        self._pending: dict[tuple[TChannel, int | None], deque[TBatch | _Spilled | None]] = defaultdict(deque)
+        self._condition = threading.Condition()
+        self._in_memory = 0
+        self._spill: tp.BinaryIO | None = None
+        self._spill_end = 0
+        self._discard = False
+        self._error: str | None = None
+        self._waiting: tuple[TChannel, int | None] | None = None  # stream the consumer waits for
+        self._closed = threading.Event()
+        self.ends_received = 0
+        self._thread = threading.Thread(target=self._receive, daemon=True)
+        self._thread.start()
+
+    def _spilled(self, batch: TBatch) -> _Spilled:
+        if self._spill is None:
+            self._spill = tempfile.TemporaryFile()
+        data = rowfile.encode_batch(batch)
+        os.pwrite(self._spill.fileno(), data, self._spill_end)
+        self._spill_end += len(data)
+        return _Spilled(self._spill_end - len(data), len(data))
+
+    def _receive(self) -> None:
+        while not self._closed.is_set():
+            try:
+                channel, sender, batch = self._queue.get(timeout=RECEIVE_TIMEOUT)
+            except Empty:
+                continue
+            with self._condition:
+                if isinstance(batch, str):
+                    self._error = self._error or f'Parallel worker {sender} failed:\n{batch}'
+                elif batch is None:
+                    self.ends_received += 1
+                key = channel, sender if self._by_sender else None
+                if self._error is None and not (self._discard and batch is not None):
+                    entry: TBatch | _Spilled | None = batch
+                    if batch is not None and self._in_memory >= MAILBOX_BATCHES:
+                        entry = self._spilled(batch)
+                    elif batch is not None:
+                        self._in_memory += 1
+                    self._pending[key].append(entry)
+                if batch is None or self._error is not None or key == self._waiting:
+                    self._condition.notify()
+
+    def _next(self, channel: TChannel, sender: int | None) -> TBatch | None:
+        with self._condition:
+            pending = self._pending[channel, sender]
+            self._waiting = channel, sender
+            self._condition.wait_for(lambda: pending or self._error is not None)
+            self._waiting = None
+            if self._error is not None:
+                raise RuntimeError(self._error)
+            entry = pending.popleft()
+            if isinstance(entry, list):
+                self._in_memory -= 1
+        if isinstance(entry, _Spilled):
+            return tp.cast(TBatch, rowfile.decode_batch(os.pread(tp.cast(tp.BinaryIO, self._spill).fileno(),
+                                                                 entry.length, entry.offset)))
+        return entry
+
+    def rows(self, channel: TChannel, sender: int) -> ops.TRowsGenerator:
+        while (batch := self._next(channel, sender)) is not None:
+            yield from batch
+
+    def any_rows(self, senders: int) -> ops.TRowsGenerator:
+        """Rows of all senders in order of arrival (the mailbox has to be created with by_sender=False)"""
+        ended = 0
+        while ended < senders:
+            batch = self._next((), None)
+            if batch is None:
+                ended += 1
+            else:
+                yield from batch
+
+    def drain(self, expected_ends: int) -> None:
+        """Discard messages until the given number of end markers is received"""
+        with self._condition:
+            self._discard = True
+            self._pending.clear()
+            self._in_memory = 0
+            self._condition.wait_for(lambda: self.ends_received >= expected_ends or self._error is not None)
+            if self._error is not None:
+                raise RuntimeError(self._error)
+
+    def close(self) -> None:
+        """Stops the receiving thread and removes the spill file"""
+        self._closed.set()
+        self._thread.join()
+        if self._spill is not None:
+            self._spill.close()
+
+
+class _Exchange:
+    """Repartitions the rows of all workers by hash of keys (or gathers them in worker 0 if keys are empty)"""
+
+    def __init__(self, worker: '_Worker', channel: TChannel, rows: ops.TRowsIterable,
+                 keys: list[str], merge_keys: list[str] | None) -> None:
+        self._worker = worker
+        self._channel = channel
+        self._rows = rows
+        self._keys = keys
+        self._merge_keys = merge_keys
+        self._sent = False
+        self.siblings: list[_Exchange] = [self]
+
+    def send(self) -> None:
+        if self._sent:
+            return
+        self._sent = True
+        inboxes, index = self._worker.inboxes, self._worker.index
+        if self._keys:
+            key = itemgetter(*self._keys)
+            buffers: list[TBatch] = [[] for _ in inboxes]
+            for row in self._rows:
+                target = partition_of(key(row), len(inboxes))
+                buffers[target].append(row)
+                if len(buffers[target]) >= BATCH_SIZE:
+                    inboxes[target].put((self._channel, index, buffers[target]))
+                    buffers[target] = []
+            for target, batch in enumerate(buffers):
+                if batch:
+                    inboxes[target].put((self._channel, index, batch))
+        else:
+            for batch in batched(self._rows):
+                inboxes[0].put((self._channel, index, batch))
+        for inbox in inboxes:
+            inbox.put((self._channel, index, None))
+
+    def receive(self) -> ops.TRowsGenerator:
+        # Operations consume their inputs in data dependent order (e.g. joiners), so all the inputs
+        # are sent before waiting for the first one: other workers may need them to get to this point
+        for exchange in self.siblings:
+            exchange.send()
+        streams = [self._worker.mailbox.rows(self._channel, sender) for sender in range(self._worker.parallelism)]
+        if self._merge_keys:
+            yield from heapq.merge(*streams, key=itemgetter(*self._merge_keys))
+        else:
+            yield from itertools.chain(*streams)
+
+
+def _drain(streams: list[ops.TRowsIterable]) -> ops.TRowsGenerator:
+    for stream in streams:
+        for _ in stream:
+            pass
+    yield from ()
+
+
+class _Worker:
+    """Evaluates one partition of the graph"""
+
+    def __init__(self, index: int, parallelism: int, inboxes: list[queues.Queue],  # type: ignore[type-arg]
+                 kwargs: dict[str, tp.Any]) -> None:
+        self.index = index
+        self.parallelism = parallelism
+        self.inboxes = inboxes
+        self.mailbox = _Mailbox(inboxes[index])
+        self.kwargs = kwargs
+        self.exchanges: list[_Exchange] = []
+        self.sources = 0
+
+    def build(self, graph: 'Graph', ids: tp.Iterator[int]) -> tuple[ops.TRowsIterable, list[str] | None]:
+        node_id = next(ids)
+        parents = [self.build(parent, ids) for parent in graph._parents]
+        parents_rows = [rows for rows, _ in parents]
+        parents_orderings = [ordering for _, ordering in parents]
+        operation = graph._operation
+
+        if isinstance(operation, ops.ReadIterGenerator):
+            self.sources += 1
+            return self.mailbox.rows((node_id,), PARENT), None
+        if isinstance(operation, ops.ReadRowFile):
+            return operation.read(self.index, self.parallelism), None
+        if isinstance(operation, ops.ReadCsv) or (isinstance(operation, ops.Read)
+                                                  and compressed.detect(operation.filename) is not None):
+            # quoted fields may span lines and a compressed file is read as a stream, so the file is read
+            # by the first worker and repartitioned by the keys
+            return operation() if self.index == 0 else iter([]), None
+        if isinstance(operation, ops.Read):
+            size = os.path.getsize(operation.filename)
+            start, end = size * self.index // self.parallelism, size * (self.index + 1) // self.parallelism
+            return read_byte_range(operation, start, end), None
+        if isinstance(operation, (ops.Reduce, ops.Join)):
+            keys = list(operation.keys)
+            exchanges = []
+            for input_index, (rows, ordering) in enumerate(parents):
+                if keys:
+                    merge_keys = ordering if ordering is not None and ordering[:len(keys)] == keys else keys
+                else:
+                    merge_keys = ordering
+                exchanges.append(_Exchange(self, (node_id, input_index), rows, keys, merge_keys))
+            for exchange in exchanges:
+                exchange.siblings = exchanges
+            self.exchanges.extend(exchanges)
+            inputs = [exchange.receive() for exchange in exchanges]
+            if not keys and self.index != 0:
+                return _drain(inputs), None
+            return operation(*inputs, **self.kwargs), ordering_of(operation, parents_orderings)
+        if isinstance(operation, (ops.Limit, ops.Top)):
+            # every worker selects from its partition, then worker 0 selects from the gathered selections
+            ordering = ordering_of(operation, parents_orderings)
+            exchange = _Exchange(self, (node_id, 0), operation(*parents_rows, **self.kwargs), [], ordering)
+            exchange.siblings = [exchange]
+            self.exchanges.append(exchange)
+            if self.index != 0:
+                return _drain([exchange.receive()]), None
+            return operation(exchange.receive(), **self.kwargs), ordering
+        return operation(*parents_rows, **self.kwargs), ordering_of(operation, parents_orderings)
+
+
+def _worker_main(graph: 'Graph', index: int, parallelism: int, inboxes: list[queues.Queue],  # type: ignore[type-arg]
+                 results: queues.Queue, kwargs: dict[str, tp.Any]) -> None:  # type: ignore[type-arg]
+    try:
+        worker = _Worker(index, parallelism, inboxes, kwargs)
+        rows, _ = worker.build(graph, itertools.count())
+        for batch in batched(rows):
+            results.put(((), index, batch))
+        # Every worker waits for the end markers of all the others, so exchanges skipped by an
+        # early stopping consumer still have to be sent
+        for exchange in worker.exchanges:
+            exchange.send()
+        worker.mailbox.drain(len(worker.exchanges) * parallelism + worker.sources)
+        worker.mailbox.close()
+        results.put(((), index, None))
+    except BaseException:
+        results.put(((), index, traceback.format_exc()))
+
+
+def _put(target: queues.Queue, message: tp.Any, stopped: threading.Event) -> bool:  # type: ignore[type-arg]
+    """Puts the message to the bounded queue unless the run is stopped while waiting"""
+    while not stopped.is_set():
+        try:
+            target.put(message, timeout=RECEIVE_TIMEOUT)
+            return True
+        except Full:
+            pass
+    return False
+
+
+def _feed_source(rows_factory: tp.Callable[[], ops.TRowsIterable], channel: TChannel, inboxes: list[queues.Queue],
+                 results: queues.Queue, stopped: threading.Event) -> None:  # type: ignore[type-arg]
+    try:
+        for batch_index, batch in enumerate(batched(rows_factory())):
+            if not _put(inboxes[batch_index % len(inboxes)], (channel, PARENT, batch), stopped):
+                return
+        for inbox in inboxes:
+            if not _put(inbox, (channel, PARENT, None), stopped):
+                return
+    except BaseException:
+        _put(results, ((), PARENT, traceback.format_exc()), stopped)
+
+
+def _root_ordering(graph: 'Graph') -> list[str] | None:
+    return ordering_of(graph._operation, [_root_ordering(parent) for parent in graph._parents])
+
+
+def run_partitioned(graph: 'Graph', parallelism: int, ordered: bool,
+                    kwargs: dict[str, tp.Any]) -> ops.TRowsGenerator:
+    """
+    Runs the graph in parallelism worker processes. Sources are split between workers (data sources round-robin
+    by batches, files by byte ranges), every reduce and join repartitions its inputs by hash of the keys, so that
+    all rows with equal keys meet in one worker; grouping by empty keys gathers rows in the first worker.
+    :param graph: graph to run
+    :param parallelism: number of worker processes
+    :param ordered: merge the outputs of the workers by the ordering of the graph result
+        (sort, reduce or join keys), otherwise rows are streamed in order of arrival
+    :param kwargs: data sources
+    """
+    context = multiprocessing.get_context('fork')  # graphs hold lambdas, so they can be shared only by forking
+    inboxes = [context.Queue(QUEUE_BATCHES) for _ in range(parallelism)]
+    results = context.Queue(QUEUE_BATCHES)
+
+    workers = [context.Process(target=_worker_main, args=(graph, index, parallelism, inboxes, results, kwargs))
+               for index in range(parallelism)]
+    for worker in workers:
+        worker.start()
+
+    stopped = threading.Event()  # stops the threads feeding the data sources when the run is stopped early
+    for node_id, node in enumerate(walk(graph)):
+        if isinstance(node._operation, ops.ReadIterGenerator):
+            threading.Thread(target=_feed_source, daemon=True,
+                             args=(kwargs[node._operation.name], (node_id,), inboxes, results, stopped)).start()
+
+    mailbox = _Mailbox(results, by_sender=ordered)
+    ordering = _root_ordering(graph)
+    finished = False
+    try:
+        if ordered:
+            streams = [mailbox.rows((), index) for index in range(parallelism)]
+            if ordering is not None:
+                yield from heapq.merge(*streams, key=itemgetter(*ordering))
+            else:
+                yield from itertools.chain(*streams)
+        else:
+            yield from mailbox.any_rows(parallelism)
+        finished = True
+    finally:
+        stopped.set()
+        for worker in workers:
+            if not finished:
+                worker.terminate()
+            worker.join()
+        mailbox.close()
+
+
+BRANCH_BUFFER_BATCHES = 16
+
+
+def _branch_main(graph: 'Graph', buffer: queues.Queue, kwargs: dict[str, tp.Any]) -> None:  # type: ignore[type-arg]
+    try:
+        for batch in batched(_build_branches(graph, kwargs)):
+            buffer.put(batch)
+        buffer.put(None)
+    except BaseException:
+        buffer.put(traceback.format_exc())
+
+
+def _branch_rows(process: multiprocessing.process.BaseProcess,
+                 buffer: queues.Queue) -> ops.TRowsGenerator:  # type: ignore[type-arg]
+    finished = False
+    try:
+        while True:
+            batch = buffer.get()
+            if batch is None:
+                break
+            if isinstance(batch, str):
+                raise RuntimeError(f'Branch process failed:\n{batch}')
+            yield from batch
+        finished = True
+    finally:
+        if not finished:
+            process.terminate()
+        process.join()
+
+
+def _build_branches(graph: 'Graph', kwargs: dict[str, tp.Any]) -> ops.TRowsIterable:
+    parents = [_build_branches(graph._parents[0], kwargs)] if graph._parents else []
+    for parent in graph._parents[1:]:
+        if not parent._parents:  # a bare source is not worth a process
+            parents.append(_build_branches(parent, kwargs))
+            continue
+        context = multiprocessing.get_context('fork')
+        buffer = context.Queue(maxsize=BRANCH_BUFFER_BATCHES)
+        process = context.Process(target=_branch_main, args=(parent, buffer, kwargs))
+        process.start()
+        parents.append(_branch_rows(process, buffer))
+    return graph._operation(*parents, **kwargs)
+
+
+def run_branches(graph: 'Graph', kwargs: dict[str, tp.Any]) -> ops.TRowsGenerator:
+    """
+    Runs the graph evaluating every input of a join but the first one in its own process (recursively),
+    so independent branches are computed concurrently and streamed into the join through bounded buffers
+    :param graph: graph to run
+    :param kwargs: data sources
+    """
+    yield from _build_branches(graph, kwargs)
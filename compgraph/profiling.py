@@ -0,0 +1,207 @@
+import os
+import resource
+import sys
+import time
+import typing as tp
+
+from . import operations as ops
+
+if tp.TYPE_CHECKING:  # pragma: no cover
+    from .graph import Graph
+
+BYTES_SAMPLE_EVERY = 64  # size of every n-th row is measured, the total is extrapolated
+
+_active: list['Profiler'] = []
+_frames: list['_Frame'] = []  # nodes of the profiled runs being pulled right now, innermost last
+
+
+def current() -> tp.Optional['Profiler']:
+    """Profiler of the innermost `with Profiler()` block, if any"""
+    return _active[-1] if _active else None
+
+
+def peak_memory() -> int:
+    """Peak resident memory of the current process in bytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def process_stats(phases: list[tuple[str, float, float]], **extra: tp.Any) -> dict[str, tp.Any]:
+    """
+    Resources used by the current process, reported by the sorting processes back to the profiler
+    :param phases: name, start and end (time.perf_counter, which is shared by the processes) of the work stages
+    :param extra: other statistics of the process
+    """
+    return dict(extra, cpu_time=time.process_time(), peak_memory=peak_memory(), pid=os.getpid(), phases=phases)
+
+
+def record_process(stats: dict[str, tp.Any]) -> None:
+    """Attributes the resources of a helper process (such as the sorting one) to the node being pulled"""
+    if _frames:
+        _frames[-1].stats.process = stats
+
+
+def describe(operation: ops.Operation) -> str:
+    """Short human readable description of the operation"""
+    name = type(operation).__name__
+    if isinstance(operation, ops.Map):
+        return f'{name}({type(operation.mapper).__name__})'
+    if isinstance(operation, ops.Reduce):
+        return f'{name}({type(operation.reducer).__name__}, keys={list(operation.keys)})'
+    if isinstance(operation, ops.Join):
+        return f'{name}({type(operation.joiner).__name__}, keys={list(operation.keys)})'
+    if isinstance(operation, (ops.Read, ops.ReadRowFile, ops.ReadCsv)):
+        return f'{name}({operation.filename})'
+    if isinstance(operation, ops.ReadIterGenerator):
+        return f'{name}({operation.name})'
+    if isinstance(operation, ops.Top):
+        return f'{name}({operation.n}, keys={list(operation.keys)}{", descending" if operation.descending else ""})'
+    if isinstance(operation, ops.Limit):
+        return f'{name}({operation.n})'
+    mappers = getattr(operation, 'mappers', None)
+    if mappers is not None:
+        return f'{name}({", ".join(type(mapper).__name__ for mapper in mappers)})'
+    path = getattr(operation, 'path', None)
+    if path is not None:
+        return f'{name}({path})'
+    keys = getattr(operation, 'keys', None)
+    return f'{name}(keys={list(keys)})' if keys is not None else name
+
+
+def _row_size(row: ops.TRow) -> int:
+    return sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row.values())
+
+
+class NodeStats:
+    """Measurements of one node execution; time, cpu time and memory are exclusive of the inputs"""
+
+    def __init__(self, operation: str) -> None:
+        self.operation = operation
+        self.rows_out = 0
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.peak_memory_growth = 0
+        self.process: dict[str, tp.Any] | None = None
+        self.inputs: list[NodeStats] = []
+        self._sampled_rows = 0
+        self._sampled_bytes = 0
+
+    @property
+    def rows_in(self) -> int:
+        return sum(stats.rows_out for stats in self.inputs)
+
+    @property
+    def bytes_out(self) -> int:
+        """Approximate size of the produced rows in memory"""
+        return self._sampled_bytes * self.rows_out // self._sampled_rows if self._sampled_rows else 0
+
+    def to_dict(self) -> dict[str, tp.Any]:
+        return {
+            'operation': self.operation, 'rows_in': self.rows_in, 'rows_out': self.rows_out,
+            'bytes_out': self.bytes_out, 'wall_time': self.wall_time, 'cpu_time': self.cpu_time,
+            'peak_memory_growth': self.peak_memory_growth, 'process': self.process,
+            'inputs': [stats.to_dict() for stats in self.inputs],
+        }
+
+
+class _Frame:
+    def __init__(self, stats: NodeStats) -> None:
+        self.stats = stats
+        self.inner = [0.0, 0.0, 0]  # wall time, cpu time and memory growth spent in the inputs
+
+
+class Profiler:
+    """
+    Collects runtime statistics of every node of the graphs run with it, either passed as Graph.run(profile=...)
+    or active as a context manager: `with Profiler() as profiler: ...`
+    """
+
+    def __init__(self) -> None:
+        self.runs: list[NodeStats] = []
+
+    def __enter__(self) -> 'Profiler':
+        _active.append(self)
+        return self
+
+    def __exit__(self, *exc_info: tp.Any) -> None:
+        _active.remove(self)
+
+    def run(self, graph: 'Graph', kwargs: dict[str, tp.Any]) -> ops.TRowsGenerator:
+        """
+        Runs the graph measuring every node
+        :param graph: graph to run
+        :param kwargs: data sources
+        """
+        stats = NodeStats(describe(graph._operation))
+        self.runs.append(stats)
+        yield from self._evaluate(graph, stats, kwargs)
+
+    def _evaluate(self, graph: 'Graph', stats: NodeStats, kwargs: dict[str, tp.Any]) -> ops.TRowsGenerator:
+        parents_run = []
+        for parent in graph._parents:
+            parent_stats = NodeStats(describe(parent._operation))
+            stats.inputs.append(parent_stats)
+            parents_run.append(self._evaluate(parent, parent_stats, kwargs))
+        rows = iter(graph._operation(*parents_run, **kwargs))
+        frames = _frames
+        while True:
+            frame = _Frame(stats)
+            frames.append(frame)
+            start_wall, start_cpu, start_memory = time.perf_counter(), time.process_time(), peak_memory()
+            try:
+                row = next(rows, None)
+            finally:
+                frames.pop()
+                wall = time.perf_counter() - start_wall
+                self._pulled(stats, start_wall, wall)
+                cpu = time.process_time() - start_cpu
+                memory = peak_memory() - start_memory
+                stats.wall_time += wall - frame.inner[0]
+                stats.cpu_time += cpu - frame.inner[1]
+                stats.peak_memory_growth += memory - frame.inner[2]
+                if frames:
+                    outer = frames[-1].inner
+                    outer[0] += wall
+                    outer[1] += cpu
+                    outer[2] += memory
+            if row is None:
+                return
+            if stats.rows_out % BYTES_SAMPLE_EVERY == 0:
+                stats._sampled_rows += 1
+                stats._sampled_bytes += _row_size(row)
+            stats.rows_out += 1
+            yield row
+
+    def _pulled(self, stats: NodeStats, start: float, duration: float) -> None:
+        """Called after every pull of a row from the node (including the last one, finding the rows exhausted)"""
+        pass
+
+    def to_json(self) -> list[dict[str, tp.Any]]:
+        """Statistics of every run as nested dicts (inputs of a node are in 'inputs')"""
+        return [stats.to_dict() for stats in self.runs]
+
+    def report(self) -> str:
+        """Statistics of every run as an indented tree, the root is the output of the graph"""
+        lines: list[str] = []
+        for stats in self.runs:
+            self._report(stats, 0, lines)
+        return '\n'.join(lines)
+
+    def _report(self, stats: NodeStats, depth: int, lines: list[str]) -> None:
+        line = (f'{"  " * depth}{stats.operation}  rows in={stats.rows_in} out={stats.rows_out}'
+                f'  time={stats.wall_time * 1000:.1f}ms cpu={stats.cpu_time * 1000:.1f}ms'
+                f'  bytes~{_format_bytes(stats.bytes_out)} peak+{_format_bytes(stats.peak_memory_growth)}')
+        if stats.process is not None:
+            line += (f'  [process cpu={stats.process["cpu_time"] * 1000:.1f}ms'
+                     f' peak={_format_bytes(int(stats.process["peak_memory"]))}]')
+        lines.append(line)
+        for input_stats in stats.inputs:
+            self._report(input_stats, depth + 1, lines)
+
+
+def _format_bytes(size: int) -> str:
+    for unit in ['B', 'KiB', 'MiB']:
+        if abs(size) < 1024:
+            return f'{size}{unit}'
+        size //= 1024
+    return f'{size}GiB'
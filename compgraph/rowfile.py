@@ -0,0 +1,191 @@
+import lzma
+import os
+import pickle
+import stat
+import struct
+import tempfile
+import typing as tp
+import zlib
+
+from .batch import TRow
+
+T = tp.TypeVar('T')
+
+MAGIC = b'CGRF'
+VERSION = 1
+BATCH_SIZE = 4096  # rows encoded together
+# compression -> (code in the header, compress, decompress)
+COMPRESSIONS: dict[str, tuple[int, tp.Callable[[bytes], bytes], tp.Callable[[bytes], bytes]]] = {
+    'none': (0, bytes, bytes),
+    'zlib': (1, lambda data: zlib.compress(data, 1), zlib.decompress),
+    'lzma': (2, lambda data: lzma.compress(data, preset=1), lzma.decompress),
+}
+_CODES = {code: name for name, (code, _, _) in COMPRESSIONS.items()}
+
+_HEADER = struct.Struct('<4sHB')  # magic, version and compression code
+_BATCH = struct.Struct('<II')  # payload length and number of rows, a zero length batch ends the batches
+_FOOTER = struct.Struct('<Q4s')  # offset of the batch index and the magic
+
+
+def encode_batch(items: list[tp.Any], compression: str = 'none') -> bytes:
+    """
+    Encodes a batch of items: rows with the same columns are stored as tuples tagged with the columns
+    (so that the column names are not repeated), anything else is pickled as it is
+    """
+    payload: tuple[tp.Any, ...] = (None, items)
+    if items and isinstance(items[0], dict):
+        columns = tuple(items[0])
+        if all(isinstance(row, dict) and len(row) == len(columns) and tuple(row) == columns for row in items):
+            payload = (columns, [tuple(row.values()) for row in items])
+    return COMPRESSIONS[compression][1](pickle.dumps(payload, pickle.HIGHEST_PROTOCOL))
+
+
+def decode_batch(data: bytes, compression: str = 'none') -> list[tp.Any]:
+    columns, items = pickle.loads(COMPRESSIONS[compression][2](data))
+    return tp.cast(list[tp.Any], items if columns is None else [dict(zip(columns, values)) for values in items])
+
+
+def _batches(items: tp.Iterable[T], size: int) -> tp.Iterator[list[T]]:
+    batch: list[T] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def write_stream(rows: tp.Iterable[TRow], f: tp.BinaryIO, compression: str = 'zlib',
+                 batch_size: int | None = None) -> tp.Generator[TRow, None, int]:
+    """
+    Writes the rows passing through to the file: a header, the batches and an index of the batches
+    :param rows: rows to write
+    :param f: binary file positioned at the start
+    :param compression: 'none', 'zlib' or 'lzma'
+    :param batch_size: rows encoded together, BATCH_SIZE by default
+    :return: number of rows
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError(f'Unknown compression {compression}, expected one of {list(COMPRESSIONS)}')
+    start = f.tell()
+    f.write(_HEADER.pack(MAGIC, VERSION, COMPRESSIONS[compression][0]))
+    index: list[tuple[int, int]] = []
+    for batch in _batches(rows, batch_size or BATCH_SIZE):
+        data = encode_batch(batch, compression)
+        index.append((f.tell() - start, len(batch)))
+        f.write(_BATCH.pack(len(data), len(batch)))
+        f.write(data)
+        yield from batch
+    f.write(_BATCH.pack(0, 0))
+    index_offset = f.tell() - start
+    f.write(pickle.dumps(index, pickle.HIGHEST_PROTOCOL))
+    f.write(_FOOTER.pack(index_offset, MAGIC))
+    return sum(rows for _, rows in index)
+
+
+def _read_header(f: tp.BinaryIO) -> str:
+    header = f.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        raise ValueError('Not a row file')
+    magic, version, code = _HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION or code not in _CODES:
+        raise ValueError('Not a row file')
+    return _CODES[code]
+
+
+def read_stream(f: tp.BinaryIO) -> tp.Generator[TRow, None, None]:
+    """Reads the rows written by write_stream (also from a file whose writing was interrupted), closes the file"""
+    with f:
+        compression = _read_header(f)
+        while len(header := f.read(_BATCH.size)) == _BATCH.size:
+            length, _ = _BATCH.unpack(header)
+            if length == 0:
+                return
+            yield from decode_batch(f.read(length), compression)
+
+
+def is_row_file(filename: str) -> bool:
+    with open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def batch_index(filename: str) -> list[tuple[int, int]] | None:
+    """Offsets and row counts of the batches of the file, None if its writing was interrupted"""
+    with open(filename, 'rb') as f:
+        size = f.seek(0, os.SEEK_END)
+        if size < _HEADER.size + _FOOTER.size:
+            return None
+        f.seek(size - _FOOTER.size)
+        index_offset, magic = _FOOTER.unpack(f.read(_FOOTER.size))
+        if magic != MAGIC:
+            return None
+        f.seek(index_offset)
+        return tp.cast(list[tuple[int, int]], pickle.loads(f.read(size - _FOOTER.size - index_offset)))
+
+
+def read_batches(filename: str, batches: tp.Iterable[int]) -> tp.Generator[TRow, None, None]:
+    """
+    Reads some of the batches of a complete file
+    :param filename: file to read
+    :param batches: indices of the batches in ascending order
+    """
+    index = tp.cast(list[tuple[int, int]], batch_index(filename))
+    with open(filename, 'rb') as f:
+        compression = _read_header(f)
+        for batch in batches:
+            f.seek(index[batch][0])
+            length, _ = _BATCH.unpack(f.read(_BATCH.size))
+            yield from decode_batch(f.read(length), compression)
+
+
+def file_mode(filename: str) -> int:
+    """
+    Permissions for a file written to replace the filename: those of the file it replaces, otherwise those
+    open gives to a new file (0o666 without the umask), rather than the 0o600 of a temporary file
+    """
+    try:
+        return stat.S_IMODE(os.stat(filename).st_mode)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+def write_file(rows: tp.Iterable[TRow], filename: str, compression: str = 'zlib') -> tp.Generator[TRow, None, int]:
+    """
+    Writes the rows passing through to the file atomically: it appears only once all the rows are written
+    (several runs may write the same file at once), a stream that was not read to the end leaves no file
+    :return: number of rows
+    """
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(filename) or '.',
+                                             prefix=f'.{os.path.basename(filename)}.')
+    completed = False
+    try:
+        with os.fdopen(descriptor, 'wb') as f:
+            count = yield from write_stream(rows, f, compression)
+            f.flush()
+            os.fchmod(f.fileno(), file_mode(filename))
+            os.fsync(f.fileno())
+        os.replace(temporary, filename)
+        completed = True
+    finally:
+        if not completed:
+            os.unlink(temporary)
+    return count
+
+
+def write(rows: tp.Iterable[TRow], filename: str, compression: str = 'zlib') -> int:
+    """
+    Writes the rows to a row file (readable with Graph.graph_from_file(filename))
+    :param rows: rows to write
+    :param filename: file to write, replaced once all the rows are written
+    :param compression: 'none', 'zlib' or 'lzma'
+    :return: number of rows
+    """
+    writer = write_file(rows, filename, compression)
+    while True:
+        try:
+            next(writer)
+        except StopIteration as stop:
+            return tp.cast(int, stop.value)
@@ -0,0 +1,123 @@
+import itertools
+import json
+import typing as tp
+from collections import Counter
+from operator import itemgetter
+
+from . import operations as ops
+
+if tp.TYPE_CHECKING:  # pragma: no cover
+    from .graph import Graph
+
+TConsumer = tp.Callable[[ops.TRow], tp.Any] | str
+
+BATCH_SIZE = 1024  # rows pulled from one sink before switching to the next one
+# private attributes derived from the others (generated functions), they do not change the result
+DERIVED_ATTRIBUTES = frozenset({'_function'})
+
+
+def fingerprint(value: tp.Any, memo: dict[int, tp.Hashable] | None = None,
+                identify: tp.Callable[[tp.Any], tp.Hashable] = id) -> tp.Hashable:
+    """
+    Structural identity of a graph (or of an operation): equal for graphs computing the same rows
+    from the same sources, objects without public state (functions, parsers) are compared by identity
+    :param value: graph, operation or any of their attributes
+    :param memo: fingerprints of already visited graphs by id
+    :param identify: identity of the objects without public state
+    """
+    from .graph import Graph
+    if memo is None:
+        memo = {}
+    if isinstance(value, Graph):
+        if id(value) not in memo:
+            memo[id(value)] = (fingerprint(value._operation, memo, identify),
+                               tuple(fingerprint(parent, memo, identify) for parent in value._parents))
+        return memo[id(value)]
+    if value is None or isinstance(value, (str, bytes, int, float, bool)):
+        return type(value).__name__, value
+    if isinstance(value, (list, tuple)):
+        return tuple(fingerprint(item, memo, identify) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((repr(key), fingerprint(item, memo, identify)) for key, item in value.items()))
+    if isinstance(value, (ops.Operation, ops.Mapper, ops.Reducer, ops.Joiner, ops.ProjectedParser)):
+        return type(value), tuple(sorted((name, fingerprint(item, memo, identify))
+                                         for name, item in vars(value).items() if name not in DERIVED_ATTRIBUTES))
+    return 'object', identify(value)
+
+
+class _Plan:
+    """Graphs with shared nodes: rows of a node consumed several times are computed once and tee'd"""
+
+    def __init__(self, graphs: tp.Iterable['Graph'], kwargs: dict[str, tp.Any]) -> None:
+        self.kwargs = kwargs
+        self.memo: dict[int, tp.Hashable] = {}
+        self.consumers: Counter[tp.Hashable] = Counter()
+        self.opened: dict[tp.Hashable, list[tp.Iterator[ops.TRow]]] = {}
+        visited: set[tp.Hashable] = set()
+        stack = list(graphs)
+        self.consumers.update(fingerprint(graph, self.memo) for graph in stack)
+        while stack:
+            graph = stack.pop()
+            key = fingerprint(graph, self.memo)
+            if key in visited:
+                continue
+            visited.add(key)
+            self.consumers.update(fingerprint(parent, self.memo) for parent in graph._parents)
+            stack.extend(graph._parents)
+
+    def open(self, graph: 'Graph') -> ops.TRowsIterable:
+        key = fingerprint(graph, self.memo)
+        if self.consumers[key] == 1:
+            return self._evaluate(graph)
+        if key not in self.opened:
+            count = self.consumers[key]
+            # mappers modify rows in place, so every consumer gets its own copy of each row
+            copies = ((row,) + tuple(row.copy() for _ in range(count - 1)) for row in self._evaluate(graph))
+            self.opened[key] = [map(itemgetter(index), branch)
+                                for index, branch in enumerate(itertools.tee(copies, count))]
+        return self.opened[key].pop()
+
+    def _evaluate(self, graph: 'Graph') -> ops.TRowsIterable:
+        parents_run = [self.open(parent) for parent in graph._parents]
+        return graph._operation(*parents_run, **self.kwargs)
+
+
+def run_many(graphs: dict[str, 'Graph'], consumers: dict[str, TConsumer],
+             kwargs: dict[str, tp.Any]) -> dict[str, list[ops.TRow]]:
+    """
+    Runs several graphs at once, the nodes they have in common (including the sources) are computed once
+    :param graphs: sink name -> graph
+    :param consumers: sink name -> callable receiving the rows or name of the file to write rows to (as json lines),
+        rows of the other sinks are collected into lists
+    :param kwargs: data sources
+    """
+    unknown = set(consumers) - set(graphs)
+    if unknown:
+        raise ValueError(f'Consumers for unknown sinks: {sorted(unknown)}')
+    plan = _Plan(graphs.values(), kwargs)
+    results: dict[str, list[ops.TRow]] = {name: [] for name in graphs if name not in consumers}
+    files: dict[str, tp.TextIO] = {}
+    sinks: dict[str, tp.Iterator[ops.TRow]] = {}
+    try:
+        for name, graph in graphs.items():
+            sinks[name] = iter(plan.open(graph))
+            consumer = consumers.get(name)
+            if isinstance(consumer, str):
+                files[name] = open(consumer, 'w')
+        # the sinks advance together, so that the rows of the shared nodes are not buffered longer than needed
+        while sinks:
+            for name in list(sinks):
+                batch = list(itertools.islice(sinks[name], BATCH_SIZE))
+                if len(batch) < BATCH_SIZE:
+                    del sinks[name]
+                if name in results:
+                    results[name].extend(batch)
+                elif name in files:
+                    files[name].writelines(json.dumps(row) + '\n' for row in batch)
+                else:
+                    for row in batch:
+                        tp.cast(tp.Callable[[ops.TRow], tp.Any], consumers[name])(row)
+    finally:
+        for f in files.values():
+            f.close()
+    return results
@@ -0,0 +1,118 @@
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
+import typing as tp
+
+from . import columnfile
+from . import rowfile
+from .batch import TRow
+
+FORMATS = ('jsonl', 'rows', 'columns')
+BUFFER_SIZE = 1 << 20  # bytes of the file buffer
+WRITE_BATCH_SIZE = 1024  # rows serialized together
+PENDING_WRITES = 8  # serialized batches waiting for the writer thread
+
+
+class WriteStats(tp.NamedTuple):
+    """Statistics of an output file written by Graph.write"""
+    path: str
+    format: str
+    rows: int
+    bytes: int
+    seconds: float
+
+
+class _BackgroundWriter:
+    """Writes the chunks of bytes to the file in a thread, so that writing overlaps the computation of the rows"""
+
+    def __init__(self, f: tp.BinaryIO) -> None:
+        self._file = f
+        self._queue: queue.Queue[bytes | None] = queue.Queue(PENDING_WRITES)
+        self._error: BaseException | None = None
+        self._thread = threading.Thread(target=self._write, daemon=True)
+        self._thread.start()
+
+    def _write(self) -> None:
+        while (chunk := self._queue.get()) is not None:
+            if self._error is None:
+                try:
+                    self._file.write(chunk)
+                except BaseException as error:  # reported to the producer, the remaining chunks are dropped
+                    self._error = error
+
+    def write(self, chunk: bytes) -> None:
+        if self._error is not None:
+            raise self._error
+        self._queue.put(chunk)
+
+    def close(self) -> None:
+        """Waits for the pending chunks to be written"""
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+
+def write_json_lines(rows: tp.Iterable[TRow], f: tp.BinaryIO, background: bool = True) -> int:
+    """
+    Writes the rows as JSON lines, serialized in batches
+    :param rows: rows to write
+    :param f: binary file to write to
+    :param background: write the serialized batches in a thread
+    :return: number of rows
+    """
+    writer = _BackgroundWriter(f) if background else None
+    emit = writer.write if writer is not None else f.write
+    count = 0
+    batch: list[str] = []
+    try:
+        for row in rows:
+            batch.append(json.dumps(row))
+            if len(batch) == WRITE_BATCH_SIZE:
+                chunk = ('\n'.join(batch) + '\n').encode()
+                emit(chunk)
+                count += len(batch)
+                batch = []
+        if batch:
+            chunk = ('\n'.join(batch) + '\n').encode()
+            emit(chunk)
+            count += len(batch)
+    finally:
+        if writer is not None:
+            writer.close()
+    return count
+
+
+def write(rows: tp.Iterable[TRow], path: str, format: str = 'jsonl', background: bool = True) -> WriteStats:
+    """
+    Writes the rows to the file atomically: they are written to a temporary file in the same directory,
+    which replaces the file once all the rows are written; a failed run leaves the file as it was
+    :param rows: rows to write
+    :param path: file to write
+    :param format: 'jsonl' (JSON lines), 'rows' (rowfile) or 'columns' (columnfile)
+    :param background: for JSON lines, write the serialized batches in a thread
+    """
+    if format not in FORMATS:
+        raise ValueError(f'Unknown format {format}, expected one of {list(FORMATS)}')
+    start = time.perf_counter()
+    if format == 'rows':
+        count = rowfile.write(rows, path)
+    elif format == 'columns':
+        count = columnfile.write(rows, path)
+    else:
+        descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path) or '.',
+                                                 prefix=f'.{os.path.basename(path)}.')
+        try:
+            with open(descriptor, 'wb', buffering=BUFFER_SIZE) as f:
+                count = write_json_lines(rows, f, background)
+                f.flush()
+                os.fchmod(f.fileno(), rowfile.file_mode(path))
+                os.fsync(f.fileno())
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+    return WriteStats(path, format, count, os.path.getsize(path), time.perf_counter() - start)
@@ -0,0 +1,80 @@
+import json
+import os
+import typing as tp
+
+from . import profiling
+
+MIN_SPAN_DURATION = 1e-4  # pulls shorter than this (in seconds) are only accounted in the span of the node
+
+
+class Tracer(profiling.Profiler):
+    """
+    Profiler recording the execution as Chrome Trace Event JSON (chrome://tracing, ui.perfetto.dev):
+    every node is a track with a span from its first to its last pull and a span for every long pull,
+    every sorting process is a separate process with its receive, sort and send phases
+    """
+
+    def __init__(self, min_span_duration: float = MIN_SPAN_DURATION) -> None:
+        """
+        :param min_span_duration: pulls taking at least this many seconds get their own spans
+        """
+        super().__init__()
+        self.min_span_duration = min_span_duration
+        self._lifetimes: dict[int, list[float]] = {}
+        self._pulls: list[tuple[int, float, float]] = []
+
+    def _pulled(self, stats: profiling.NodeStats, start: float, duration: float) -> None:
+        lifetime = self._lifetimes.setdefault(id(stats), [start, start])
+        lifetime[1] = start + duration
+        if duration >= self.min_span_duration:
+            self._pulls.append((id(stats), start, start + duration))
+
+    def to_trace(self) -> dict[str, tp.Any]:
+        """Recorded events in Chrome Trace Event format"""
+        pid = os.getpid()
+        events = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': 'compgraph'}}]
+        tracks: dict[int, int] = {}
+        for stats in (stats for run in self.runs for stats in _walk(run)):
+            if id(stats) not in self._lifetimes:
+                continue
+            track = tracks[id(stats)] = len(tracks) + 1
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': track,
+                           'args': {'name': stats.operation}})
+            events.append({'name': 'thread_sort_index', 'ph': 'M', 'pid': pid, 'tid': track,
+                           'args': {'sort_index': track}})
+            start, end = self._lifetimes[id(stats)]
+            events.append(_span(stats.operation, 'node', start, end, pid, track,
+                                {'rows_in': stats.rows_in, 'rows_out': stats.rows_out}))
+            if stats.process is not None:
+                process = stats.process
+                events.append({'name': 'process_name', 'ph': 'M', 'pid': process['pid'],
+                               'args': {'name': f'{stats.operation} process'}})
+                for name, phase_start, phase_end in process['phases']:
+                    events.append(_span(name, 'sort', phase_start, phase_end, process['pid'], 0))
+        for stats_id, start, end in self._pulls:
+            events.append(_span('pull', 'pull', start, end, pid, tracks[stats_id]))
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save(self, filename: str) -> None:
+        """
+        Writes the trace to the file
+        :param filename: name of the json file
+        """
+        with open(filename, 'w') as f:
+            json.dump(self.to_trace(), f)
+
+
+def _walk(stats: profiling.NodeStats) -> tp.Generator[profiling.NodeStats, None, None]:
+    yield stats
+    for input_stats in stats.inputs:
+        yield from _walk(input_stats)
+
+
+def _span(name: str, category: str, start: float, end: float, pid: int, tid: int,
+          args: dict[str, tp.Any] | None = None) -> dict[str, tp.Any]:
+    """Complete event, timestamps are in microseconds"""
+    event = {'name': name, 'cat': category, 'ph': 'X', 'ts': start * 1e6, 'dur': (end - start) * 1e6,
+             'pid': pid, 'tid': tid}
+    if args is not None:
+        event['args'] = args
+    return event
@@ -1,5 +1,4 @@
 import click
-import json
 
 from compgraph.algorithms import inverted_index_graph
 
@@ -12,15 +11,12 @@ def cli() -> None:  # pragma: no cover
 @cli.command()
 @click.argument('filename_in')
 @click.argument('filename_out')
-def run_inverted_index(filename_in: str, filename_out: str) -> None:
+@click.option('--read-workers', default=1, help='Number of processes parsing the input files')
+def run_inverted_index(filename_in: str, filename_out: str, read_workers: int) -> None:
     graph = inverted_index_graph(input_stream_name='input', doc_column='doc_id', text_column='text',
-                                 result_column='tf_idf', filename=filename_in)
+                                 result_column='tf_idf', filename=filename_in, read_workers=read_workers)
 
-    result = graph.run(input=lambda: filename_in)
-    with open(filename_out, 'w') as out:
-        for row in result:
-            json.dump(row, out)
-            out.write('\n')
+    graph.write(filename_out, input=lambda: filename_in)
 
 
 if __name__ == '__main__':
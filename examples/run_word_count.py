@@ -1,5 +1,4 @@
 import click
-import json
 
 from compgraph.algorithms import word_count_graph
 
@@ -12,14 +11,12 @@ def cli() -> None:  # pragma: no cover
 @cli.command()
 @click.argument('filename_in')
 @click.argument('filename_out')
-def run_count(filename_in: str, filename_out: str) -> None:
-    graph = word_count_graph(input_stream_name='input', text_column='text', count_column='count', filename=filename_in)
-
-    result = graph.run(input=lambda: filename_in)
-    with open(filename_out, 'w') as out:
-        for row in result:
-            json.dump(row, out)
-            out.write('\n')
+@click.option('--read-workers', default=1, help='Number of processes parsing the input files')
+def run_count(filename_in: str, filename_out: str, read_workers: int) -> None:
+    graph = word_count_graph(input_stream_name='input', text_column='text', count_column='count', filename=filename_in,
+                             read_workers=read_workers)
+
+    graph.write(filename_out, input=lambda: filename_in)
 
 
 if __name__ == '__main__':
@@ -1,5 +1,4 @@
 import click
-import json
 
 from compgraph.algorithms import yandex_maps_graph
 
@@ -13,19 +12,16 @@ def cli() -> None:  # pragma: no cover
 @click.argument('filename_time')
 @click.argument('filename_length')
 @click.argument('filename_out')
-def run_maps(filename_time: str, filename_length: str, filename_out: str) -> None:
+@click.option('--read-workers', default=1, help='Number of processes parsing the input files')
+def run_maps(filename_time: str, filename_length: str, filename_out: str, read_workers: int) -> None:
     graph = yandex_maps_graph(input_stream_name_time='input_time', input_stream_name_length='input_length',
                               enter_time_column='enter_time', leave_time_column='leave_time',
                               edge_id_column='edge_id', start_coord_column='start', end_coord_column='end',
                               weekday_result_column='weekday', hour_result_column='hour',
                               speed_result_column='speed', filename_time=filename_time,
-                              filename_length=filename_length)
+                              filename_length=filename_length, read_workers=read_workers)
 
-    result = graph.run(input_time=lambda: filename_time, input_length=filename_length)
-    with open(filename_out, 'w') as out:
-        for row in result:
-            json.dump(row, out)
-            out.write('\n')
+    graph.write(filename_out, input_time=lambda: filename_time, input_length=filename_length)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,50 @@
+import json
+from pathlib import Path
+
+import pytest
+from click.testing import CliRunner
+
+from benchmarks import generators, suite
+from benchmarks.__main__ import cli
+
+
+def test_generators_deterministic() -> None:
+    assert list(generators.text_corpus(5, seed=1)) == list(generators.text_corpus(5, seed=1))
+    assert list(generators.text_corpus(5, seed=1)) != list(generators.text_corpus(5, seed=2))
+
+    travels = list(generators.travel_times(10, 3))
+    assert len(travels) == 10 and all(0 <= row['edge_id'] < 3 for row in travels)
+    assert all(row['enter_time'] < row['leave_time'] for row in travels)
+    assert [row['edge_id'] for row in generators.edge_lengths(3)] == [0, 1, 2]
+
+
+def test_suite_compare() -> None:
+    results = suite.run(scale=1, repeat=1, names=['split', 'reduce'])
+    assert set(results['results']) == {'split', 'reduce'}
+    assert results['results']['reduce']['rows_out'] == 1000
+
+    baseline = json.loads(json.dumps(results))
+    baseline['results']['split']['seconds'] /= 2
+    baseline['results']['reduce']['seconds'] *= 2
+    assert [(name, regression) for name, _, regression in suite.compare(results, baseline)] == \
+        [('reduce', False), ('split', True)]
+
+    baseline['scale'] = 2
+    with pytest.raises(ValueError):
+        suite.compare(results, baseline)
+
+
+def test_cli_baseline(tmp_path: Path) -> None:
+    output = tmp_path / 'results.json'
+    runner = CliRunner()
+
+    result = runner.invoke(cli, ['run', '--only', 'split', '--repeat', '1', '--output', str(output)])
+    assert result.exit_code == 0
+
+    baseline = json.loads(output.read_text())
+    baseline['results']['split']['seconds'] /= 10
+    (tmp_path / 'baseline.json').write_text(json.dumps(baseline))
+
+    result = runner.invoke(cli, ['compare', str(output), str(tmp_path / 'baseline.json')])
+    assert result.exit_code == 1
+    assert 'REGRESSION' in result.output
@@ -1,11 +1,26 @@
+import asyncio
+import json
+import bz2
+import gzip
+import lzma
+import multiprocessing
+import os
+import typing as tp
+import zlib
 from itertools import islice, cycle
 from operator import itemgetter
+from pathlib import Path
 
+import pytest
 from pytest import approx
 
+from benchmarks import generators
 from compgraph import algorithms
 from compgraph.graph import Graph
 from compgraph import operations as ops
+from compgraph import checkpoint, columnfile, compressed, explain, memory, parallel, profiling, rowfile, sink, tracing
+from compgraph.cache import ResultCache
+from compgraph.incremental import IncrementalState
 
 
 def test_graph_map() -> None:
@@ -268,3 +283,768 @@ def test_yandex_maps() -> None:
     result = graph.run(travel_time=lambda: islice(cycle(iter(times)), len(times)), edge_length=lambda: iter(lengths))
 
     assert sorted(result, key=itemgetter('weekday', 'hour')) == expected
+
+
+PARALLEL_TEXTS = [
+    {'doc_id': doc_id, 'text': ' '.join(f'Word{(doc_id * i) % 7}! LONGWORD{i % 5}' for i in range(doc_id % 9 + 1))}
+    for doc_id in range(50)
+]
+TEXT_SOURCES = {'texts': lambda: (dict(row) for row in PARALLEL_TEXTS)}
+TRAVEL_TIMES = list(generators.travel_times(300, 20))
+EDGE_LENGTHS = list(generators.edge_lengths(20))
+TRAVEL_SOURCES = {'travel_time': lambda: (dict(row) for row in TRAVEL_TIMES),
+                  'edge_length': lambda: (dict(row) for row in EDGE_LENGTHS)}
+
+
+ALGORITHMS: dict[str, tuple[tp.Callable[[], Graph], dict[str, tp.Any]]] = {
+    'word_count': (lambda: algorithms.word_count_graph('texts'), TEXT_SOURCES),
+    'inverted_index': (lambda: algorithms.inverted_index_graph('texts'), TEXT_SOURCES),
+    'pmi': (lambda: algorithms.pmi_graph('texts'), TEXT_SOURCES),
+    'yandex_maps': (lambda: algorithms.yandex_maps_graph('travel_time', 'edge_length'), TRAVEL_SOURCES),
+}
+RUN_MODES: dict[str, tp.Callable[[Graph, dict[str, tp.Any]], tp.Iterable[ops.TRow]]] = {
+    'parallel': lambda graph, sources: graph.run(parallelism=3, **sources),
+    'concurrent_branches': lambda graph, sources: graph.run(concurrent_branches=True, **sources),
+    'batches': lambda graph, sources: graph.run(batch_size=16, **sources),
+    'compiled': lambda graph, sources: graph.compile().run(**sources),
+}
+
+
+@pytest.mark.parametrize('mode', RUN_MODES)
+@pytest.mark.parametrize('algorithm', ALGORITHMS)
+def test_run_modes_match_sequential(algorithm: str, mode: str) -> None:
+    make_graph, sources = ALGORITHMS[algorithm]
+    graph = make_graph()
+
+    expected = list(graph.run(**sources))
+
+    # sums of a group may be added up in another order
+    assert list(RUN_MODES[mode](graph, sources)) == [approx(row) for row in expected]
+
+
+def test_parallel_run_equal_keys() -> None:
+    # keys that are equal but printed differently are one group
+    graph = Graph.graph_from_iter('keys').sort(['key']).reduce(ops.Count('count'), ['key'])
+    keys = [value for number in range(10) for value in [number, float(number)]] + [True, False]
+
+    expected = list(graph.run(keys=lambda: ({'key': key} for key in keys)))
+
+    assert list(graph.run(parallelism=3, keys=lambda: ({'key': key} for key in keys))) == expected
+
+
+def test_parallel_run_unordered() -> None:
+    graph = algorithms.word_count_graph('texts')
+
+    expected = list(graph.run(texts=lambda: (dict(row) for row in PARALLEL_TEXTS)))
+    result = graph.run(parallelism=2, ordered=False, texts=lambda: (dict(row) for row in PARALLEL_TEXTS))
+
+    assert sorted(result, key=itemgetter('text')) == sorted(expected, key=itemgetter('text'))
+
+
+def test_parallel_run_from_file(tmp_path: Path) -> None:
+    filename = tmp_path / 'texts.txt'
+    filename.write_text(''.join(json.dumps(row) + '\n' for row in PARALLEL_TEXTS))
+    graph = algorithms.word_count_graph('texts', filename=str(filename))
+
+    assert list(graph.run(parallelism=4)) == list(graph.run())
+
+
+def test_parallel_run_bounded_exchange(monkeypatch: pytest.MonkeyPatch) -> None:
+    # tiny queues and mailboxes: the batches not consumed yet are spilled instead of piling up in memory
+    monkeypatch.setattr(parallel, 'BATCH_SIZE', 3)
+    monkeypatch.setattr(parallel, 'QUEUE_BATCHES', 1)
+    monkeypatch.setattr(parallel, 'MAILBOX_BATCHES', 1)
+    spilled = multiprocessing.get_context('fork').Value('i', 0)  # the workers spill in forked processes
+
+    def spill(self: parallel._Mailbox, batch: list[ops.TRow], original: tp.Any = parallel._Mailbox._spilled) -> tp.Any:
+        with spilled.get_lock():
+            spilled.value += 1
+        return original(self, batch)
+
+    monkeypatch.setattr(parallel._Mailbox, '_spilled', spill)
+    graph = algorithms.pmi_graph('texts')
+
+    expected = list(graph.run(texts=lambda: (dict(row) for row in PARALLEL_TEXTS)))
+    assert list(graph.run(parallelism=3, texts=lambda: (dict(row) for row in PARALLEL_TEXTS))) == expected
+    assert spilled.value > 0
+    top = Graph.graph_from_iter('texts').sort(['doc_id']).limit(2)
+    assert list(top.run(parallelism=2, texts=lambda: (dict(row) for row in PARALLEL_TEXTS))) == PARALLEL_TEXTS[:2]
+
+
+def test_parallel_run_worker_failure() -> None:
+    graph = Graph.graph_from_iter('texts').map(ops.Divide('doc_id', 'doc_id')).sort(['doc_id'])
+
+    with pytest.raises(RuntimeError, match='Denominator column contains zero value'):
+        list(graph.run(parallelism=2, texts=lambda: (dict(row) for row in PARALLEL_TEXTS)))
+
+
+def test_concurrent_branches_failure() -> None:
+    graph_to_join = Graph.graph_from_iter('texts').map(ops.Divide('doc_id', 'doc_id'))
+    graph = Graph.graph_from_iter('texts').join(ops.InnerJoiner(), graph_to_join, ['doc_id'])
+
+    with pytest.raises(RuntimeError, match='Denominator column contains zero value'):
+        list(graph.run(concurrent_branches=True, texts=lambda: (dict(row) for row in PARALLEL_TEXTS)))
+
+
+def test_graph_arun_async_source() -> None:
+    graph = algorithms.word_count_graph('texts')
+
+    async def texts() -> tp.AsyncGenerator[dict[str, tp.Any], None]:
+        for row in PARALLEL_TEXTS:
+            await asyncio.sleep(0)
+            yield dict(row)
+
+    async def collect() -> list[dict[str, tp.Any]]:
+        return [row async for row in graph.arun(texts=texts())]
+
+    expected = list(graph.run(texts=lambda: (dict(row) for row in PARALLEL_TEXTS)))
+
+    assert asyncio.run(collect()) == expected
+
+    # an async iterable can be read once, a graph reading the source several times needs a callable
+    async def collect_index(texts: tp.Any) -> list[dict[str, tp.Any]]:
+        return [row async for row in algorithms.inverted_index_graph('texts').arun(texts=texts)]
+
+    with pytest.raises(ValueError, match='can be read only once'):
+        asyncio.run(collect_index(texts()))
+    assert len(asyncio.run(collect_index(texts))) == len(list(algorithms.inverted_index_graph('texts').run(
+        texts=lambda: (dict(row) for row in PARALLEL_TEXTS))))
+
+
+def test_graph_arun_concurrent_branches() -> None:
+    graph_to_join = Graph.graph_from_iter('texts').map(ops.DummyMapper())
+    graph = Graph.graph_from_iter('docs').join(ops.InnerJoiner(), graph_to_join, ['doc_id'])
+
+    async def texts() -> tp.AsyncGenerator[dict[str, tp.Any], None]:
+        for row in PARALLEL_TEXTS:
+            yield dict(row)
+
+    async def collect() -> list[dict[str, tp.Any]]:
+        return [row async for row in graph.arun(concurrent_branches=True, texts=texts,
+                                                docs=lambda: (dict(row) for row in PARALLEL_TEXTS))]
+
+    # the branch reading the async source runs in another process, where the event loop does not run
+    with pytest.raises(RuntimeError, match='Async sources can not be read by the processes of concurrent_branches'):
+        asyncio.run(collect())
+
+
+def test_graph_arun_early_stop() -> None:
+    graph = Graph.graph_from_iter('texts').sort(['doc_id'])
+
+    async def first() -> dict[str, tp.Any]:
+        rows = graph.arun(texts=lambda: (dict(row) for row in PARALLEL_TEXTS))
+        row = await rows.__anext__()
+        await rows.aclose()
+        return row
+
+    assert asyncio.run(first()) == PARALLEL_TEXTS[0]
+
+
+def test_graph_sort_mixed_columns() -> None:
+    graph = Graph.graph_from_iter('data').sort(['key'])
+
+    rows = [{'key': 3, 'a': 1}, {'key': 1, 'b': 2}, {'key': 2, 'a': 3}, {'key': 1, 'a': 4}]
+
+    expected = [{'key': 1, 'b': 2}, {'key': 1, 'a': 4}, {'key': 2, 'a': 3}, {'key': 3, 'a': 1}]
+
+    assert list(graph.run(data=lambda: iter(rows))) == expected
+
+
+def test_graph_declared_schema() -> None:
+    graph = Graph.graph_from_iter('data', schema=['doc_id', 'text']) \
+        .map(ops.Split('text')) \
+        .map(ops.Product(['doc_id', 'doc_id'], 'square')) \
+        .sort(['text', 'doc_id'])
+
+    assert graph.schema == ('doc_id', 'text', 'square')
+
+    rows = [{'doc_id': 2, 'text': 'b a'}, {'doc_id': 1, 'text': 'b'}]
+
+    expected = [
+        {'doc_id': 2, 'text': 'a', 'square': 4},
+        {'doc_id': 1, 'text': 'b', 'square': 1},
+        {'doc_id': 2, 'text': 'b', 'square': 4},
+    ]
+
+    assert list(graph.run(data=lambda: iter(rows))) == expected
+    assert graph.reduce(ops.Count('count'), ['text']).schema is None
+
+    with pytest.raises(ValueError):
+        list(graph.run(data=lambda: iter([{'doc_id': 1, 'text': 'a', 'extra': 0}])))
+
+
+def test_graph_compile_fuses_chain() -> None:
+    class Negate(ops.Mapper):
+        def __call__(self, row: ops.TRow) -> ops.TRowsGenerator:
+            row['value'] = -row['value']
+            yield row
+
+    graph = Graph.graph_from_iter('data') \
+        .map(ops.Product(['value', 'value'], 'square')) \
+        .map(Negate()) \
+        .map(ops.Filter(lambda row: row['value'] < -1)) \
+        .map(ops.Project(['value', 'square']))
+
+    compiled = graph.compile()
+
+    assert 'lambda' not in compiled._operation.source
+    assert len(compiled._operation.mappers) == 2
+    assert isinstance(compiled._parents[0]._operation, ops.Map)
+    assert len(compiled._parents[0]._parents[0]._operation.mappers) == 1
+
+    rows = [{'value': 1}, {'value': 2}, {'value': 3}]
+
+    expected = [{'value': -2, 'square': 4}, {'value': -3, 'square': 9}]
+
+    assert list(compiled.run(data=lambda: (dict(row) for row in rows))) == expected
+    assert list(graph.run(data=lambda: (dict(row) for row in rows))) == expected
+
+
+SUFFIXED_JOIN_SOURCES = {'left': lambda: iter([{'k': 1, 'x': 1}]), 'right': lambda: iter([{'k': 1, 'x': 2}])}
+
+
+def _suffixed_joins() -> list[Graph]:
+    """Joins of SUFFIXED_JOIN_SOURCES that differ only in the suffixes of the clashing columns"""
+    return [Graph.graph_from_iter('left').join(joiner, Graph.graph_from_iter('right'), ['k'])
+            for joiner in [ops.InnerJoiner(), ops.InnerJoiner('_left', '_right')]]
+
+
+def test_graph_run_many(tmp_path: Path) -> None:
+    calls = []
+
+    def texts() -> tp.Iterator[ops.TRow]:
+        calls.append(1)
+        return (dict(row) for row in PARALLEL_TEXTS)
+
+    word_count = algorithms.word_count_graph('texts')
+    inverted_index = algorithms.inverted_index_graph('texts')
+    docs = Graph.graph_from_iter('texts').map(ops.Project(['doc_id']))
+
+    expected_word_count = list(word_count.run(texts=texts))
+    expected_inverted_index = list(inverted_index.run(texts=texts))
+    expected_docs = list(docs.run(texts=texts))
+
+    calls.clear()
+    received: list[ops.TRow] = []
+    filename = tmp_path / 'docs.txt'
+    result = Graph.run_many({'wc': word_count, 'idx': inverted_index, 'docs': docs, 'wc_copy': word_count},
+                            {'idx': received.append, 'docs': str(filename)}, texts=texts)
+
+    assert len(calls) == 1
+    assert result == {'wc': expected_word_count, 'wc_copy': expected_word_count}
+    assert received == expected_inverted_index
+    assert [json.loads(line) for line in filename.read_text().splitlines()] == expected_docs
+
+    with pytest.raises(ValueError):
+        Graph.run_many({'wc': word_count}, {'idx': received.append}, texts=texts)
+
+    # joins differing only in the suffixes of the clashing columns are not shared
+    default, suffixed = _suffixed_joins()
+    assert Graph.run_many({'default': default, 'suffixed': suffixed}, {}, **SUFFIXED_JOIN_SOURCES) == {
+        'default': [{'k': 1, 'x_1': 1, 'x_2': 2}], 'suffixed': [{'k': 1, 'x_left': 1, 'x_right': 2}]}
+
+
+def test_graph_limit_and_top() -> None:
+    word_count = algorithms.word_count_graph('texts')
+    expected = list(word_count.run(texts=lambda: (dict(row) for row in PARALLEL_TEXTS)))
+
+    top = word_count.limit(3)
+    assert isinstance(top._operation, ops.Top)
+    assert list(top.run(texts=lambda: (dict(row) for row in PARALLEL_TEXTS))) == expected[:3]
+    assert list(top.run(parallelism=2, texts=lambda: (dict(row) for row in PARALLEL_TEXTS))) == expected[:3]
+
+    most_frequent = word_count.top(2, ['count'], descending=True)
+    assert list(most_frequent.run(texts=lambda: (dict(row) for row in PARALLEL_TEXTS))) == expected[::-1][:2]
+
+    read = []
+
+    def numbers() -> ops.TRowsGenerator:
+        for number in range(100):
+            read.append(number)
+            yield {'number': number}
+
+    graph = Graph.graph_from_iter('numbers').map(ops.DummyMapper()).limit(5).limit(10)
+    assert list(graph.run(numbers=numbers)) == [{'number': number} for number in range(5)]
+    assert len(read) == 5
+
+    with pytest.raises(ValueError):
+        Graph.graph_from_iter('numbers').limit(-1)
+
+
+def test_graph_profile() -> None:
+    graph = algorithms.word_count_graph('texts')
+    expected = list(graph.run(texts=lambda: (dict(row) for row in PARALLEL_TEXTS)))
+
+    profiler = profiling.Profiler()
+    assert list(graph.run(profile=profiler, texts=lambda: (dict(row) for row in PARALLEL_TEXTS))) == expected
+
+    [root] = profiler.to_json()
+    assert root['operation'] == "ExternalSort(keys=['count', 'text'])"
+    assert root['rows_out'] == len(expected)
+    assert root['process']['peak_memory'] > 0
+    assert root['inputs'][0]['operation'] == "Reduce(Count, keys=['text'])"
+
+    node = root
+    while node['inputs']:
+        assert node['wall_time'] >= 0 and node['bytes_out'] > 0
+        assert node['rows_in'] == sum(input_node['rows_out'] for input_node in node['inputs'])
+        node = node['inputs'][0]
+    assert node['operation'] == 'ReadIterGenerator(texts)'
+    assert node['rows_out'] == len(PARALLEL_TEXTS)
+
+    with profiling.Profiler() as profiler:
+        list(graph.run(texts=lambda: (dict(row) for row in PARALLEL_TEXTS)))
+        list(graph.run(texts=lambda: (dict(row) for row in PARALLEL_TEXTS)))
+    assert len(profiler.runs) == 2
+    assert profiler.report().count('ReadIterGenerator(texts)') == 2
+
+    assert graph.profiler is None
+    list(graph.run(profile=True, texts=lambda: (dict(row) for row in PARALLEL_TEXTS)))
+    assert graph.profiler is not None and graph.profiler is not profiler
+    assert 'Reduce(Count' in graph.profiler.report()
+
+    with pytest.raises(ValueError):
+        list(graph.run(profile=True, parallelism=2, texts=lambda: (dict(row) for row in PARALLEL_TEXTS)))
+
+
+def test_graph_explain(tmp_path: Path) -> None:
+    graph = algorithms.inverted_index_graph('texts')
+
+    plan = graph.explain({'texts': 1000}).splitlines()
+    assert plan[0].startswith("Reduce(TopN, keys=['text'])")
+    assert sum('ReadIterGenerator(texts)  rows~1K' in line for line in plan) == 3
+    assert all('[computed 3 times]' in line for line in plan if 'ReadIterGenerator' in line)
+    assert '?' in Graph.graph_from_iter('texts').map(ops.DummyMapper()).explain()
+
+    plan = algorithms.word_count_graph('texts').explain({'texts': 10 * len(PARALLEL_TEXTS)},
+                                                        texts=lambda: iter(PARALLEL_TEXTS)).splitlines()
+    assert plan[-1].endswith(f'ReadIterGenerator(texts)  rows~{10 * len(PARALLEL_TEXTS)} '
+                             f'cost~{10 * len(PARALLEL_TEXTS)} total~{10 * len(PARALLEL_TEXTS)}')
+
+    filename = tmp_path / 'texts.txt'
+    filename.write_text(''.join(json.dumps(row) + '\n' for row in PARALLEL_TEXTS))
+    plan = algorithms.word_count_graph('texts', filename=str(filename)).limit(1).explain().splitlines()
+    assert plan[0].startswith("Top(1, keys=['count', 'text'])  rows~1 ")
+    assert plan[-1].lstrip().startswith(f'Read({filename})  rows~{len(PARALLEL_TEXTS)} ')
+
+    # the graph runs on the first lines of a larger file, checkpoints and cached results are not made of them
+    filename.write_text((json.dumps({'text': 'word'}) + '\n') * 2 * explain.SAMPLE_LINES)
+    words = Graph.graph_from_file(str(filename), json.loads).map(ops.Split('text')).sort(['text'])
+    graphs = [words.checkpoint(str(tmp_path / 'words')).reduce(ops.Count('count'), ['text']),
+              words.cache(ResultCache(str(tmp_path / 'cache'), 2 ** 20)).reduce(ops.Count('count'), ['text'])]
+    for graph in graphs:
+        graph.explain()
+    assert not (tmp_path / 'words').exists() and not list((tmp_path / 'cache').glob('*'))
+    for graph in graphs:
+        assert list(graph.run()) == [{'text': 'word', 'count': 2 * explain.SAMPLE_LINES}]
+
+
+def test_graph_trace(tmp_path: Path) -> None:
+    graph = algorithms.yandex_maps_graph('travel_time', 'edge_length')
+    tracer = tracing.Tracer(min_span_duration=0)
+
+    travel_time = [
+        {'enter_time': '20171020T112238.723000', 'leave_time': '20171020T112237.427000', 'edge_id': 1},
+        {'enter_time': '20171011T145553.040000', 'leave_time': '20171011T145551.957000', 'edge_id': 1},
+    ]
+    edge_length = [{'start': [37.84870228730142, 55.73853974696249], 'end': [37.8490418381989, 55.73832445777953],
+                    'edge_id': 1}]
+
+    rows = list(graph.run(profile=tracer, travel_time=lambda: iter(travel_time), edge_length=lambda: iter(edge_length)))
+    assert len(rows) == 2
+
+    filename = tmp_path / 'trace.json'
+    tracer.save(str(filename))
+    events = json.loads(filename.read_text())['traceEvents']
+
+    nodes = [event for event in events if event.get('cat') == 'node']
+    assert nodes[0]['name'].startswith('Map(Project)') and nodes[0]['tid'] == 1
+    assert all(event['dur'] >= 0 for event in events if event['ph'] == 'X')
+
+    sort_processes = {event['pid'] for event in events if event.get('cat') == 'sort'}
+    assert len(sort_processes) == sum(node['name'].startswith('ExternalSort') for node in nodes)
+    assert {event['name'] for event in events if event.get('cat') == 'sort'} == {'receive', 'sort', 'send'}
+    assert any(event.get('cat') == 'pull' for event in events)
+
+
+def test_graph_memory_budget(monkeypatch: pytest.MonkeyPatch) -> None:
+    # the budget is always exceeded, so every buffer is spilled once it reaches CHECK_EVERY items
+    monkeypatch.setattr(memory, 'CHECK_EVERY', 16)
+    texts = PARALLEL_TEXTS * 10
+
+    for graph in [algorithms.inverted_index_graph('texts'), algorithms.pmi_graph('texts')]:
+        expected = list(graph.run(texts=lambda: (dict(row) for row in texts)))
+        budget = memory.MemoryBudget(1)
+
+        assert list(graph.run(memory_budget=budget, texts=lambda: (dict(row) for row in texts))) == expected
+
+        report = budget.report()
+        assert report["ExternalSort(keys=['doc_id', 'text'])"]['spills'] > 1
+        assert any(operator.startswith('TermFrequency') and stats['spills'] for operator, stats in report.items())
+
+    rows = [{'key': 1, 'value': value} for value in range(200)]
+    graph = Graph.graph_from_iter('left').join(ops.OuterJoiner(), Graph.graph_from_iter('right'), ['key'])
+
+    expected = list(graph.run(left=lambda: (dict(row) for row in rows[:100]),
+                              right=lambda: (dict(row) for row in rows)))
+    budget = memory.MemoryBudget(1)
+    result = graph.run(memory_budget=budget, left=lambda: (dict(row) for row in rows[:100]),
+                       right=lambda: (dict(row) for row in rows))
+
+    assert list(result) == expected
+    assert budget.report()['OuterJoiner']['spills'] == 2
+
+    with pytest.raises(ValueError):
+        memory.MemoryBudget(0)
+
+
+PARSED_LINES: list[str] = []
+
+
+def _counting_parser(line: str) -> ops.TRow:
+    PARSED_LINES.append(line)
+    return tp.cast(ops.TRow, json.loads(line))
+
+
+def test_graph_checkpoint(tmp_path: Path) -> None:
+    filename = tmp_path / 'texts.txt'
+    filename.write_text(''.join(json.dumps(row) + '\n' for row in PARALLEL_TEXTS))
+    sorted_words = Graph.graph_from_file(str(filename), _counting_parser) \
+        .map(ops.Split('text')).sort(['text']).checkpoint(str(tmp_path / 'words'))
+    graph = sorted_words.reduce(ops.Count('count'), ['text'])
+
+    expected = list(graph.run())
+    assert PARSED_LINES
+
+    # the checkpoint is valid, nothing before it is computed
+    PARSED_LINES.clear()
+    assert list(graph.run()) == expected
+    assert not PARSED_LINES
+
+    # an unfinished run leaves no checkpoint, so the next one starts over
+    filename.write_text(''.join(json.dumps(row) + '\n' for row in PARALLEL_TEXTS[:-1]))
+    assert len(list(islice(graph.run(), 1))) == 1
+    assert [path.name for path in (tmp_path / 'words').iterdir()] == ['rows']
+    PARSED_LINES.clear()
+    assert list(graph.run()) != expected
+    assert PARSED_LINES
+
+    # data sources are compared by their rows, sorts are checkpointed by the run
+    graph = Graph.graph_from_iter('texts').map(ops.Split('text')).sort(['text']).reduce(ops.Count('count'), ['text'])
+    expected = list(graph.run(texts=lambda: iter(PARALLEL_TEXTS)))
+    texts = [dict(row) for row in PARALLEL_TEXTS]
+    assert list(graph.run(checkpoint_dir=str(tmp_path / 'auto'), texts=lambda: iter(texts))) == expected
+    assert len(list((tmp_path / 'auto').iterdir())) == 1
+
+    texts[0]['text'] += ' checkpoint'
+    result = list(graph.run(checkpoint_dir=str(tmp_path / 'auto'), texts=lambda: iter(texts)))
+    assert {'text': 'checkpoint', 'count': 1} in result
+
+    with pytest.raises(ValueError):
+        list(graph.run(parallelism=2, checkpoint_dir=str(tmp_path / 'auto'), texts=lambda: iter(texts)))
+
+    # a checkpoint of a join is not valid for a join differing only in the suffixes of the clashing columns
+    default, suffixed = (graph.checkpoint(str(tmp_path / 'join')) for graph in _suffixed_joins())
+    assert list(default.run(**SUFFIXED_JOIN_SOURCES)) == [{'k': 1, 'x_1': 1, 'x_2': 2}]
+    assert list(suffixed.run(**SUFFIXED_JOIN_SOURCES)) == [{'k': 1, 'x_left': 1, 'x_right': 2}]
+
+    # a dry pass neither writes the checkpoint nor reads a valid one
+    for path in ['dry', 'words']:
+        dry = checkpoint.Checkpoint(str(tmp_path / path), sorted_words)
+        assert list(dry(iter(PARALLEL_TEXTS[:1]), dry=True)) == PARALLEL_TEXTS[:1]
+    assert not (tmp_path / 'dry').exists()
+
+
+def test_graph_cache(tmp_path: Path) -> None:
+    filename = tmp_path / 'texts.txt'
+    filename.write_text(''.join(json.dumps(row) + '\n' for row in PARALLEL_TEXTS))
+    cache = ResultCache(str(tmp_path / 'cache'), max_size=2 ** 20)
+    words = Graph.graph_from_file(str(filename), _counting_parser).map(ops.Split('text'))
+    count = words.sort(['text']).reduce(ops.Count('count'), ['text']).cache(cache)
+    docs = words.sort(['doc_id']).reduce(ops.Count('count'), ['doc_id']).cache(cache)
+
+    expected = list(count.run())
+    PARSED_LINES.clear()
+    assert list(count.run()) == expected
+    assert not PARSED_LINES and (cache.hits, cache.misses) == (1, 1)
+
+    # another plan is another result
+    list(docs.run())
+    assert PARSED_LINES and cache.misses == 2 and len(cache.entries()) == 2
+
+    # the least recently used result is evicted
+    assert list(count.run()) == expected
+    cache.max_size = cache.size() - 1
+    filename.write_text(''.join(json.dumps(row) + '\n' for row in PARALLEL_TEXTS[1:]))
+    assert list(count.run()) != expected
+    assert len(cache.entries()) == 2 and cache.misses == 3
+    assert cache.get(cache.key(count._parents[0], {})) is not None
+    assert cache.get(cache.key(docs._parents[0], {})) is None
+
+    # joins differing only in the suffixes of the clashing columns are different results
+    default, suffixed = (graph.cache(cache) for graph in _suffixed_joins())
+    assert list(default.run(**SUFFIXED_JOIN_SOURCES)) == [{'k': 1, 'x_1': 1, 'x_2': 2}]
+    assert list(suffixed.run(**SUFFIXED_JOIN_SOURCES)) == [{'k': 1, 'x_left': 1, 'x_right': 2}]
+
+    # every worker sees only its partition of the rows, which is not the cached result
+    with pytest.raises(ValueError):
+        list(count.run(parallelism=2))
+    with pytest.raises(ValueError):
+        ResultCache(str(tmp_path), max_size=0)
+
+
+def test_graph_incremental(tmp_path: Path) -> None:
+    filename = tmp_path / 'texts.txt'
+    graph = algorithms.word_count_graph('texts', filename=str(filename))
+    state = IncrementalState(str(tmp_path / 'word_count'), [str(filename)])
+    lines = [json.dumps(row) + '\n' for row in PARALLEL_TEXTS]
+
+    filename.write_text(''.join(lines[:20]) + lines[20][:10])
+    assert list(graph.run(incremental=state)) == list(algorithms.word_count_graph('texts').run(
+        texts=lambda: iter(PARALLEL_TEXTS[:20])))
+
+    # the line being appended is read by the next run, an unfinished run is not committed
+    with filename.open('a') as f:
+        f.write(''.join(lines[20:])[10:])
+    assert len(list(islice(graph.run(incremental=state), 1))) == 1
+    assert list(graph.run(incremental=state)) == list(graph.run())
+
+    # a rewritten file is read anew
+    filename.write_text(''.join(lines[:5]))
+    assert list(graph.run(incremental=state)) == list(graph.run())
+
+    # a last line without a line end is read once a run finds the file unchanged since the previous one
+    filename.write_text(''.join(lines[:5]) + lines[5].rstrip('\n'))
+    assert list(graph.run(incremental=state)) != list(graph.run())
+    assert list(graph.run(incremental=state)) == list(graph.run())
+    # the line end appended to it is skipped, while a continued line makes the state computed anew
+    with filename.open('a') as f:
+        f.write('\n' + lines[6])
+    assert list(graph.run(incremental=state)) == list(graph.run())
+    with filename.open('a') as f:
+        f.write(lines[7].rstrip('\n'))
+    list(graph.run(incremental=state))
+    list(graph.run(incremental=state))
+    with filename.open('a') as f:
+        f.write('  \n' + lines[8])
+    assert list(graph.run(incremental=state)) == list(graph.run())
+
+    # only the state files are removed from the directory
+    (tmp_path / 'word_count' / 'notes.txt').write_text('kept')
+    with filename.open('a') as f:
+        f.write(lines[9])
+    assert list(graph.run(incremental=state)) == list(graph.run())
+    assert sorted(path.name for path in (tmp_path / 'word_count').iterdir())[-2:] == ['manifest.json', 'notes.txt']
+
+    graph = Graph.graph_from_iter('values').sort(['key']).reduce(ops.Mean('value'), ['key'])
+    state = IncrementalState(str(tmp_path / 'mean'), ['values'])
+    rows = [{'key': index % 3, 'value': index} for index in range(30)]
+    for start in range(0, 30, 10):
+        result = list(graph.run(incremental=state, values=lambda: iter(rows[start:start + 10])))
+    assert result == list(graph.run(values=lambda: iter(rows)))
+
+    with pytest.raises(ValueError):
+        list(algorithms.inverted_index_graph('texts').run(incremental=IncrementalState(str(tmp_path), ['texts']),
+                                                           texts=lambda: iter(PARALLEL_TEXTS)))
+
+
+def test_graph_from_file_workers(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(parallel, 'READ_CHUNK_SIZE', 100)
+    filename = tmp_path / 'texts.txt'
+    # the last line has no line break
+    filename.write_text('\n'.join(json.dumps(row) for row in PARALLEL_TEXTS))
+    expected = list(Graph.graph_from_file(str(filename), json.loads).run())
+
+    assert list(Graph.graph_from_file(str(filename), json.loads, workers=3).run()) == expected
+    rows = Graph.graph_from_file(str(filename), json.loads, workers=3, ordered=False).run()
+    assert sorted(rows, key=itemgetter('doc_id')) == expected
+    assert list(islice(Graph.graph_from_file(str(filename), json.loads, workers=2).run(), 5)) == expected[:5]
+
+    graph = algorithms.word_count_graph('texts', filename=str(filename), read_workers=2)
+    assert list(graph.run()) == list(algorithms.word_count_graph('texts', filename=str(filename)).run())
+
+    (tmp_path / 'empty.txt').write_text('')
+    assert list(Graph.graph_from_file(str(tmp_path / 'empty.txt'), json.loads, workers=2).run()) == []
+
+
+def test_graph_from_file_columns(tmp_path: Path) -> None:
+    filename = tmp_path / 'texts.txt'
+    filename.write_text(''.join(json.dumps(dict(row, url=f'https://example.com/{row["doc_id"]}', meta={'tags': []}))
+                                + '\n' for row in PARALLEL_TEXTS))
+
+    graph = Graph.graph_from_file(str(filename), json.loads, columns=['text', 'doc_id', 'missing'])
+    assert list(graph.run()) == [{'text': row['text'], 'doc_id': row['doc_id']} for row in PARALLEL_TEXTS]
+    assert checkpoint.plan_digest(graph) != checkpoint.plan_digest(
+        Graph.graph_from_file(str(filename), json.loads, columns=['text']))
+
+    for build in [algorithms.word_count_graph, algorithms.inverted_index_graph, algorithms.pmi_graph]:
+        expected = list(build('texts').run(texts=lambda: (dict(row) for row in PARALLEL_TEXTS)))
+        assert list(build('texts', filename=str(filename)).run()) == expected
+
+
+def _check_file_modes(path: Path, write: tp.Callable[[str], tp.Any]) -> None:
+    """A new file gets the permissions open would give it, a replaced file keeps its permissions"""
+    umask = os.umask(0o022)
+    try:
+        write(str(path))
+        assert path.stat().st_mode & 0o777 == 0o644
+        path.chmod(0o640)
+        write(str(path))
+        assert path.stat().st_mode & 0o777 == 0o640
+    finally:
+        os.umask(umask)
+
+
+def test_graph_row_file(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(rowfile, 'BATCH_SIZE', 2)
+    rows = [dict(row) for row in PARALLEL_TEXTS] + [{'doc_id': 100, 'text': 'hello', 'extra': [1, 2]}]
+    for compression in rowfile.COMPRESSIONS:
+        filename = str(tmp_path / f'texts.{compression}')
+        assert rowfile.write(iter(rows), filename, compression) == len(rows)
+        assert list(Graph.graph_from_file(filename).run()) == rows
+    filename = str(tmp_path / 'texts.zlib')
+    projected = Graph.graph_from_file(filename, columns=['extra'])
+    assert list(projected.run()) == [{}] * (len(rows) - 1) + [{'extra': [1, 2]}]
+
+    graph = Graph.graph_from_file(filename).map(ops.Split('text')).sort(['text']).reduce(ops.Count('count'), ['text'])
+    expected = list(graph.run())
+    assert list(graph.run(parallelism=2)) == expected
+    assert list(Graph.graph_from_iter('texts').map(ops.Split('text')).sort(['text']).reduce(
+        ops.Count('count'), ['text']).run(texts=lambda: (dict(row) for row in rows))) == expected
+
+    # a file whose writing was interrupted has the batches written so far (a batch is written before its rows pass)
+    with open(tmp_path / 'partial', 'wb') as f:
+        writer = rowfile.write_stream(iter(rows), f)
+        assert [next(writer) for _ in range(3)] == rows[:3]
+        writer.close()
+    assert list(Graph.graph_from_file(str(tmp_path / 'partial')).run()) == rows[:4]
+
+    _check_file_modes(tmp_path / 'mode.rows', lambda path: rowfile.write(iter(rows), path))
+
+    with pytest.raises(ValueError):
+        Graph.graph_from_file(str(tmp_path / 'partial'), workers=2)
+    (tmp_path / 'texts.txt').write_text('{}\n')
+    with pytest.raises(ValueError):
+        Graph.graph_from_file(str(tmp_path / 'texts.txt'))
+
+
+def test_graph_column_file(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    rows = [dict(row, url=f'https://example.com/{row["doc_id"]}') for row in PARALLEL_TEXTS]
+    rows += [{'doc_id': 100, 'text': 'hello', 'extra': None}, {'doc_id': 101, 'extra': [1, 2]}]
+    filename = str(tmp_path / 'texts.columns')
+    assert columnfile.write(iter(rows), filename, group_size=8) == len(rows)
+    assert list(Graph.graph_from_file(filename).run()) == rows
+    assert list(Graph.graph_from_file(filename, columns=['doc_id', 'extra']).run()) == [
+        {key: row[key] for key in ['doc_id', 'extra'] if key in row} for row in rows]
+
+    # only the chunks of the requested columns of the row groups the ranges do not rule out are read
+    decompressed: list[int] = []
+    decompress = zlib.decompress
+    monkeypatch.setattr(zlib, 'decompress', lambda data: decompressed.append(1) or decompress(data))
+    graph = Graph.graph_from_file(filename, columns=['text'], where={'doc_id': (10, 20)})
+    assert list(graph.run()) == [{'text': row['text']} for row in rows if 10 <= row['doc_id'] <= 20]
+    assert len(decompressed) == 2 * 2
+    monkeypatch.undo()
+    assert [row['doc_id'] for row in Graph.graph_from_file(filename, where={'doc_id': (None, 3)}).run()] == [0, 1, 2, 3]
+
+    texts = Graph.graph_from_file(filename, columns=['text'], where={'text': ('', None)})
+    graph = texts.map(ops.Split('text')).sort(['text']).reduce(ops.Count('count'), ['text'])
+    assert list(graph.run(parallelism=2)) == list(graph.run())
+
+    _check_file_modes(tmp_path / 'mode.columns', lambda path: columnfile.write(iter(rows), path))
+
+    with pytest.raises(ValueError):
+        Graph.graph_from_file(filename, json.loads, where={'doc_id': (0, 1)})
+
+
+def test_graph_write(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(sink, 'WRITE_BATCH_SIZE', 7)
+    graph = Graph.graph_from_iter('texts').map(ops.Split('text')).sort(['text']).reduce(ops.Count('count'), ['text'])
+    expected = list(graph.run(texts=lambda: (dict(row) for row in PARALLEL_TEXTS)))
+
+    for background in [True, False]:
+        stats = graph.write(str(tmp_path / 'counts.jsonl'), background=background,
+                            texts=lambda: (dict(row) for row in PARALLEL_TEXTS))
+        text = (tmp_path / 'counts.jsonl').read_text()
+        assert text == ''.join(json.dumps(row) + '\n' for row in expected)
+        assert (stats.rows, stats.bytes, stats.format) == (len(expected), len(text.encode()), 'jsonl')
+    for format in ['rows', 'columns']:
+        filename = str(tmp_path / f'counts.{format}')
+        assert graph.write(filename, format, texts=lambda: (dict(row) for row in PARALLEL_TEXTS)).rows == len(expected)
+        assert list(Graph.graph_from_file(filename).run()) == expected
+
+    def failing() -> tp.Generator[ops.TRow, None, None]:
+        yield from islice(PARALLEL_TEXTS, 20)
+        raise RuntimeError('source failed')
+
+    # a failed run leaves the previous output as it was, and no temporary files
+    for format in sink.FORMATS:
+        filename = tmp_path / f'counts.{format}'
+        before = filename.read_bytes()
+        with pytest.raises(RuntimeError):
+            graph.write(str(filename), format, texts=failing)
+        assert filename.read_bytes() == before
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['counts.columns', 'counts.jsonl', 'counts.rows']
+    for format in sink.FORMATS:
+        _check_file_modes(tmp_path / f'mode.{format}', lambda path: graph.write(
+            path, format, texts=lambda: (dict(row) for row in PARALLEL_TEXTS)))
+    with pytest.raises(ValueError):
+        graph.write(str(tmp_path / 'counts.csv'), 'csv', texts=lambda: iter(PARALLEL_TEXTS))
+
+
+def test_graph_from_csv(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(ops, 'CSV_CHUNK_SIZE', 3)
+    (tmp_path / 'edges.csv').write_text('edge_id,name,length\n1,"Main St, 1",10.5\n2,"Two\nlines",\n\n3,Third,7\n')
+    expected = [{'edge_id': 1, 'length': 10.5, 'name': 'Main St, 1'},
+                {'edge_id': 2, 'length': None, 'name': 'Two\nlines'},
+                {'edge_id': 3, 'length': 7.0, 'name': 'Third'}]
+    graph = Graph.graph_from_csv(str(tmp_path / 'edges.csv'), {'edge_id': int, 'length': float, 'name': str})
+    assert graph.schema == ('edge_id', 'length', 'name')
+    assert list(graph.run()) == expected
+    assert list(Graph.graph_from_csv(str(tmp_path / 'edges.csv')).run())[0] == {
+        'edge_id': '1', 'name': 'Main St, 1', 'length': '10.5'}
+
+    (tmp_path / 'edges.tsv').write_text('1\tMain\t10.5\n2\tSecond\t3\n')
+    graph = Graph.graph_from_csv(str(tmp_path / 'edges.tsv'), {'edge_id': int, 'name': str}, header=False)
+    assert list(graph.run()) == [{'edge_id': 1, 'name': 'Main'}, {'edge_id': 2, 'name': 'Second'}]
+    assert list(graph.map(ops.Product(['edge_id', 'edge_id'], 'square')).run(batch_size=1)) == [
+        {'edge_id': 1, 'name': 'Main', 'square': 1}, {'edge_id': 2, 'name': 'Second', 'square': 4}]
+    assert list(graph.sort(['name']).run(parallelism=2)) == list(graph.sort(['name']).run())
+
+    with pytest.raises(ValueError):
+        list(Graph.graph_from_csv(str(tmp_path / 'edges.csv'), ['missing']).run())
+    with pytest.raises(ValueError):
+        Graph.graph_from_csv(str(tmp_path / 'edges.tsv'), header=False)
+
+
+def test_graph_from_compressed_file(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(compressed, 'BLOCK_SIZE', 100)
+    monkeypatch.setattr(compressed, 'PENDING_BLOCKS', 2)
+    text = ''.join(json.dumps(row) + '\r\n' for row in PARALLEL_TEXTS)
+    for compress, name in [(gzip.compress, 'texts.gz'), (bz2.compress, 'texts.bz2'), (lzma.compress, 'texts.xz'),
+                           (gzip.compress, 'texts')]:
+        (tmp_path / name).write_bytes(compress(text.encode()))
+        graph = Graph.graph_from_file(str(tmp_path / name), json.loads)
+        assert list(graph.run()) == PARALLEL_TEXTS
+        # the decompressing thread stops when the rows are not read to the end
+        assert list(graph.limit(3).run()) == PARALLEL_TEXTS[:3]
+    with compressed.open_lines(str(tmp_path / 'texts.gz')) as lines:
+        assert list(lines) == [json.dumps(row) + '\n' for row in PARALLEL_TEXTS]
+
+    word_count = algorithms.word_count_graph('texts', filename=str(tmp_path / 'texts.gz'))
+    expected = list(algorithms.word_count_graph('texts').run(texts=lambda: (dict(row) for row in PARALLEL_TEXTS)))
+    assert list(word_count.run()) == expected
+    assert list(word_count.run(parallelism=2)) == expected
+    assert 'rows~50 ' in Graph.graph_from_file(str(tmp_path / 'texts.gz'), json.loads).explain()
+
+    (tmp_path / 'edges.csv.gz').write_bytes(gzip.compress(b'edge_id,name\r\n1,"Two\r\nlines"\r\n2,x\r\n'))
+    assert list(Graph.graph_from_csv(str(tmp_path / 'edges.csv.gz'), {'edge_id': int, 'name': str}).run()) == [
+        {'edge_id': 1, 'name': 'Two\r\nlines'}, {'edge_id': 2, 'name': 'x'}]
+
+    (tmp_path / 'broken.gz').write_bytes(gzip.compress(text.encode())[:-20])
+    with pytest.raises(EOFError):
+        list(Graph.graph_from_file(str(tmp_path / 'broken.gz'), json.loads).run())
+    with pytest.raises(ValueError):
+        Graph.graph_from_file(str(tmp_path / 'texts.gz'), json.loads, workers=2)
+    with pytest.raises(ValueError):
+        list(word_count.run(incremental=IncrementalState(str(tmp_path / 'state'), [str(tmp_path / 'texts.gz')])))
@@ -0,0 +1,60 @@
+import typing as tp
+from operator import itemgetter
+from pathlib import Path
+
+import pytest
+
+from compgraph import algorithms
+from compgraph.index import InvertedIndex
+
+TEXTS = [
+    {'doc_id': doc_id, 'text': ' '.join(f'word{(doc_id * i) % 11} prefix{i % 4}' for i in range(doc_id % 7 + 1))}
+    for doc_id in range(40)
+]
+
+
+def _index_rows(texts: list[dict[str, tp.Any]]) -> list[dict[str, tp.Any]]:
+    return list(algorithms.inverted_index_graph('texts').run(texts=lambda: (dict(row) for row in texts)))
+
+
+def test_index_lookup(tmp_path: Path) -> None:
+    rows = _index_rows(TEXTS)
+
+    with InvertedIndex(str(tmp_path)) as index:
+        assert index.add(rows) == len({row['text'] for row in rows})
+        for word in {row['text'] for row in rows}:
+            assert index.lookup(word) == [row for row in rows if row['text'] == word]
+        assert index.lookup('missing') == []
+        assert list(index.prefix('prefix')) == [row for row in rows if row['text'].startswith('prefix')]
+        assert {row['text'] for row in index.prefix('word', limit=2)} == {'word0', 'word1'}
+
+    # the index is read back from the directory
+    with InvertedIndex(str(tmp_path)) as index:
+        assert index.lookup('word3') == [row for row in rows if row['text'] == 'word3']
+
+        with pytest.raises(ValueError):
+            index.add(reversed(rows))
+
+
+def test_index_segments(tmp_path: Path) -> None:
+    first, second = _index_rows(TEXTS[:20]), _index_rows(TEXTS[20:])
+
+    with InvertedIndex(str(tmp_path), top=None) as index:
+        index.add(first)
+        index.add(second)
+        assert len(index.segments) == 2
+
+        expected = sorted((row for row in first + second if row['text'] == 'word5'), key=itemgetter('tf_idf'),
+                          reverse=True)
+        assert index.lookup('word5') == expected
+        everything = list(index.prefix(''))
+
+        index.merge()
+        assert len(index.segments) == 1
+        assert index.lookup('word5') == expected
+        assert list(index.prefix('')) == everything
+        assert sorted(path.name for path in tmp_path.iterdir()) == ['000002.seg', 'segments.json']
+
+    with InvertedIndex(str(tmp_path)) as index:
+        assert index.lookup('word5') == expected[:3]
+
@@ -1,10 +1,12 @@
 import copy
 import dataclasses
+import time
 import typing as tp
 
 import pytest
 from pytest import approx
 
+from compgraph import batch
 from compgraph import operations as ops
 
 
@@ -274,3 +276,55 @@ def test_reducer(case: ReduceCase) -> None:
     result = ops.Reduce(case.reducer, case.reducer_keys)(iter(case.data))
     assert isinstance(result, tp.Iterator)
     assert sorted(result, key=key_func) == sorted(case.ground_truth, key=key_func)
+
+
+@pytest.mark.parametrize('case', MAP_CASES)
+def test_mapper_batch(case: MapCase) -> None:
+    key_func = _Key(*case.cmp_keys)
+
+    result = batch.from_batches(ops.Map(case.mapper).map_batches(batch.to_batches(copy.deepcopy(case.data), 2)))
+    assert sorted(result, key=key_func) == sorted(case.ground_truth, key=key_func)
+
+
+def test_mapper_batch_exact(monkeypatch: pytest.MonkeyPatch) -> None:
+    # the local clock of Berlin is moved an hour forward at 2022-03-27T02:00, durations are taken between the
+    # datetimes as written (as row by row), and products of integers do not overflow
+    monkeypatch.setenv('TZ', 'Europe/Berlin')
+    time.tzset()
+    rows = [
+        {'start': '20220327T013000', 'end': '20220327T033000', 'count': 2 ** 40},
+        {'start': '2022-03-27T01:30:00', 'end': '2022-03-27T03:30:00.5', 'count': 3},
+    ]
+    mappers = [ops.TimeDiff('hours', 'start', 'end'), ops.HourWeekday('end', 'weekday', 'hour'),
+               ops.Product(['count', 'count'])]
+    try:
+        for mapper in mappers:
+            expected = [row for data in copy.deepcopy(rows) for row in mapper(data)]
+            result = batch.from_batches(ops.Map(mapper).map_batches(batch.to_batches(copy.deepcopy(rows))))
+            assert list(result) == expected
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+
+    sums = ops.Reduce(ops.Sum('count'), ()).reduce_batches(batch.to_batches([{'count': 2 ** 62}] * 4))
+    assert list(sums) == [{'count': 2 ** 64}]
+
+
+def test_joiner_reused_with_other_keys() -> None:
+    # the layouts of joined rows are cached by the joiner, one joiner may serve joins by different keys
+    joiner = ops.InnerJoiner()
+
+    assert list(ops.Join(joiner, ['k', 'x'])(iter([{'k': 1, 'x': 1}]), iter([{'k': 1, 'x': 1}]))) == [{'k': 1, 'x': 1}]
+    assert list(ops.Join(joiner, ['k'])(iter([{'k': 1, 'x': 1}]), iter([{'k': 1, 'x': 2}]))) == [
+        {'k': 1, 'x_1': 1, 'x_2': 2}
+    ]
+
+
+@pytest.mark.parametrize('reducer', [ops.Count('count'), ops.Sum('score'), ops.Mean('score')])
+def test_combining_reducer_batches(reducer: ops.Reducer) -> None:
+    rows = [{'match_id': i // 5, 'player_id': i, 'score': i * 7 % 11} for i in range(23)]
+
+    expected = list(ops.Reduce(reducer, ('match_id',))(copy.deepcopy(rows)))
+    result = ops.Reduce(reducer, ('match_id',)).reduce_batches(batch.to_batches(copy.deepcopy(rows), 3))
+
+    assert list(result) == [approx(row) for row in expected]